@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='collection_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from datetime import date, timedelta
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import AbstractUser
@@ -11,9 +12,47 @@ class User(AbstractUser):
     login_bonus_last_date = models.DateField(null=True, blank=True)
     login_bonus_streak = models.IntegerField(default=0)
 
+    # 所持カードが変わるたびに増やす（コレクション取得の ETag に使う）
+    collection_version = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.username
 
+    def touch_collection(self) -> int:
+        """
+        所持カードが変わったことを記録し、新しいバージョンを返す
+        変更した UserCard の seq にするため、所持カードの変更と同じトランザクションで呼ぶこと
+        """
+        User.objects.filter(pk=self.pk).update(collection_version=models.F('collection_version') + 1)
+        self.collection_version = User.objects.values_list('collection_version', flat=True).get(pk=self.pk)
+        return self.collection_version
+
+    def award_login_bonus(self, today: date) -> int | None:
+        """
+        ログインボーナスを付与し、付与した魔石の数を返す（本日すでに付与済みの場合は None）
+        連続7日目までは「連続日数 x 10個」、8日目以降は毎日100個
+        魔石は F() で加算し、ボーナスのフィールドのみを更新する
+        （読み込んだ後にガチャなどで変わった magic_stones・collection_version を上書きしない）
+        """
+        if self.login_bonus_last_date == today:
+            return None
+
+        # 連続ログインかどうかを判定（前日のボーナス取得があれば継続、なければ1日にリセット）
+        if self.login_bonus_last_date == today - timedelta(days=1):
+            streak = self.login_bonus_streak + 1
+        else:
+            streak = 1
+        bonus = streak * 10 if streak <= 7 else 100
+
+        # 読み込んだ時の最終付与日と一致する場合のみ更新する（同時に受け取っても二重に付与しない）
+        awarded = User.objects.filter(pk=self.pk, login_bonus_last_date=self.login_bonus_last_date).update(
+            magic_stones=models.F('magic_stones') + bonus,
+            login_bonus_streak=streak,
+            login_bonus_last_date=today,
+        )
+        self.refresh_from_db(fields=['magic_stones', 'login_bonus_streak', 'login_bonus_last_date'])
+        return bonus if awarded else None
+
     def get_friends(self):
         # ユーザーのフレンド一覧を取得
         friendships1 = Friendship.objects.filter(user1=self).values_list('user2', flat=True)
@@ -1,3 +1,49 @@
+import datetime
 from django.test import TestCase
+from morisummon.gacha import gacha_tables, pull
+from morisummon.models import Card
+from .models import User
 
-# Create your tests here.
+
+class LoginBonusTests(TestCase):
+    """ログインボーナスは読み込んだ後のガチャなどによる変更を上書きしない"""
+
+    def setUp(self):
+        gacha_tables.invalidate()
+        Card.objects.create(name='card', pack='test')
+        self.user = User.objects.create_user(username='bonus', password='password', magic_stones=100)
+
+    def tearDown(self):
+        gacha_tables.invalidate()
+
+    def test_pull_between_read_and_award(self):
+        # ボーナスを付与する側が読み込んだ後に、別のリクエストでガチャを引く
+        stale = User.objects.get(pk=self.user.pk)
+        puller = User.objects.get(pk=self.user.pk)
+        pull(puller, 'test', 5)
+
+        bonus = stale.award_login_bonus(datetime.date(2026, 1, 1))
+
+        self.user.refresh_from_db()
+        self.assertEqual(bonus, 10)
+        self.assertEqual(self.user.collection_version, puller.collection_version)
+        self.assertEqual(self.user.magic_stones, puller.magic_stones + bonus)
+
+    def test_streak(self):
+        today = datetime.date(2026, 1, 8)
+        User.objects.filter(pk=self.user.pk).update(login_bonus_last_date=today - datetime.timedelta(days=1), login_bonus_streak=7)
+        self.user.refresh_from_db()
+
+        self.assertEqual(self.user.award_login_bonus(today), 100)
+        self.assertEqual(self.user.login_bonus_streak, 8)
+        self.assertIsNone(self.user.award_login_bonus(today))
+        self.assertIsNone(User.objects.get(pk=self.user.pk).award_login_bonus(today))
+        self.assertEqual(User.objects.get(pk=self.user.pk).magic_stones, 200)
+
+    def test_view(self):
+        self.client.force_login(self.user)
+        first = self.client.get('/api/login_bonus/').json()
+        second = self.client.get('/api/login_bonus/').json()
+
+        self.assertEqual(first, {'awarded': True, 'bonus': 10, 'streak': 1})
+        self.assertEqual(second, {'awarded': False})
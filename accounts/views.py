@@ -70,37 +70,18 @@ def register(request):
 
     return Response({'token': str(token)}, status=201)
 
-from datetime import timedelta
 from django.utils import timezone
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def login_bonus(request):
     user = request.user
-    today = timezone.localdate()
-    yesterday = today - timedelta(days=1)
+    bonus = user.award_login_bonus(timezone.localdate())
 
     # すでに本日のボーナスを受け取っている場合は何もしない
-    if user.login_bonus_last_date == today:
+    if bonus is None:
         return Response({'awarded': False})
 
-    # 連続ログインかどうかを判定
-    if user.login_bonus_last_date == yesterday:
-        user.login_bonus_streak += 1
-    else:
-        user.login_bonus_streak = 1
-
-    # ボーナスの計算：
-    # 連続7日目までは「連続日数 x 10個」、8日目以降は毎日100個
-    if user.login_bonus_streak <= 7:
-        bonus = user.login_bonus_streak * 10
-    else:
-        bonus = 100
-
-    user.magic_stones += bonus
-    user.login_bonus_last_date = today
-    user.save()
-
     return Response({
         'awarded': True,
         'bonus': bonus,
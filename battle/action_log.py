@@ -0,0 +1,217 @@
+"""
+バトルの行動ログ（追記のみ）
+
+エンジン（battle.engine）が受け付けた行動と、その結果のイベントを部屋ごとに連番（seq）付きで記録する。
+一定間隔（MORISUMMON_BATTLE_LOG_SNAPSHOT_INTERVAL 行動）と対戦開始時にはバトルルーム全体のスナップショットも残す。
+・1行動ごとの書き込みは小さなエントリの追記のみで、バトルルーム全体は書き込まない
+・バトルルームは反映済みの seq（BattleRoom.log_seq）を持ち、最後の書き出し以降の行動はログから再生して復元できる
+  （プロセスが落ちてメモリ上の変更が MongoDB に書き出されなかった場合など）
+・データは msgpack で保存する
+"""
+import datetime
+import logging
+from dataclasses import dataclass
+from typing import Iterator
+import msgpack
+from channels.db import database_sync_to_async
+from django.conf import settings
+from pymongo.errors import BulkWriteError
+from battle import engine
+from battle.models import BattleLogEntry, BattleLogEntryKind
+from battle.state import BattleRoomState
+
+logger = logging.getLogger(__name__)
+
+
+def pack(value) -> bytes:
+    return msgpack.packb(value, use_bin_type=True, datetime=False, default=_pack_default)
+
+
+def unpack(data: bytes):
+    return msgpack.unpackb(data, raw=False, timestamp=3, strict_map_key=False)
+
+
+def _pack_default(value):
+    if isinstance(value, datetime.datetime):
+        # MongoDB と同じく、タイムゾーンの無い日時は UTC として扱う
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _unpack_snapshot(data: bytes) -> BattleRoomState:
+    son = unpack(data)
+    for key, value in son.items():
+        if isinstance(value, datetime.datetime):
+            # pymongo が返すのと同じタイムゾーンの無い UTC に戻す
+            son[key] = value.replace(tzinfo=None)
+    return BattleRoomState.from_son(son)
+
+
+@dataclass(slots=True)
+class LogEntry:
+    room_id: str
+    seq: int
+    kind: BattleLogEntryKind
+    data: bytes
+    finished: bool = False
+
+    def to_son(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "seq": self.seq,
+            "kind": self.kind.value,
+            "data": self.data,
+            "finished": self.finished,
+            "created_at": datetime.datetime.now(datetime.timezone.utc),
+        }
+
+    def decode(self) -> dict:
+        """書き出し用の dict（data を展開したもの）"""
+        data = unpack(self.data)
+        return {"room_id": self.room_id, "seq": self.seq, "kind": self.kind.value, "finished": self.finished, "data": data}
+
+    @classmethod
+    def from_son(cls, son: dict) -> "LogEntry":
+        return cls(
+            room_id=son["room_id"],
+            seq=son["seq"],
+            kind=BattleLogEntryKind(son["kind"]),
+            data=bytes(son["data"]),
+            finished=son.get("finished", False),
+        )
+
+
+class ActionLog:
+    """
+    バトルの行動ログ
+    ・record() は状態の log_seq を進めて記録するエントリを作るだけ（保存が確定してから append() で書き込む）
+    ・recover() は MongoDB から読み込んだバトルルームに、反映されていない行動を再生する
+    """
+
+    def __init__(self, enabled: bool | None = None, snapshot_interval: int | None = None):
+        self._enabled = enabled
+        self._snapshot_interval = snapshot_interval
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is not None:
+            return self._enabled
+        return getattr(settings, "MORISUMMON_BATTLE_LOG_ENABLED", False)
+
+    @property
+    def snapshot_interval(self) -> int:
+        if self._snapshot_interval is not None:
+            return self._snapshot_interval
+        return getattr(settings, "MORISUMMON_BATTLE_LOG_SNAPSHOT_INTERVAL", 20)
+
+    def record(self, room: BattleRoomState, action: dict, events: list[dict]) -> list[LogEntry]:
+        """エンジンが受け付けた行動を記録するエントリを返す（room.log_seq を進める）"""
+        if not self.enabled:
+            return []
+
+        finished = engine.is_finished(room)
+        room.log_seq += 1
+        entries = [LogEntry(
+            room_id=room.id,
+            seq=room.log_seq,
+            kind=BattleLogEntryKind.ACTION,
+            data=pack({"action": action, "events": events}),
+            finished=finished,
+        )]
+
+        # 対戦開始時（開始前の状態はログに無い）と一定間隔でスナップショットを残す
+        if action["type"] == "battle.start" or room.log_seq % self.snapshot_interval == 0:
+            entries.append(self.snapshot(room))
+        return entries
+
+    def snapshot(self, room: BattleRoomState) -> LogEntry:
+        """バトルルーム全体のスナップショットのエントリを返す（room.log_seq を進める）"""
+        room.log_seq += 1
+        return LogEntry(
+            room_id=room.id,
+            seq=room.log_seq,
+            kind=BattleLogEntryKind.SNAPSHOT,
+            data=pack(room.to_son()),
+            finished=engine.is_finished(room),
+        )
+
+    async def append(self, entries: list[LogEntry]) -> None:
+        if entries:
+            await database_sync_to_async(self._append)(entries)
+
+    def _append(self, entries: list[LogEntry]) -> None:
+        try:
+            BattleLogEntry._get_collection().insert_many([entry.to_son() for entry in entries], ordered=True)
+        except BulkWriteError as e:
+            # 同じ seq がすでにある（別のノードが同じ部屋を更新した）。書き出し時の競合で部屋は読み直される
+            logger.warning(f"行動ログの追記が競合しました: {e.details.get('writeErrors', [])[:1]}")
+
+    async def recover(self, room: BattleRoomState) -> BattleRoomState | None:
+        """
+        room に反映されていない行動をログから再生した状態を返す（反映済みの場合は None）
+        途中にスナップショットがある場合は最後のスナップショットから再生する
+        """
+        if not self.enabled:
+            return None
+        entries = await database_sync_to_async(self._entries_after)(room.id, room.log_seq)
+        if not entries:
+            return None
+        return self._replay(room, entries)
+
+    async def load(self, room_id: str) -> BattleRoomState | None:
+        """最後のスナップショットとそれ以降の行動からバトルルームを復元する（ログが無い場合は None）"""
+        return await database_sync_to_async(self.load_sync)(room_id)
+
+    def load_sync(self, room_id: str) -> BattleRoomState | None:
+        collection = BattleLogEntry._get_collection()
+        snapshot = collection.find_one(
+            {"room_id": room_id, "kind": BattleLogEntryKind.SNAPSHOT.value},
+            sort=[("seq", -1)],
+        )
+        if snapshot is None:
+            return None
+        room = _unpack_snapshot(snapshot["data"])
+        entries = self._entries_after(room_id, snapshot["seq"])
+        return self._replay(room, entries) if entries else room
+
+    def iter_entries(self, room_id: str, batch_size: int = 500) -> Iterator[LogEntry]:
+        """部屋の行動ログを seq 順に少しずつ読み込みながら返す"""
+        cursor = BattleLogEntry._get_collection().find({"room_id": room_id}).sort("seq", 1).batch_size(batch_size)
+        for son in cursor:
+            yield LogEntry.from_son(son)
+
+    def finished_room_ids(self) -> list[str]:
+        """決着した対戦の部屋の id"""
+        return BattleLogEntry._get_collection().distinct("room_id", {"finished": True})
+
+    def _entries_after(self, room_id: str, seq: int) -> list[LogEntry]:
+        cursor = BattleLogEntry._get_collection().find({"room_id": room_id, "seq": {"$gt": seq}}).sort("seq", 1)
+        return [LogEntry.from_son(son) for son in cursor]
+
+    @staticmethod
+    def _replay(room: BattleRoomState, entries: list[LogEntry]) -> BattleRoomState:
+        # 最後のスナップショット以降だけを再生する
+        start = 0
+        for i, entry in enumerate(entries):
+            if entry.kind == BattleLogEntryKind.SNAPSHOT:
+                start = i
+
+        if entries[start].kind == BattleLogEntryKind.SNAPSHOT:
+            state = _unpack_snapshot(entries[start].data)
+            # 楽観的排他制御のバージョンと、エンジンの外で更新される接続情報は MongoDB 上のものを引き継ぐ
+            state.version = room.version
+            for key in ("player1", "player2"):
+                if getattr(room, key) and getattr(state, key):
+                    getattr(state, key).info = getattr(room, key).info.copy()
+            start += 1
+        else:
+            state = room.copy()
+
+        for entry in entries[start:]:
+            state, _ = engine.apply_internal(state, unpack(entry.data)["action"])
+        state.log_seq = entries[-1].seq
+        return state
+
+action_log = ActionLog()
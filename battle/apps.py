@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BattleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'battle'
+
+    def ready(self):
+        import battle.signals
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from morisummon.models import Card
+
+logger = logging.getLogger(__name__)
+
+
+def battle_card_template(card: Card) -> dict:
+    """Card から BattleCardInfo の初期値を作る"""
+    return {
+        "id": str(card.id),
+        "name": card.name,
+        "image": card.image.url if card.image else None,
+        "energy": 0,
+        "attack_needs_energy": card.attack_cost,
+        "escape_needs_energy": card.retreat_cost,
+        "hp": card.hp,          # 現在HP
+        "max_hp": card.hp,      # 最大HPとして初期HPを設定
+        "attack": card.attack,
+    }
+
+
+class CardCatalog:
+    """
+    プロセス全体で共有するカードカタログ
+    ・全ての Card を1度だけ読み込み、BattleCardInfo のひな形を id ごとに保持する
+    ・デッキの初期化はひな形からのコピーのみで行い、DB にはアクセスしない
+    ・Card の保存・削除時にはシグナル（battle.signals）から invalidate() が呼ばれ、次回読み込み直す
+    """
+
+    def __init__(self):
+        self._templates: dict[int, dict] | None = None
+        self._generation = 0
+        self._lock: asyncio.Lock | None = None
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._templates = None
+
+    async def get_templates(self) -> dict[int, dict]:
+        templates = self._templates
+        if templates is not None:
+            return templates
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # 対戦開始が集中しても読み込みは1回にまとめる
+        async with self._lock:
+            if self._templates is None:
+                generation = self._generation
+                templates = await database_sync_to_async(self._load)()
+                # 読み込み中に Card が更新された場合は保持しない（次回読み込み直す）
+                if generation == self._generation:
+                    self._templates = templates
+                return templates
+            return self._templates
+
+    def _load(self) -> dict[int, dict]:
+        templates = {card.id: battle_card_template(card) for card in Card.objects.all()}
+        logger.debug(f"Loaded {len(templates)} cards into the battle card catalog")
+        return templates
+
+
+card_catalog = CardCatalog()
@@ -0,0 +1,41 @@
+"""
+バトルの WebSocket メッセージの符号化方式
+
+接続時のサブプロトコルで選ぶ（指定が無い場合は従来通り JSON のテキストフレーム）
+・morisummon.msgpack: 送受信ともバイナリフレームの msgpack
+  （キーを番号に置き換える方式は、置き換えのためにメッセージ全体を作り直す分だけ JSON より遅くなるため扱わない）
+"""
+import json
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "morisummon.msgpack"
+
+
+class JsonCodec:
+    """JSON のテキストフレーム（既定）"""
+    binary = False
+
+    def encode(self, content: dict) -> str:
+        return json.dumps(content)
+
+    def decode(self, data: str) -> dict:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """msgpack のバイナリフレーム"""
+    binary = True
+
+    def encode(self, content: dict) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+    def decode(self, data: bytes) -> dict:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+JSON_CODEC = JsonCodec()
+
+# サブプロトコル -> 符号化方式
+CODECS: dict[str, JsonCodec | MsgpackCodec] = {
+    MSGPACK_SUBPROTOCOL: MsgpackCodec(),
+}
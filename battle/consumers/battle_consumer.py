@@ -1,21 +1,35 @@
 from abc import ABC, abstractmethod
 import logging
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from mongoengine.errors import NotUniqueError
 from django.contrib.auth.models import AnonymousUser
 from accounts.models import User
-from battle.consumers.mixins.actions_battle_mixin import BattleActionsMixin
 from battle.consumers.mixins.actions_preparing_mixin import BattlePreparingActionsMixin
 from battle.consumers.mixins.db_mixin import BattleDBMixin
 from battle.consumers.mixins.event_mixin import BattleEventMixin
 from battle.consumers.mixins.helpers_mixin import BattleHelpersMixin
-from battle.consumers.mixins.actions_energy_mixin import BattleEnergyMixin
+from battle.consumers.mixins.engine_mixin import BattleEngineMixin
+from battle.consumers.mixins.unit_of_work_mixin import BattleUnitOfWorkMixin
+from battle.consumers.mixins.protocol_mixin import BattleProtocolMixin
+from battle import engine
 from battle.models import BattleRoom
+from battle.state import BattleRoomState
+from battle.locks import room_locks, RoomLockTimeout
+from battle.reaper import room_reaper
+from battle.store import BattleRoomConflict
+from morisummon.metrics import metrics
 from .mixins import *
 
 
 logger = logging.getLogger(__name__)
 
-class BattleConsumer(AsyncJsonWebsocketConsumer, BattleDBMixin, BattleEventMixin, BattleHelpersMixin, BattleActionsMixin, BattlePreparingActionsMixin, BattleEnergyMixin):
+# 同じ部屋への同時操作が競合した場合の再試行回数
+ROOM_CONFLICT_RETRIES = 3
+
+# エンジン以外で処理するメッセージ（計測する名前に使う）
+PROTOCOL_MESSAGES = ("chat.message", "protocol.delta", "battle.resync")
+
+class BattleConsumer(AsyncJsonWebsocketConsumer, BattleUnitOfWorkMixin, BattleDBMixin, BattleEventMixin, BattleHelpersMixin, BattleProtocolMixin, BattleEngineMixin, BattlePreparingActionsMixin):
     room_id: str
     room_slug: str
     user: User | AnonymousUser = None
@@ -37,18 +51,24 @@ class BattleConsumer(AsyncJsonWebsocketConsumer, BattleDBMixin, BattleEventMixin
             await self.close()
             return
 
-        try:
-            room = await self.get_room()
-            await self._join_room(room)
-        except BattleRoom.DoesNotExist:
-            await self._create_new_room()
+        # 同じ slug に同時に接続しても部屋が二重に作られないようロックする
+        async with room_locks.lock(self.room_slug):
+            try:
+                room = await self.get_room()
+                await self._join_room(room)
+            except BattleRoom.DoesNotExist:
+                try:
+                    await self._create_new_room()
+                except NotUniqueError:
+                    # 別のノードが同じ slug の部屋を先に作成していた
+                    await self._join_room(await self.get_room())
 
         if not self.room_id:
             await self.close()
             return
 
         await self.channel_layer.group_add(f"battle_rooms_{self.room_id}", self.channel_name)
-        await self.accept()
+        await self.accept(self._negotiate_subprotocol())
 
         await self._send_battle_update()
 
@@ -58,66 +78,97 @@ class BattleConsumer(AsyncJsonWebsocketConsumer, BattleDBMixin, BattleEventMixin
             return
 
         await self.channel_layer.group_discard(f"battle_rooms_{self.room_id}", self.channel_name)
-        room = await self.get_room()
 
-        if not room.winner:
-            if room.player1:
-                channel_name = room.player1.info.channel_name
-                await self.channel_layer.send(channel_name, {
-                    "type": "error",
-                    "message": "相手が切断しました"
-                })
-            if room.player2:
-                channel_name = room.player2.info.channel_name
-                await self.channel_layer.send(channel_name, {
-                    "type": "error",
-                    "message": "相手が切断しました"
-                })
+        async with room_locks.lock(self.room_slug):
+            try:
+                room = await self.get_room()
+            except BattleRoom.DoesNotExist:
+                # 相手の切断などですでに削除されている
+                return
+
+            if str(self.user.id) not in room.player_map:
+                # 満員で参加できなかった
+                return
 
-        await self.delete_room(self.room_id)
+            if room.winner or room_reaper.grace <= 0:
+                # 決着済み（または猶予期間なし）の場合はすぐに削除する
+                if not room.winner:
+                    await self._notify_opponent(room, "error", "相手が切断しました")
+                await self.delete_room(self.room_id)
+                return
+
+            # 猶予期間内の再接続（_rejoin_room）を待ち、期限が過ぎたら battle.reaper が削除する
+            await self._set_player_connection_status(room, False)
+            await self.save_room(room, flush=True)
+            await self._notify_opponent(room, "warning", "相手の接続が切れました。再接続を待っています...")
+            await self._send_battle_update(room)
+            room_reaper.schedule(room.id, room.slug)
+
+    async def _notify_opponent(self, room: BattleRoomState, message_type: str, message: str):
+        opponent = self.get_opponent(room, self.user)
+        if opponent and opponent.info.is_connected:
+            await self.channel_layer.send(opponent.info.channel_name, {
+                "type": message_type,
+                "message": message
+            })
+
+    # 送受信は選ばれた符号化方式（battle.codecs）で行う
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.codec.binary:
+            await self.receive_json(self.codec.decode(bytes_data), **kwargs)
+        else:
+            await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
+    async def send_json(self, content, close=False):
+        await self._send_frame(content, close)
 
     # Websocket メッセージ受信時の処理
     async def receive_json(self, content, **kwargs):
+        # アクションの種類ごとに計測する（morisummon.metrics）
         request_type = content.get("type")
-        if request_type == "chat.message":
-            # (既存の処理)
-            pass
-        elif request_type == "action.pass":
-            await self._action_pass_turn()
-        elif request_type == "action.end_turn":
-            forced = content.get("forced", False)
-            await self._action_end_turn(forced)
-        elif request_type == "action.assign_energy":
-            card_id = content.get("card_id")
-            await self._action_assign_energy(card_id)
-        elif request_type == "action.place_card":
-            card_index = content.get("card_index")
-            to_field = content.get("to_field")
-            await self._action_place_card(card_index, to_field)
-        elif request_type == "action.setup_complete":
-            await self._action_setup_complete()
-        # 新規分岐
-        elif request_type == "action.attack":
-            target_type = content.get("targetType")
-            logger.debug("攻撃アクション受信: %s", content)
-            if target_type == "battleCard":
-                await self._action_attack_battle_card()
-            else:
-                await self._action_attack(content)
-        elif request_type == "action.escape":
-            bench_index = content.get("bench_index")
-            logger.debug(f"逃げアクション bench_index: {bench_index}")
-            if bench_index is not None:
-                await self._action_escape(bench_index)
-            else:
+        if request_type not in engine.HANDLERS and request_type not in PROTOCOL_MESSAGES:
+            request_type = "unknown"
+
+        with metrics.track("ws", f"battle:{request_type}") as timer:
+            # 同じ部屋の操作は1つずつ順番に処理する（別の部屋とは並行して処理される）
+            try:
+                async with room_locks.lock(self.room_slug):
+                    timer.error = not await self._receive_action(content)
+            except RoomLockTimeout:
+                timer.error = True
                 await self.send_json({
                     "type": "error",
-                    "message": "bench_index が指定されていません"
+                    "message": "サーバーが混み合っています。もう一度お試しください"
                 })
-        elif request_type == "action.surrender":
-            await self._action_surrender()
+
+    async def _receive_action(self, content) -> bool:
+        # 他の操作と競合した場合は最新の状態を読み直してアクションをやり直す
+        for attempt in range(ROOM_CONFLICT_RETRIES):
+            try:
+                # 1メッセージにつき保存1回・battle.update 1回にまとめる
+                async with self.unit_of_work():
+                    await self._dispatch_action(content)
+                return True
+            except BattleRoomConflict as e:
+                logger.info(f"Conflict on {e.room_id}, retrying ({attempt + 1}/{ROOM_CONFLICT_RETRIES})")
+
+        await self.send_json({
+            "type": "error",
+            "message": "他の操作と競合しました。もう一度お試しください"
+        })
+        return False
+
+    async def _dispatch_action(self, content):
+        request_type = content.get("type")
+        if request_type == "chat.message":
+            # (既存の処理)
+            pass
+        elif request_type == "protocol.delta":
+            # 差分配信（battle.patch）の有効・無効を切り替える
+            self._set_delta_mode(bool(content.get("enabled", True)))
+            await self._resync_battle_state()
+        elif request_type == "battle.resync":
+            await self._resync_battle_state()
         else:
-            await self.send_json({
-                "type": "error",
-                "message": "不明なアクションです"
-            })
+            # ゲームのルールに関するアクションはエンジン（battle.engine）で処理する
+            await self._apply_action(content)
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from battle.matchmaking import matchmaking, Match, MatchTicket, get_match_deck, get_match_bucket, DECK_NOT_READY_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+
+class MatchmakingConsumer(AsyncJsonWebsocketConsumer):
+    """
+    対戦相手を探す WebSocket（ws/battle/find/）
+    ・接続するとマッチングの待ち行列に並び、相手が見つかると match.found で部屋の slug を送って切断する
+    ・相手を待っている間は match.waiting を送る
+    ・切断すると待ち行列から取り除く
+    """
+    ticket: MatchTicket | None = None
+    _wait_task: asyncio.Task | None = None
+
+    async def connect(self):
+        user = self.scope["user"]
+        await self.accept()
+
+        if user.is_anonymous:
+            await self._send_error("ログインしてください")
+            return
+
+        deck = await get_match_deck(user)
+        if deck is None:
+            await self._send_error(DECK_NOT_READY_MESSAGE)
+            return
+
+        self.ticket, match = await matchmaking.join(user.id, await get_match_bucket(deck))
+        if match:
+            await self._send_match(match)
+            return
+
+        await self.send_json({"type": "match.waiting"})
+        self._wait_task = asyncio.create_task(self._wait_for_match())
+
+    async def disconnect(self, close_code):
+        if self._wait_task:
+            self._wait_task.cancel()
+        if self.ticket:
+            await matchmaking.cancel(self.ticket)
+
+    async def receive_json(self, content, **kwargs):
+        # クライアントから送るメッセージは無い
+        pass
+
+    async def _wait_for_match(self):
+        match = await matchmaking.wait(self.ticket)
+        if match:
+            await self._send_match(match)
+        else:
+            # 同じユーザーが別の画面から並び直した場合など
+            await self._send_error("マッチングが取り消されました")
+
+    async def _send_match(self, match: Match):
+        logger.info(f"Matched {match.players[0]} vs {match.players[1]} in {match.slug}")
+        self.ticket = None
+        await self.send_json({"type": "match.found", "slug": match.slug})
+        await self.close()
+
+    async def _send_error(self, message: str):
+        await self.send_json({"type": "error", "message": message})
+        await self.close()
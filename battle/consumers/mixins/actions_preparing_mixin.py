@@ -1,20 +1,19 @@
-import json
 import logging
 from random import shuffle
 from ulid import ULID
 from channels.db import database_sync_to_async
-from morisummon.utils import dictutil
-from battle.models import (
-    BattleRoom,
-    PlayerSet,
-    BattlePlayerInfo,
-    BattlePlayerStatus,
-    BattleCardInfo
+from battle.state import (
+    BattleRoomState,
+    PlayerSetState,
+    BattlePlayerInfoState,
+    BattlePlayerStatusState,
 )
+from battle.card_catalog import card_catalog, battle_card_template
+from battle.reaper import room_reaper
 from .base import BaseMixin
 
 # Djangoモデル（別アプリ）のインポート
-from morisummon.models import Card, Deck
+from morisummon.models import Deck
 
 logger = logging.getLogger(__name__)
 
@@ -28,11 +27,11 @@ class BattlePreparingActionsMixin(BaseMixin):
         self.room_id = str(ULID())
         self.opponent_id = None
 
-        room_data = BattleRoom(
+        room_data = BattleRoomState(
             id=self.room_id,
             slug=self.room_slug,
-            player1=PlayerSet(
-                info=BattlePlayerInfo(
+            player1=PlayerSetState(
+                info=BattlePlayerInfoState(
                     id=str(self.user.id),
                     name=self.user.username,
                     avatar=None,
@@ -40,27 +39,41 @@ class BattlePreparingActionsMixin(BaseMixin):
                     is_connected=True,
                     channel_name=self.channel_name
                 ),
-                status=BattlePlayerStatus()
+                status=BattlePlayerStatusState()
             ),
             player_map={str(self.user.id): "player1"},
             turn_player_id=None,  # ターン開始前
             status="setup"        # セットアップフェーズ
         )
-        room_data.save()
+        await self.create_room(room_data)
 
-    async def _is_user_joined(self, room: BattleRoom):
+    async def _is_user_joined(self, room: BattleRoomState):
         """ユーザーが既に参加しているか確認する"""
         p1id = room.player1.info.id
         p2id = room.player2.info.id if room.player2 else None
         return str(self.user.id) in [p1id, p2id]
 
-    async def _rejoin_room(self, room: BattleRoom):
-        """再接続する"""
+    async def _rejoin_room(self, room: BattleRoomState):
+        """
+        再接続する
+        切断後の猶予期間内（battle.reaper）であれば、新しいチャネルで対戦を再開する
+        """
         self.room_id = room.id
         await self._set_player_connection_status(room, True)
-        await self.save_room(room)
+        self.get_player(room, self.user).info.channel_name = self.channel_name
+        await self.save_room(room, flush=True)
+
+        if all(player.info.is_connected for player in (room.player1, room.player2) if player):
+            room_reaper.cancel(room.id)
+
+        opponent = self.get_opponent(room, self.user)
+        if opponent and opponent.info.is_connected:
+            await self._send_channel_message(opponent.info.channel_name, {
+                "type": "info",
+                "message": "相手が再接続しました"
+            })
 
-    async def _join_room(self, room: BattleRoom):
+    async def _join_room(self, room: BattleRoomState):
         """既存のバトルルームに参加する"""
         self.room_id = room.id
 
@@ -78,8 +91,8 @@ class BattlePreparingActionsMixin(BaseMixin):
             await self.close()
             return
 
-        room.player2 = PlayerSet(
-            info=BattlePlayerInfo(
+        room.player2 = PlayerSetState(
+            info=BattlePlayerInfoState(
                 id=str(self.user.id),
                 name=self.user.username,
                 avatar=None,
@@ -87,41 +100,29 @@ class BattlePreparingActionsMixin(BaseMixin):
                 is_connected=True,
                 channel_name=self.channel_name
             ),
-            status=BattlePlayerStatus()
+            status=BattlePlayerStatusState()
         )
         room.player_map[str(self.user.id)] = "player2"
-        await self.save_room(room)
+        # マッチングは MongoDB 上の player2 を参照するため即時書き込み
+        await self.save_room(room, flush=True)
         await self._start_battle(room)
 
-    async def _start_battle(self, room: BattleRoom):
+    async def _start_battle(self, room: BattleRoomState):
         """
         バトル開始前の準備:
-         ・各プレイヤーのデッキ情報を取得し、シャッフル後に初期ドロー（3枚）を実施
+         ・各プレイヤーのデッキ情報を取得してシャッフルし、エンジンで初期ドロー（3枚）を実施
          ・クライアントにはセットアップフェーズのUIを表示
         """
-        room.status = "setup"
-        await self._initialize_deck_and_draw(room)
-        await self.save_room(room)
-        await self._send_battle_update()
-
-    async def _initialize_deck_and_draw(self, room: BattleRoom):
-        """
-        各プレイヤーの Django モデルの Deck を取得し、
-        シャッフル後に BattleCardInfo に変換して _deck_cards にセット、
-        その後、初期ドロー（3枚）を _hand_cards に移す。
-        """
-        # player1 の処理
-        if room.player1:
-            deck_obj = await self._get_user_deck(room.player1.info.id)
-            if deck_obj:
-                await self._set_deck_cards(room.player1, deck_obj)
-                self._draw_cards(room.player1, 3)
-        # player2 の処理
-        if room.player2:
-            deck_obj = await self._get_user_deck(room.player2.info.id)
+        decks = {}
+        for key in ("player1", "player2"):
+            player: PlayerSetState = getattr(room, key)
+            if not player:
+                continue
+            deck_obj = await self._get_user_deck(player.info.id)
             if deck_obj:
-                await self._set_deck_cards(room.player2, deck_obj)
-                self._draw_cards(room.player2, 3)
+                decks[key] = await self._deck_card_templates(deck_obj)
+
+        await self._apply_server_action(room, {"type": "battle.start", "decks": decks}, flush=True)
 
     @database_sync_to_async
     def _get_user_deck(self, user_id: str):
@@ -137,193 +138,25 @@ class BattlePreparingActionsMixin(BaseMixin):
             logger.error(f"Deck取得エラー user_id {user_id}: {e}")
             return None
 
-    async def _set_deck_cards(self, player: PlayerSet, deck: Deck):
+    async def _deck_card_templates(self, deck: Deck) -> list[dict]:
         """
-        Deck.card_ids から Card 情報を取得し、BattleCardInfo に変換して
-        プレイヤーの status._deck_cards にセットする
+        Deck.card_ids をシャッフルし、各カードの初期値（battle.card_catalog.battle_card_template）のリストにする
+        ※カード情報はプロセス内のカードカタログ（battle.card_catalog）から取得し、DB にはアクセスしない
         """
-        player.status._deck_cards = []
+        templates = await card_catalog.get_templates()
         card_data_list = deck.card_ids  # ここは int のリストの場合も、Card オブジェクトの場合もある
         shuffled_cards = list(card_data_list)
         shuffle(shuffled_cards)
+        deck_cards = []
         for card_data in shuffled_cards:
             if not card_data:
                 continue
-            # card_data が整数の場合は DB から取得、そうでなければ Card インスタンスと仮定
+            # card_data が整数の場合はカタログから取得、そうでなければ Card インスタンスと仮定
             if isinstance(card_data, int):
-                try:
-                    card_obj = await database_sync_to_async(Card.objects.get)(id=card_data)
-                except Card.DoesNotExist:
+                template = templates.get(card_data)
+                if template is None:
                     continue
             else:
-                card_obj = card_data  # 既に Card オブジェクトの場合
-            bc = BattleCardInfo(
-                id=str(card_obj.id),
-                name=card_obj.name,
-                image=card_obj.image.url if card_obj.image else None,
-                energy=0,
-                attack_needs_energy=card_obj.attack_cost,
-                escape_needs_energy=card_obj.retreat_cost,
-                hp=card_obj.hp,         # 現在HP
-                max_hp=card_obj.hp,      # 追加：最大HPとして初期HPを設定
-                attack=card_obj.attack
-            )
-            player.status._deck_cards.append(bc)
-
-
-    def _draw_cards(self, player: PlayerSet, count: int = 1):
-        """
-        プレイヤーの _deck_cards から指定枚数を取り出し、_hand_cards に追加する
-        """
-        if not player.status._deck_cards:
-            return
-        if not player.status._hand_cards:
-            player.status._hand_cards = []
-        for _ in range(count):
-            if not player.status._deck_cards:
-                break
-            card = player.status._deck_cards.pop(0)
-            player.status._hand_cards.append(card)
-        player.status.hand_cards_count = len(player.status._hand_cards)
-
-    async def _action_place_card(self, card_index: int, to_field: str):
-        """
-        手札から指定のカードを取り出し、指定されたフィールドに配置するアクション。
-        セットアップフェーズでは誰でも配置可能、対戦フェーズでは自分のターンのみ配置可能とする。
-        """
-        from battle.models import BattleRoomStatus
-        room: BattleRoom = await self.get_room()
-        user = await self.get_user()
-        player = self.get_player(room, user)
-
-        # セットアップフェーズの場合はターンチェックをスキップする
-        if room.status != BattleRoomStatus.SETUP and room.turn_player_id != str(player.info.id):
-            await self.send_json({
-                "type": "warning",
-                "message": "自分のターンではありません"
-            })
-            return
-
-        hand = player.status._hand_cards or []
-        if card_index < 0 or card_index >= len(hand):
-            await self.send_json({
-                "type": "error",
-                "message": "指定された手札のカードが存在しません。"
-            })
-            return
-
-        card = hand.pop(card_index)
-
-        # ベンチ配置の場合（"bench" または "bench-0" 等）
-        if to_field == "bench" or to_field.startswith("bench-"):
-            # 最大ベンチ数（bench_cards_max）を取得（なければ 2 枚とする）
-            max_bench = player.status.bench_cards_max or 2
-            current_bench = player.status.bench_cards or []
-            if len(current_bench) >= max_bench:
-                await self.send_json({
-                    "type": "error",
-                    "message": "ベンチが満杯です"
-                })
-                # カードを元に戻す
-                hand.insert(card_index, card)
-                return
-            # ※もし "bench-<index>" で特定の位置に配置したい場合は、index の取得処理を追加可能
-            # ここでは単純に末尾に追加する
-            current_bench.append(card)
-            player.status.bench_cards = current_bench
-
-        # メインカード配置の場合
-        elif to_field == "battle_card" or to_field.startswith("main"):
-            if player.status.battle_card:
-                await self.send_json({
-                    "type": "warning",
-                    "message": "すでにメインカードが配置されています。"
-                })
-                # カードを元に戻す
-                hand.insert(card_index, card)
-                return
-            player.status.battle_card = card
-
-        else:
-            # どの条件にも合致しない場合
-            hand.insert(card_index, card)
-            await self.send_json({
-                "type": "error",
-                "message": "無効な配置先です。"
-            })
-            return
-
-        player.status.hand_cards_count = len(hand)
-        await self.save_room(room)
-        await self._send_battle_update()
-
-    async def _action_setup_complete(self):
-        """
-        ユーザーが初期配置完了を宣言するアクション
-        ※少なくとも1枚はカードを配置していることが必要
-        ※両者完了している場合、room.status を IN_PROGRESS に変更し、ターン開始処理を実行する
-        ※すでに準備完了中の場合は操作をブロックする
-        """
-        from battle.models import BattleRoomStatus
-
-        room: BattleRoom = await self.get_room()
-        user = await self.get_user()
-        player = self.get_player(room, user)
-
-        # すでに準備完了中の場合は操作をブロック
-        if getattr(player.status, "setup_done", False):
-            await self.send_json({
-                "type": "warning",
-                "message": "準備完了中には操作できません"
-            })
-            return
-
-        if room.status != BattleRoomStatus.SETUP:
-            await self.send_json({
-                "type": "warning",
-                "message": "現在はセットアップフェーズではありません。"
-            })
-            return
-
-        if not player.status.battle_card and not player.status.bench_cards:
-            await self.send_json({
-                "type": "warning",
-                "message": "少なくとも1枚はカードを配置してください。"
-            })
-            return
-
-        # 自分の準備完了フラグを立てる
-        player.status.setup_done = True
-        await self.save_room(room)
-
-        # 再取得して最新の状態にする
-        room = await self.get_room()
-        opponent = self.get_opponent(room, user)
-
-        # デバッグ用ログ出力
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.debug(f"Player {player.info.id} setup_done: {player.status.setup_done}")
-        logger.debug(f"Opponent {opponent.info.id if opponent else 'None'} setup_done: {getattr(opponent.status, 'setup_done', False)}")
-
-        # 相手の準備完了フラグが立っている場合、対戦開始フェーズに移行
-        if opponent and getattr(opponent.status, "setup_done", False):
-            room.status = BattleRoomStatus.IN_PROGRESS
-            room.turn_player_id = room.player1.info.id  # 例：player1 を先行とする
-            await self.save_room(room)
-            await self._start_new_turn(room, room.player1)
-        else:
-            await self.send_json({
-                "type": "warning",
-                "message": "相手の配置完了を待っています..."
-            })
-
-        await self._send_battle_update()
-
-    async def _start_new_turn(self, room: BattleRoom, player: PlayerSet):
-        """
-        ターン開始時の処理：カードを1枚ドローする
-        """
-        self._draw_cards(player, 1)
-        await self.save_room(room)
-        await self._send_battle_update()
+                template = battle_card_template(card_data)  # 既に Card オブジェクトの場合
+            deck_cards.append(template)
+        return deck_cards
@@ -1,52 +1,59 @@
 from typing import Literal
 from channels.db import database_sync_to_async
 from accounts.models import User
-from battle.models import BattleRoom
+from battle.state import BattleRoomState, PlayerSetState
+from battle.store import room_store
 from .base import BaseMixin
 
 class BattleDBMixin(BaseMixin):
     """ データベース操作関連の処理をまとめたMixin """
 
-    @database_sync_to_async
-    def get_user(self):
-        """ユーザー情報を取得"""
+    async def get_user(self):
+        """ユーザー情報を取得（接続時に認証ミドルウェアが解決済みのためスレッドを経由しない）"""
         return self.scope['user']
 
-    def get_player(self, room: BattleRoom, user: User) -> BattleRoom:
+    def get_player(self, room: BattleRoomState, user: User) -> PlayerSetState:
         """プレイヤーを取得"""
         return room.player1 if str(user.id) == room.player1.info.id else room.player2
 
-    def get_opponent(self, room: BattleRoom, user: User) -> BattleRoom:
+    def get_opponent(self, room: BattleRoomState, user: User) -> PlayerSetState:
         """相手プレイヤーを取得"""
         return room.player2 if str(user.id) == room.player1.info.id else room.player1
 
-    def get_opponent_id(self, room: BattleRoom) -> str:
+    def get_opponent_id(self, room: BattleRoomState) -> str:
         """相手プレイヤーのIDを取得"""
         return self.get_opponent(room).info.id
 
     @database_sync_to_async
-    def get_user_index(self, room: BattleRoom) -> Literal[1, 2]:
+    def get_user_index(self, room: BattleRoomState) -> Literal[1, 2]:
         """ユーザーがどのプレイヤーかを取得"""
         return 1 if room.player_map[str(self.user.id)] == "player1" else 2
 
     @database_sync_to_async
-    def get_user_index_str(self, room: BattleRoom) -> Literal["player1", "player2"]:
+    def get_user_index_str(self, room: BattleRoomState) -> Literal["player1", "player2"]:
         """ユーザーがどのプレイヤーかを取得"""
         return room.player_map[str(self.user.id)]
 
-    @database_sync_to_async
-    def get_room(self, id: str = None):
-        """バトルルームを取得"""
+    async def get_room(self, id: str = None):
+        """バトルルームを取得（プロセス内のストアから読み込む）"""
         if id:
-            return BattleRoom.objects.get(id=id)
-        return BattleRoom.objects.get(slug=self.room_slug)
-
-    @database_sync_to_async
-    def save_room(self, room: BattleRoom):
-        """バトルルームを保存"""
-        room.save()
-
-    @database_sync_to_async
-    def delete_room(self, room_id: str):
+            return await room_store.get(id=id)
+        return await room_store.get(slug=self.room_slug)
+
+    async def create_room(self, room: BattleRoomState):
+        """バトルルームを新規作成"""
+        await room_store.insert(room)
+
+    async def save_room(self, room: BattleRoomState, flush: bool = False):
+        """
+        バトルルームを保存
+        ・通常はストアに反映するだけで、MongoDB への書き込みは一定間隔でまとめて行う
+        ・flush=True の場合（ターンの区切りなど）はその場で MongoDB に書き出す
+        """
+        await room_store.put(room)
+        if flush:
+            await room_store.flush(room.id)
+
+    async def delete_room(self, room_id: str):
         """バトルルームを削除"""
-        BattleRoom.objects.filter(id=room_id).delete()
+        await room_store.delete(room_id)
@@ -0,0 +1,83 @@
+import logging
+from battle import engine
+from battle.action_log import action_log
+from battle.state import BattleRoomState
+from .base import BaseMixin
+
+logger = logging.getLogger(__name__)
+
+# プレイヤー宛ての通知として送るイベント
+NOTICE_EVENTS = ("warning", "error", "info")
+
+
+class BattleEngineMixin(BaseMixin):
+    """
+    バトルのルール（battle.engine）と WebSocket をつなぐMixin
+    ・受信したアクションに送信者の player_id を付けて engine.apply() に渡す
+      （受け付けるのは action.* のみ。battle.start などサーバー側の処理は _apply_server_action() から行う）
+    ・返ってきたイベントを保存・送信・魔石の付与に置き換える
+    ・受け付けたアクションは行動ログ（battle.action_log）に追記する
+    """
+
+    async def _apply_action(self, content: dict) -> list[dict]:
+        """受信したアクションをエンジンで処理する"""
+        # クライアントが送れるのは action.* のみ（battle.start などは部屋を読み込む前に拒否する）
+        if content.get("type") not in engine.HANDLERS:
+            logger.warning(f"Rejected action {content.get('type')!r} from user {self.user.id}")
+            await self.send_json({"type": "error", "message": "不明なアクションです"})
+            return []
+
+        room: BattleRoomState = await self.get_room()
+        action = dict(content, player_id=str(self.user.id))
+        return await self._apply_engine_action(room, action, engine.apply)
+
+    async def _apply_server_action(self, room: BattleRoomState, action: dict, flush: bool = False) -> list[dict]:
+        """サーバー側の処理（engine.SERVER_HANDLERS）をエンジンで処理する（受信したメッセージには使わないこと）"""
+        return await self._apply_engine_action(room, action, engine.apply_internal, flush=flush)
+
+    async def _apply_engine_action(self, room: BattleRoomState, action: dict, apply, flush: bool = False) -> list[dict]:
+        room, events = apply(room, action)
+        entries = [] if engine.is_rejected(events) else action_log.record(room, action, events)
+        await self._handle_engine_events(room, events, flush=flush)
+        await self._append_action_log(entries)
+        return events
+
+    async def _handle_engine_events(self, room: BattleRoomState, events: list[dict], flush: bool = False) -> None:
+        changed = False
+        for event in events:
+            if event["type"] == "battle.update":
+                changed = True
+            elif event["type"] == "turn.start":
+                # ターンの区切りで MongoDB に書き出す
+                flush = True
+
+        if changed:
+            await self.save_room(room, flush=flush)
+
+        for event in events:
+            event_type = event["type"]
+            if event_type in NOTICE_EVENTS:
+                await self._send_engine_notice(room, event)
+            elif event_type == "chat.message":
+                message = {"type": "chat.message", "user": event["user"], "message": event["message"]}
+                if event["to"] is None:
+                    await self._send_group_message(f"battle_rooms_{room.id}", message)
+                else:
+                    await self._send_channel_message(self._player_channel_name(room, event["to"]), message)
+            elif event_type == "reward":
+                await self._reward_magic_stones(event["player_id"], event["magic_stones"])
+
+        if changed:
+            await self._send_battle_update()
+
+    async def _send_engine_notice(self, room: BattleRoomState, event: dict) -> None:
+        message = {"type": event["type"], "message": event["message"]}
+        if event["to"] == str(self.user.id):
+            await self.send_json(message)
+        else:
+            await self._send_channel_message(self._player_channel_name(room, event["to"]), message)
+
+    def _player_channel_name(self, room: BattleRoomState, player_id: str) -> str:
+        if player_id == str(self.user.id):
+            return self.channel_name
+        return getattr(room, room.player_map[player_id]).info.channel_name
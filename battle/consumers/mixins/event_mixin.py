@@ -4,13 +4,13 @@ from .base import BaseMixin
 class BattleEventMixin(BaseMixin):
     """ WebSocket イベント処理を担当するMixin """
 
-    # 最新の状態を送信
+    # 最新の状態を送信（差分モードの場合は battle.patch）
     async def battle_update(self, event):
-        await self.send_json({
-            "type": "battle.update",
-            "you_are": event["you_are"],
-            "data": event["data"]
-        })
+        await self._send_battle_state(event["you_are"], event["data"])
+
+    # ストアの書き出しが競合した（battle.store）。保存されている状態を送り直す
+    async def battle_resync(self, event):
+        await self._resync_battle_state()
 
     async def turn_change(self, event):
         await self.send_json({
@@ -37,3 +37,8 @@ class BattleEventMixin(BaseMixin):
             "type": "warning",
             "message": event["message"]
         })
+    async def info(self, event):
+        await self.send_json({
+            "type": "info",
+            "message": event["message"]
+        })
@@ -0,0 +1,91 @@
+from battle.codecs import CODECS, JSON_CODEC, JsonCodec, MsgpackCodec
+from battle.patch import make_patch
+from .base import BaseMixin
+
+# 差分配信（battle.patch）を利用するクライアントが指定するサブプロトコル
+DELTA_SUBPROTOCOL = "morisummon.delta"
+
+
+class BattleProtocolMixin(BaseMixin):
+    """
+    battle.update の送信方式を扱うMixin
+    ・通常は従来通り毎回全体の状態を battle.update で送る
+    ・差分モードでは最後に送った状態との差分を RFC 6902 形式の battle.patch で送る
+      - 各メッセージに連番（seq）を付け、クライアントは欠番を検知したら battle.resync を送る
+      - 接続直後・再同期時は全体の状態を seq 付きの battle.update で送る
+    ・差分モードはサブプロトコル "morisummon.delta" か protocol.delta メッセージで有効にする
+    ・送受信の符号化方式（JSON / msgpack, battle.codecs）もサブプロトコルで選ぶ
+      msgpack の場合の差分モードは protocol.delta メッセージで有効にする
+    """
+    delta_enabled: bool = False
+    codec: JsonCodec | MsgpackCodec = JSON_CODEC
+    _last_projection: dict | None = None
+    _update_seq: int = 0
+
+    def _negotiate_subprotocol(self) -> str | None:
+        """クライアントが要求したサブプロトコルから利用するものを選ぶ（要求された順に優先する）"""
+        for subprotocol in self.scope.get("subprotocols", []):
+            if subprotocol == DELTA_SUBPROTOCOL:
+                self.delta_enabled = True
+                return subprotocol
+            if subprotocol in CODECS:
+                self.codec = CODECS[subprotocol]
+                return subprotocol
+        return None
+
+    async def _send_frame(self, content: dict, close: bool = False) -> None:
+        if self.codec.binary:
+            await self.send(bytes_data=self.codec.encode(content), close=close)
+        else:
+            await self.send(text_data=self.codec.encode(content), close=close)
+
+    def _set_delta_mode(self, enabled: bool) -> None:
+        self.delta_enabled = enabled
+        # 次回は全体の状態を送る
+        self._last_projection = None
+
+    async def _resync_battle_state(self) -> None:
+        """自分の現在の状態を全体送信し直す（欠番検知時・差分モード切り替え時）"""
+        room = await self.get_room()
+        you_are = room.player_map.get(str(self.user.id))
+        if not you_are:
+            return
+        data = self._format_battle_status(room, user_set=getattr(room, you_are))
+        self._last_projection = None
+        await self._send_battle_state(you_are, data)
+
+    async def _send_battle_state(self, you_are: str, data: dict) -> None:
+        if not self.delta_enabled:
+            await self.send_json({
+                "type": "battle.update",
+                "you_are": you_are,
+                "data": data
+            })
+            return
+
+        if self._last_projection is None:
+            await self._send_battle_snapshot(you_are, data)
+            return
+
+        patch = make_patch(self._last_projection, data)
+        if not patch:
+            return
+
+        self._update_seq += 1
+        self._last_projection = data
+        await self.send_json({
+            "type": "battle.patch",
+            "you_are": you_are,
+            "seq": self._update_seq,
+            "patch": patch
+        })
+
+    async def _send_battle_snapshot(self, you_are: str, data: dict) -> None:
+        self._update_seq += 1
+        self._last_projection = data
+        await self.send_json({
+            "type": "battle.update",
+            "you_are": you_are,
+            "seq": self._update_seq,
+            "data": data
+        })
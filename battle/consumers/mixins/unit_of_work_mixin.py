@@ -0,0 +1,125 @@
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from channels.db import database_sync_to_async
+from django.db.models import F
+from accounts.models import User
+from battle.action_log import action_log, LogEntry
+from battle.state import BattleRoomState
+from .base import BaseMixin
+
+
+@dataclass
+class BattleUnitOfWork:
+    """1つの受信メッセージの処理中に発生した変更と送信内容"""
+    room: BattleRoomState | None = None
+    dirty: bool = False
+    flush: bool = False
+    send_update: bool = False
+    # (送信先, グループ宛かどうか, メッセージ)
+    messages: list[tuple[str, bool, dict]] = field(default_factory=list)
+    callbacks: list[Callable[[], Awaitable]] = field(default_factory=list)
+
+
+class BattleUnitOfWorkMixin(BaseMixin):
+    """
+    受信メッセージ1件ごとの Unit of Work を扱うMixin
+    ・処理中の get_room() は最初に読み込んだ同じ BattleRoomState を返す
+    ・save_room() / _send_battle_update() / システムメッセージは処理の最後にまとめて反映する
+      （保存1回、各プレイヤーへの battle.update 1回）
+    ・処理中に例外が発生した場合は何も反映しない
+    """
+    _uow: BattleUnitOfWork | None = None
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        uow = BattleUnitOfWork()
+        self._uow = uow
+        try:
+            yield uow
+        finally:
+            self._uow = None
+        await self._commit(uow)
+
+    async def _commit(self, uow: BattleUnitOfWork) -> None:
+        if uow.dirty:
+            await super().save_room(uow.room, flush=uow.flush)
+
+        for callback in uow.callbacks:
+            await callback()
+
+        for target, is_group, message in uow.messages:
+            if is_group:
+                await self.channel_layer.group_send(target, message)
+            else:
+                await self.channel_layer.send(target, message)
+
+        if uow.send_update:
+            await super()._send_battle_update(uow.room)
+
+    async def get_room(self, id: str = None):
+        uow = self._uow
+        if uow is None:
+            return await super().get_room(id)
+        if uow.room is None:
+            uow.room = await super().get_room(id)
+        return uow.room
+
+    async def save_room(self, room: BattleRoomState, flush: bool = False):
+        uow = self._uow
+        if uow is None:
+            return await super().save_room(room, flush=flush)
+        uow.room = room
+        uow.dirty = True
+        uow.flush = uow.flush or flush
+
+    async def _send_battle_update(self, room: BattleRoomState = None):
+        uow = self._uow
+        if uow is None:
+            return await super()._send_battle_update(room)
+        uow.send_update = True
+
+    async def _send_system_message(self, message: str) -> None:
+        """部屋の全員にシステムメッセージを送る"""
+        await self._send_group_message(f"battle_rooms_{self.room_id}", {
+            "type": "chat.message",
+            "user": {"name": "システム"},
+            "message": message,
+        })
+
+    async def _send_group_message(self, group: str, message: dict) -> None:
+        if self._uow is None:
+            await self.channel_layer.group_send(group, message)
+        else:
+            self._uow.messages.append((group, True, message))
+
+    async def _send_channel_message(self, channel_name: str, message: dict) -> None:
+        if self._uow is None:
+            await self.channel_layer.send(channel_name, message)
+        else:
+            self._uow.messages.append((channel_name, False, message))
+
+    async def _reward_magic_stones(self, user_id: str, amount: int) -> None:
+        """魔石を付与する（保存が確定した後に反映する）"""
+        async def reward():
+            await database_sync_to_async(
+                User.objects.filter(pk=user_id).update
+            )(magic_stones=F("magic_stones") + amount)
+
+        if self._uow is None:
+            await reward()
+        else:
+            self._uow.callbacks.append(reward)
+
+    async def _append_action_log(self, entries: list[LogEntry]) -> None:
+        """行動ログに追記する（保存が確定した後に反映する）"""
+        if not entries:
+            return
+
+        async def append():
+            await action_log.append(entries)
+
+        if self._uow is None:
+            await append()
+        else:
+            self._uow.callbacks.append(append)
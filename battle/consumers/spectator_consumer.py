@@ -0,0 +1,88 @@
+import logging
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from battle.consumers.battle_consumer import ROOM_CONFLICT_RETRIES
+from battle.locks import RoomLockTimeout, room_locks
+from battle.models import BattleRoom
+from battle.projection import project_spectator_view
+from battle.state import BattleRoomState
+from battle.store import BattleRoomConflict, room_store
+
+logger = logging.getLogger(__name__)
+
+
+class SpectatorConsumer(AsyncJsonWebsocketConsumer):
+    """
+    対戦を観戦する WebSocket（ws/battle/room/<slug>/watch/）
+    ・battle_rooms_<id>_spectators グループに参加し、状態が変わるたびに公開情報のみの
+      battle.update（you_are: "spectator"）を受け取る
+    ・送る内容は BattleConsumer が状態の変更ごとに1度だけ整形・符号化したもので、ここではそのまま送信する
+    ・送受信は JSON のテキストフレームのみ。クライアントから送るメッセージは無い
+    ・接続・切断のたびに部屋の spectator_count を増減する（0 の間、BattleConsumer は観戦者向けのデータを作らない）
+    """
+    group_name: str | None = None
+    slug: str | None = None
+
+    async def connect(self):
+        user = self.scope["user"]
+        slug = self.scope["url_route"]["kwargs"]["slug"]
+        await self.accept()
+
+        if user.is_anonymous:
+            await self._send_error("ログインしてください")
+            return
+
+        # 現在の状態を送ってからグループの更新を受け取るまでの間に更新が挟まらないようロックする
+        async with room_locks.lock(slug):
+            try:
+                room = await self._add_spectator(slug, 1)
+            except BattleRoom.DoesNotExist:
+                await self._send_error("対戦が見つかりません")
+                return
+            except BattleRoomConflict:
+                await self._send_error("サーバーが混み合っています。もう一度お試しください")
+                return
+
+            logger.info(f"User {user} is watching battle room {slug}")
+            self.slug = slug
+            self.group_name = f"battle_rooms_{room.id}_spectators"
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            await self.send_json({
+                "type": "battle.update",
+                "you_are": "spectator",
+                "data": project_spectator_view(room)
+            })
+
+    async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.slug:
+            try:
+                async with room_locks.lock(self.slug):
+                    await self._add_spectator(self.slug, -1)
+            except (BattleRoom.DoesNotExist, BattleRoomConflict, RoomLockTimeout) as e:
+                # 数え残しは観戦者向けの整形が余分に行われるだけなので、記録のみ
+                logger.info(f"Could not update the spectator count of {self.slug}: {e!r}")
+
+    async def _add_spectator(self, slug: str, delta: int) -> BattleRoomState:
+        """部屋の spectator_count を増減して返す（部屋のロックを取得した状態で呼ぶこと）"""
+        for _ in range(ROOM_CONFLICT_RETRIES):
+            room = await room_store.get(slug=slug)
+            room.spectator_count = max(room.spectator_count + delta, 0)
+            try:
+                await room_store.put(room)
+                return room
+            except BattleRoomConflict as e:
+                logger.info(f"Conflict on {e.room_id} while counting spectators, retrying")
+        raise BattleRoomConflict(room.id)
+
+    async def receive_json(self, content, **kwargs):
+        # クライアントから送るメッセージは無い
+        pass
+
+    # 符号化済みの battle.update（helpers_mixin._send_battle_update）
+    async def battle_spectate(self, event):
+        await self.send(text_data=event["text"])
+
+    async def _send_error(self, message: str):
+        await self.send_json({"type": "error", "message": message})
+        await self.close()
@@ -0,0 +1,523 @@
+"""
+バトルのルールをまとめたエンジン（WebSocket・DB には依存しない）
+
+    state, events = apply(state, action)           クライアントから受信したアクション（action.*）
+    state, events = apply_internal(state, action)  サーバー側で行う処理（battle.start）と行動ログの再生
+
+・state   : BattleRoomState（battle.state。その場で更新して返す。受け付けられなかったアクションでは何も変更しない）
+・action  : WebSocket で受信するメッセージと同じ形の dict に、送信者の player_id を加えたもの
+            例）{"type": "action.place_card", "player_id": "1", "card_index": 0, "to_field": "bench"}
+            apply() は HANDLERS（action.*）のみを受け付け、battle.start などのサーバー側の処理
+            （SERVER_HANDLERS）は apply_internal() からしか実行できない
+・events  : アクションの結果を表す dict のリスト（送信・保存は呼び出し側で行う）
+    {"type": "battle.update"}                                状態が変わった
+    {"type": "turn.start", "player_id": ...}                 ターンが切り替わった
+    {"type": "chat.message", "to": ..., "user": ..., "message": ...}
+                                                             to が None の場合は部屋の全員宛て
+    {"type": "warning" | "error" | "info", "to": ..., "message": ..., "rejected": bool}
+                                                             rejected=True はアクションを受け付けなかったことを表す
+    {"type": "reward", "player_id": ..., "magic_stones": ...}  勝利報酬
+
+action.batch は複数のアクションを順番に適用し、1つでも受け付けられなかった場合は全体を取り消す
+（イベントは適用した順に1つのリストにまとめて返す）。
+
+乱数は使わない（デッキのシャッフルは battle.start の呼び出し側で行う）ため、
+同じ state・action からは常に同じ結果になる。
+"""
+import logging
+from typing import Callable
+from battle.models import BattleRoomStatus
+from battle.state import BattleRoomState, BattleCardState, PlayerSetState
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_USER = {"name": "システム"}
+
+# 対戦開始時に配る手札の枚数
+INITIAL_HAND_SIZE = 3
+# 勝利時に付与する魔石
+WIN_REWARD_MAGIC_STONES = 10
+# action.batch で1度に送れるアクションの上限
+MAX_BATCH_ACTIONS = 20
+
+
+class InvalidAction(Exception):
+    """アクションを受け付けられない場合に送出する（apply() がイベントに変換する）"""
+
+    def __init__(self, message: str, level: str = "warning"):
+        super().__init__(message)
+        self.message = message
+        self.level = level
+
+
+def apply(state: BattleRoomState, action: dict) -> tuple[BattleRoomState, list[dict]]:
+    """クライアントのアクション（action.*）を1件適用し、更新後の状態とイベントを返す"""
+    return _apply(state, action, HANDLERS)
+
+
+def apply_internal(state: BattleRoomState, action: dict) -> tuple[BattleRoomState, list[dict]]:
+    """
+    サーバー側の処理（SERVER_HANDLERS）も含めてアクションを1件適用する
+    WebSocket から受信したアクションには使わないこと（対戦開始や行動ログの再生に使う）
+    """
+    return _apply(state, action, INTERNAL_HANDLERS)
+
+
+def _apply(state: BattleRoomState, action: dict, handlers: dict) -> tuple[BattleRoomState, list[dict]]:
+    handler = handlers.get(action.get("type"))
+    events: list[dict] = []
+    try:
+        if handler is None:
+            raise InvalidAction("不明なアクションです", "error")
+        handler(state, action, events)
+    except InvalidAction as e:
+        return state, [{
+            "type": e.level,
+            "to": action.get("player_id"),
+            "message": e.message,
+            "rejected": True,
+        }]
+    return state, events
+
+
+def is_rejected(events: list[dict]) -> bool:
+    """apply() の結果がアクションを受け付けなかったものかどうか"""
+    return any(event.get("rejected") for event in events)
+
+
+def is_finished(state: BattleRoomState) -> bool:
+    """決着済みかどうか"""
+    return _status(state) == BattleRoomStatus.FINISHED
+
+
+# ---------------------------------------------------------------------------
+# 共通処理
+# ---------------------------------------------------------------------------
+
+def _status(state: BattleRoomState) -> BattleRoomStatus:
+    # 文字列で代入された場合も Enum として扱う
+    return BattleRoomStatus(state.status)
+
+
+def _players(state: BattleRoomState, action: dict) -> tuple[PlayerSetState, PlayerSetState | None]:
+    """アクションを送ったプレイヤーと相手プレイヤーを返す"""
+    player_id = str(action.get("player_id"))
+    if state.player1 and state.player1.info.id == player_id:
+        return state.player1, state.player2
+    if state.player2 and state.player2.info.id == player_id:
+        return state.player2, state.player1
+    raise InvalidAction("この部屋のプレイヤーではありません", "error")
+
+
+def _check_turn(state: BattleRoomState, player: PlayerSetState, message: str = "自分のターンではありません") -> None:
+    if state.turn_player_id != str(player.info.id):
+        raise InvalidAction(message)
+
+
+def _notice(events: list[dict], level: str, player: PlayerSetState, message: str) -> None:
+    events.append({"type": level, "to": player.info.id, "message": message, "rejected": False})
+
+
+def _chat(events: list[dict], message: str, to: PlayerSetState | None = None, user: dict = None) -> None:
+    events.append({
+        "type": "chat.message",
+        "to": to.info.id if to else None,
+        "user": user or SYSTEM_USER,
+        "message": message,
+    })
+
+
+def draw_cards(player: PlayerSetState, count: int = 1) -> None:
+    """プレイヤーの _deck_cards から指定枚数を取り出し、_hand_cards に追加する"""
+    if not player.status._deck_cards:
+        return
+    if not player.status._hand_cards:
+        player.status._hand_cards = []
+    for _ in range(count):
+        if not player.status._deck_cards:
+            break
+        card = player.status._deck_cards.pop(0)
+        player.status._hand_cards.append(card)
+    player.status.hand_cards_count = len(player.status._hand_cards)
+
+
+def _start_turn(state: BattleRoomState, player: PlayerSetState, events: list[dict]) -> None:
+    """ターン開始時の処理：カードを1枚ドローする"""
+    draw_cards(player, 1)
+    events.append({"type": "turn.start", "player_id": player.info.id})
+
+
+def _end_turn(state: BattleRoomState, opponent: PlayerSetState, events: list[dict]) -> None:
+    # 例：相手のエネルギーを1追加
+    opponent.status.energy = 1
+    # ターンを相手に渡す
+    state.turn_player_id = opponent.info.id
+    _start_turn(state, opponent, events)
+
+
+def _win(state: BattleRoomState, winner: PlayerSetState, events: list[dict]) -> None:
+    state.status = BattleRoomStatus.FINISHED
+    state.winner = str(winner.info.id)
+    # 勝利時に user.magic_stones を +10 する
+    events.append({"type": "reward", "player_id": winner.info.id, "magic_stones": WIN_REWARD_MAGIC_STONES})
+
+
+def _check_attack(player: PlayerSetState, opponent: PlayerSetState | None) -> None:
+    """攻撃できるか確認する"""
+    # 攻撃側のメインカードチェック
+    if not player.status.battle_card:
+        raise InvalidAction("攻撃するメインカードがありません")
+    # 防御側のメインカードチェック
+    if not opponent or not opponent.status.battle_card:
+        raise InvalidAction("相手のメインカードが存在しません")
+    # 攻撃に必要なエネルギー数を取得（エネルギーは消費しない）
+    required_energy = player.status.battle_card.attack_needs_energy or 0
+    if player.status.battle_card.energy < required_energy:
+        raise InvalidAction("攻撃に必要なエネルギーが足りません")
+
+
+# ---------------------------------------------------------------------------
+# アクション
+# ---------------------------------------------------------------------------
+
+def _battle_start(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """
+    対戦開始：各プレイヤーのデッキ（シャッフル済みのカードの初期値のリスト）をセットし、
+    初期ドロー（3枚）を行う
+    {"type": "battle.start", "decks": {"player1": [...], "player2": [...]}}
+    サーバー側の処理のため、プレイヤーが送ったもの（player_id 付き）は受け付けない
+    """
+    if action.get("player_id") is not None:
+        raise InvalidAction("不明なアクションです", "error")
+
+    decks = action.get("decks") or {}
+    for key in ("player1", "player2"):
+        player = getattr(state, key)
+        templates = decks.get(key)
+        if player is None or templates is None:
+            continue
+        player.status._deck_cards = [BattleCardState(**template) for template in templates]
+        draw_cards(player, INITIAL_HAND_SIZE)
+    state.status = BattleRoomStatus.SETUP
+    events.append({"type": "battle.update"})
+
+
+def _place_card(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """
+    手札から指定のカードを取り出し、指定されたフィールドに配置する。
+    セットアップフェーズでは誰でも配置可能、対戦フェーズでは自分のターンのみ配置可能とする。
+    """
+    player, _ = _players(state, action)
+    card_index = action.get("card_index")
+    to_field = action.get("to_field")
+
+    # セットアップフェーズの場合はターンチェックをスキップする
+    if _status(state) != BattleRoomStatus.SETUP:
+        _check_turn(state, player)
+
+    hand = player.status._hand_cards or []
+    if not isinstance(card_index, int) or card_index < 0 or card_index >= len(hand):
+        raise InvalidAction("指定された手札のカードが存在しません。", "error")
+    if not isinstance(to_field, str):
+        raise InvalidAction("無効な配置先です。", "error")
+
+    # ベンチ配置の場合（"bench" または "bench-0" 等）
+    if to_field == "bench" or to_field.startswith("bench-"):
+        # 最大ベンチ数（bench_cards_max）を取得（なければ 2 枚とする）
+        max_bench = player.status.bench_cards_max or 2
+        bench = player.status.bench_cards or []
+        if len(bench) >= max_bench:
+            raise InvalidAction("ベンチが満杯です", "error")
+        # ※もし "bench-<index>" で特定の位置に配置したい場合は、index の取得処理を追加可能
+        # ここでは単純に末尾に追加する
+        bench.append(hand.pop(card_index))
+        player.status.bench_cards = bench
+
+    # メインカード配置の場合
+    elif to_field == "battle_card" or to_field.startswith("main"):
+        if player.status.battle_card:
+            raise InvalidAction("すでにメインカードが配置されています。")
+        player.status.battle_card = hand.pop(card_index)
+
+    else:
+        raise InvalidAction("無効な配置先です。", "error")
+
+    player.status.hand_cards_count = len(hand)
+    events.append({"type": "battle.update"})
+
+
+def _setup_complete(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """
+    初期配置完了の宣言
+    ※少なくとも1枚はカードを配置していることが必要
+    ※両者完了している場合、status を IN_PROGRESS に変更し、player1 のターンを開始する
+    ※すでに準備完了中の場合は操作をブロックする
+    """
+    player, opponent = _players(state, action)
+
+    if player.status.setup_done:
+        raise InvalidAction("準備完了中には操作できません")
+    if _status(state) != BattleRoomStatus.SETUP:
+        raise InvalidAction("現在はセットアップフェーズではありません。")
+    if not player.status.battle_card and not player.status.bench_cards:
+        raise InvalidAction("少なくとも1枚はカードを配置してください。")
+
+    # 自分の準備完了フラグを立てる
+    player.status.setup_done = True
+
+    # 相手の準備完了フラグが立っている場合、対戦開始フェーズに移行
+    if opponent and opponent.status.setup_done:
+        state.status = BattleRoomStatus.IN_PROGRESS
+        state.turn_player_id = state.player1.info.id  # 例：player1 を先行とする
+        _start_turn(state, state.player1, events)
+    else:
+        _notice(events, "warning", player, "相手の配置完了を待っています...")
+
+    events.append({"type": "battle.update"})
+
+
+def _end_turn_action(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """ターン終了（action.end_turn / action.pass）"""
+    player, opponent = _players(state, action)
+    _check_turn(state, player, "現在相手のターンです")
+    logger.debug(f"Player {player.info.id} is ending turn ({action.get('type')})")
+    _end_turn(state, opponent, events)
+    events.append({"type": "battle.update"})
+
+
+def _assign_energy(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """
+    エネルギーをカードに割り振る
+    card_id: 割り振り対象のカード識別子（例："bench-0"ならベンチ0番目、
+             "battle_card"または"main"ならアクティブカード）
+    """
+    player, _ = _players(state, action)
+    card_id = action.get("card_id")
+
+    _check_turn(state, player)
+
+    # 利用可能エネルギーが足りるかチェック
+    if player.status.energy <= 0:
+        raise InvalidAction("利用可能なエネルギーがありません")
+    if not isinstance(card_id, str):
+        raise InvalidAction("無効なカード識別子です", "error")
+
+    # カード識別子により対象カードを決定する
+    if card_id.startswith("bench-"):
+        try:
+            index = int(card_id.split("-")[1])
+        except (IndexError, ValueError):
+            raise InvalidAction("無効なカード識別子です", "error")
+        bench = player.status.bench_cards or []
+        if index >= len(bench):
+            raise InvalidAction("指定されたベンチカードは存在しません", "error")
+        card = bench[index]
+
+    elif card_id == "battle_card" or card_id.startswith("main"):
+        # アクティブなバトルカードに割り当てる
+        if not player.status.battle_card:
+            # ダミーデータを作成して割り当てる（実際のモデル定義に合わせた形式）
+            player.status.battle_card = BattleCardState(
+                id="dummy_001",
+                name="ジャスティス",
+                image="/static/images/cards/card01.png",
+                energy=0,
+                attack_needs_energy=1,
+                escape_needs_energy=2,
+                hp=100,
+                attack=50
+            )
+        card = player.status.battle_card
+
+    else:
+        raise InvalidAction("無効なカード識別子です", "error")
+
+    # エネルギー1を利用可能エネルギーから差し引き、対象カードに割り振る
+    player.status.energy -= 1
+    card.energy = (card.energy or 0) + 1
+    logger.debug(f"Player {player.info.id} assigned energy to {card_id}")
+    events.append({"type": "battle.update"})
+
+
+def _attack(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """攻撃（targetType が battleCard の場合は相手のメインカードへの攻撃）"""
+    if action.get("targetType") == "battleCard":
+        _attack_battle_card(state, action, events)
+    else:
+        _attack_target(state, action, events)
+
+
+def _attack_battle_card(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """相手のメインカードを攻撃し、ライフ・ベンチからの昇格を処理してターンを終了する"""
+    player, opponent = _players(state, action)
+    _check_turn(state, player)
+    _check_attack(player, opponent)
+
+    atk_value = player.status.battle_card.attack
+    if atk_value is None:
+        raise InvalidAction("攻撃カードに攻撃値が設定されていません")
+
+    logger.debug("攻撃力: %s", atk_value)
+    target = opponent.status.battle_card
+    old_hp = target.hp or 0
+    target.hp = old_hp - atk_value
+    new_hp = target.hp
+
+    # 攻撃結果の通知
+    _chat(events, (
+        f"{player.status.battle_card.name} が "
+        f"{target.name} に {atk_value} ダメージ！ "
+        f"(HP: {old_hp} → {new_hp})"
+    ))
+
+    # ノックアウト処理
+    if new_hp <= 0:
+        opponent.status.life -= 1
+        _chat(events, f"相手の {target.name} が倒れました！")
+        if opponent.status.life <= 0:
+            _win(state, player, events)
+            _chat(events, "相手のHPが0になりました。あなたの勝ちです！")
+        elif opponent.status.bench_cards:
+            # ベンチからメインカードを昇格
+            new_main = opponent.status.bench_cards.pop(0)
+            opponent.status.battle_card = new_main
+            _chat(events, f"相手のベンチカード {new_main.name} がメインカードに昇格しました！")
+        else:
+            _win(state, player, events)
+            _chat(events, "相手はメインカードがなく、ベンチカードもありません。あなたの勝ちです！")
+
+    # 攻撃後はターン終了
+    _end_turn(state, opponent, events)
+    events.append({"type": "battle.update"})
+
+
+def _attack_target(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """target_id で指定した相手のカードを攻撃し、ターンを終了する"""
+    player, opponent = _players(state, action)
+    _check_turn(state, player)
+    _check_attack(player, opponent)
+
+    # ターゲットチェック
+    target_id = action.get("target_id")
+    card_id = opponent.status.battle_card.id
+    if card_id is not None and target_id and target_id != card_id:
+        raise InvalidAction("無効な攻撃対象です")
+
+    atk_value = player.status.battle_card.attack
+    if atk_value is None:
+        raise InvalidAction("攻撃カードに攻撃値が設定されていません")
+
+    # ダメージ処理
+    target = opponent.status.battle_card
+    old_hp = target.hp or 0
+    target.hp = old_hp - atk_value
+    logger.debug("攻撃前のHP: %s → 攻撃後のHP: %s", old_hp, target.hp)
+
+    _chat(events, (
+        f"{player.status.battle_card.name}が"
+        f"{target.name}に{atk_value}ダメージ！ "
+        f"残HP: {target.hp}"
+    ))
+
+    # HP が 0 以下の場合
+    if target.hp <= 0:
+        opponent.status.battle_card = None
+        _notice(events, "info", player, "相手のメインカードが倒れました。")
+        if opponent.status.bench_cards:
+            opponent.status.battle_card = opponent.status.bench_cards.pop(0)
+            _notice(events, "info", player, "相手のベンチカードがメインカードに昇格しました。")
+        else:
+            _win(state, player, events)
+            _notice(events, "info", player, "相手はカードがなくなりました。あなたの勝ちです！")
+
+    # 攻撃後はターン終了
+    _end_turn(state, opponent, events)
+    events.append({"type": "battle.update"})
+
+
+def _escape(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """逃げる：メインカードと指定したベンチカードを入れ替える"""
+    player, _ = _players(state, action)
+    bench_index = action.get("bench_index")
+    if bench_index is None:
+        raise InvalidAction("bench_index が指定されていません", "error")
+
+    _check_turn(state, player)
+    if not player.status.battle_card:
+        raise InvalidAction("メインカードがありません")
+
+    required_energy = player.status.battle_card.escape_needs_energy or 0
+    if player.status.battle_card.energy < required_energy:
+        raise InvalidAction("逃げに必要なエネルギーが足りません")
+
+    bench = player.status.bench_cards or []
+    if not isinstance(bench_index, int) or bench_index < 0 or bench_index >= len(bench) or bench[bench_index] is None:
+        raise InvalidAction("有効なベンチカードが選択されていません", "error")
+
+    player.status.battle_card.energy -= required_energy
+    bench[bench_index], player.status.battle_card = player.status.battle_card, bench[bench_index]
+    events.append({"type": "battle.update"})
+
+
+def _surrender(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """降参：相手の勝利として対戦を終了する（報酬は無し）"""
+    player, opponent = _players(state, action)
+    if not opponent:
+        raise InvalidAction("対戦相手がいません")
+
+    state.status = BattleRoomStatus.FINISHED
+    state.winner = str(opponent.info.id)
+    events.append({"type": "battle.update"})
+    _chat(events, "あなたは降参しました。", to=player, user={"name": player.info.name})
+    _chat(events, "相手が降参を選びました！", to=opponent)
+
+
+def _batch(state: BattleRoomState, action: dict, events: list[dict]) -> None:
+    """
+    まとめて送られた複数のアクションを順番に適用する
+    {"type": "action.batch", "actions": [{"type": "action.place_card", ...}, ...]}
+    ・複製した状態に適用し、全て受け付けられた場合のみ state に反映する
+    ・受け付けられなかったアクションがあれば、その理由（何番目か）で全体を拒否する
+    """
+    actions = action.get("actions")
+    if not isinstance(actions, list) or not actions:
+        raise InvalidAction("アクションが指定されていません", "error")
+    if len(actions) > MAX_BATCH_ACTIONS:
+        raise InvalidAction(f"一度に送れるアクションは{MAX_BATCH_ACTIONS}件までです", "error")
+
+    working = state.copy()
+    batch_events: list[dict] = []
+    for index, item in enumerate(actions, start=1):
+        # まとめられるのはクライアントのアクション（action.*）のみ
+        if not isinstance(item, dict) or item.get("type") not in HANDLERS or item.get("type") == "action.batch":
+            raise InvalidAction(f"{index}件目のアクションが不正です", "error")
+        # 送信者は batch のものを使う（中のアクションで別のプレイヤーを名乗れないようにする）
+        working, step_events = apply(working, dict(item, player_id=action.get("player_id")))
+        if is_rejected(step_events):
+            rejected = next(event for event in step_events if event.get("rejected"))
+            raise InvalidAction(f"{index}件目: {rejected['message']}", rejected["type"])
+        batch_events += step_events
+
+    state.assign(working)
+    events += batch_events
+
+
+# クライアントが送れるアクション（apply()）
+HANDLERS: dict[str, Callable[[BattleRoomState, dict, list[dict]], None]] = {
+    "action.place_card": _place_card,
+    "action.setup_complete": _setup_complete,
+    "action.pass": _end_turn_action,
+    "action.end_turn": _end_turn_action,
+    "action.assign_energy": _assign_energy,
+    "action.attack": _attack,
+    "action.escape": _escape,
+    "action.surrender": _surrender,
+    "action.batch": _batch,
+}
+
+# サーバー側でのみ行う処理（apply_internal()）
+SERVER_HANDLERS: dict[str, Callable[[BattleRoomState, dict, list[dict]], None]] = {
+    "battle.start": _battle_start,
+}
+
+INTERNAL_HANDLERS = {**SERVER_HANDLERS, **HANDLERS}
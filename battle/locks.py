@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from uuid import uuid4
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RoomLockTimeout(Exception):
+    """部屋のロックを時間内に取得できなかった場合に送出する"""
+
+    def __init__(self, key: str):
+        super().__init__(f"Timed out waiting for room lock {key}")
+        self.key = key
+
+
+@dataclass
+class LockWaitStats:
+    """ロック待ち時間の集計"""
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "max_seconds": self.max,
+            "avg_seconds": self.total / self.count if self.count else 0.0,
+        }
+
+
+class RoomLockBackend(ABC):
+    @abstractmethod
+    def acquire(self, key: str):
+        """key に対する排他ロックを取得する async context manager を返す"""
+
+
+@dataclass
+class _LockSlot:
+    lock: asyncio.Lock
+    users: int = 0
+
+
+class LocalRoomLockBackend(RoomLockBackend):
+    """
+    プロセス内の asyncio.Lock による部屋ごとのロック
+    ・asyncio.Lock は取得を待っている順に解放されるため、同じ部屋の操作は到着順に処理される
+    ・使われなくなったロックは破棄するので、部屋の数だけメモリが増え続けることはない
+    """
+
+    def __init__(self):
+        self._slots: dict[str, _LockSlot] = {}
+
+    @asynccontextmanager
+    async def acquire(self, key: str):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _LockSlot(lock=asyncio.Lock())
+        slot.users += 1
+        try:
+            async with slot.lock:
+                yield
+        finally:
+            slot.users -= 1
+            if slot.users == 0 and self._slots.get(key) is slot:
+                del self._slots[key]
+
+
+class RedisRoomLockBackend(RoomLockBackend):
+    """
+    Redis のリース付きロックによる部屋ごとのロック（複数ノード構成用）
+    ・SET NX PX で取得し、トークンが一致する場合のみ削除して解放する
+    ・保持したままプロセスが落ちてもリース期間が過ぎれば自動的に解放される
+    ・保持している間はリース期間の 1/3 ごとに延長する（処理が長引いてもリースが切れないようにする）
+    ・同じプロセス内の待ち行列はローカルロックで到着順に並べてから Redis に問い合わせる
+    """
+
+    RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+    RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+    def __init__(self, url: str, lease: float = 10.0, timeout: float = 5.0, prefix: str = "morisummon:room-lock:"):
+        self._url = url
+        self._lease_ms = int(lease * 1000)
+        self._timeout = timeout
+        self._prefix = prefix
+        self._local = LocalRoomLockBackend()
+        self._redis = None
+
+    def _client(self):
+        if self._redis is None:
+            from redis import asyncio as aioredis
+            self._redis = aioredis.from_url(self._url)
+        return self._redis
+
+    @asynccontextmanager
+    async def acquire(self, key: str):
+        async with self._local.acquire(key):
+            client = self._client()
+            redis_key = self._prefix + key
+            token = uuid4().hex
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self._timeout
+            delay = 0.005
+
+            while not await client.set(redis_key, token, nx=True, px=self._lease_ms):
+                if loop.time() >= deadline:
+                    raise RoomLockTimeout(key)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+
+            renewer = asyncio.create_task(self._renew(client, redis_key, token))
+            try:
+                yield
+            finally:
+                renewer.cancel()
+                await client.eval(self.RELEASE_SCRIPT, 1, redis_key, token)
+
+    async def _renew(self, client, redis_key: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self._lease_ms / 3000)
+            try:
+                renewed = await client.eval(self.RENEW_SCRIPT, 1, redis_key, token, self._lease_ms)
+            except Exception as e:
+                logger.warning(f"Failed to renew room lock {redis_key}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost room lock {redis_key} before release")
+                return
+
+
+class RoomLockManager:
+    """
+    バトルルームごとの排他制御
+    ・同じ部屋への操作は1つずつ順番に処理し、別の部屋同士は並行して処理する
+    ・ロック待ち時間を wait_stats に記録する
+    """
+
+    def __init__(self, backend: RoomLockBackend = None):
+        self._backend = backend
+        self.wait_stats = LockWaitStats()
+
+    @property
+    def backend(self) -> RoomLockBackend:
+        if self._backend is None:
+            self._backend = self._create_backend()
+        return self._backend
+
+    def _create_backend(self) -> RoomLockBackend:
+        name = getattr(settings, "MORISUMMON_BATTLE_LOCK_BACKEND", "local")
+        if name == "redis":
+            return RedisRoomLockBackend(
+                url=settings.MORISUMMON_REDIS_URL,
+                lease=getattr(settings, "MORISUMMON_BATTLE_LOCK_LEASE", 10.0),
+                timeout=getattr(settings, "MORISUMMON_BATTLE_LOCK_TIMEOUT", 5.0),
+            )
+        if name == "local":
+            return LocalRoomLockBackend()
+        raise ValueError(f"Unknown battle lock backend: {name}")
+
+    @asynccontextmanager
+    async def lock(self, room_key: str):
+        started = time.perf_counter()
+        async with self.backend.acquire(room_key):
+            waited = time.perf_counter() - started
+            self.wait_stats.observe(waited)
+            if waited > 0.1:
+                logger.debug(f"Waited {waited:.3f}s for room lock {room_key}")
+            yield
+
+
+room_locks = RoomLockManager()
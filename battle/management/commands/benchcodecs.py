@@ -0,0 +1,42 @@
+import timeit
+from django.core.management.base import BaseCommand
+from battle.codecs import CODECS, JSON_CODEC, MSGPACK_SUBPROTOCOL
+from battle.management.commands.benchprojection import build_sample_room
+from battle.models import BattleRoomStatus
+from battle.projection import project_views
+from battle.state import BattleRoomState
+
+
+class Command(BaseCommand):
+    help = 'Compare frame size and encoding time of battle.update for each WebSocket codec (battle.codecs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help='Number of frames per run')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        codecs = [
+            ('json', JSON_CODEC),
+            (MSGPACK_SUBPROTOCOL, CODECS[MSGPACK_SUBPROTOCOL]),
+        ]
+
+        for status in (BattleRoomStatus.SETUP, BattleRoomStatus.IN_PROGRESS):
+            state = BattleRoomState.from_document(build_sample_room(status))
+            message = {"type": "battle.update", "you_are": "player1", "data": project_views(state)["player1"]}
+
+            json_size = len(JSON_CODEC.encode(message).encode())
+            for name, codec in codecs:
+                # 受信側で元のメッセージに戻せることを確認する
+                decoded = codec.decode(codec.encode(message))
+                if decoded != message:
+                    self.stdout.write(self.style.ERROR(f'Round trip mismatch for {name} ({status.value})'))
+                    return
+
+                frame = codec.encode(message)
+                size = len(frame.encode() if isinstance(frame, str) else frame)
+                elapsed = min(timeit.repeat(lambda: codec.encode(message), number=number, repeat=3))
+                self.stdout.write(
+                    f'{status.value:>8} {name:>24}: {size:6} bytes/frame ({size / json_size:4.0%}), '
+                    f'{elapsed / number * 1e6:7.1f} us/frame'
+                )
+
@@ -0,0 +1,141 @@
+import json
+import timeit
+from django.core.management.base import BaseCommand
+from morisummon.utils import dictutil
+from battle.models import (
+    BattleRoom,
+    BattleRoomStatus,
+    PlayerSet,
+    BattlePlayerInfo,
+    BattlePlayerStatus,
+    BattleCardInfo,
+)
+from battle.projection import project_views
+from battle.state import BattleRoomState
+
+
+def legacy_format_battle_status(room: BattleRoom, user_set: PlayerSet) -> dict:
+    """battle.projection 導入前の _format_battle_status（比較用）"""
+    data = json.loads(room.to_json())
+    # TTL・行動ログ用のフィールドはクライアントに送らない（battle.projection.ROOM_VISIBILITY）
+    dictutil.delete(data, "last_activity_at")
+    dictutil.delete(data, "log_seq")
+
+    if not data.get("player2"):
+        data["status"] = "waiting"
+        data["opponent"] = {}
+        return data
+
+    if room.player1.info.id == user_set.info.id:
+        data["you"] = data["player1"]
+        data["opponent"] = data["player2"]
+    else:
+        data["you"] = data["player2"]
+        data["opponent"] = data["player1"]
+
+    dictutil.delete(data, "player1")
+    dictutil.delete(data, "player2")
+
+    your_status = data.get("you", {}).get("status", {})
+    your_status["hand_cards"] = your_status.get("_hand_cards", [])
+    if "status" in data.get("you", {}):
+        dictutil.delete(data["you"]["status"], "_hand_cards")
+
+    opponent = data.get("opponent") or {}
+    opponent_status = opponent.get("status", {})
+    hand_count = opponent_status.get("hand_cards_count", len(opponent_status.get("_hand_cards", [])))
+    opponent_status["hand_cards"] = f"{hand_count}枚"
+    dictutil.delete(opponent_status, "_deck_cards")
+    dictutil.delete(opponent_status, "private")
+    # 旧実装では相手の _hand_cards がそのまま送られていた（公開範囲の定義上は本人のみ）
+    dictutil.delete(opponent_status, "_hand_cards")
+
+    if room.status in ["setup", "SETUP"] or (hasattr(room.status, "name") and room.status.name.lower() == "setup"):
+        if opponent_status.get("battle_card"):
+            opponent_status["battle_card"] = {"placeholder": "配置済"}
+        if opponent_status.get("bench_cards"):
+            new_bench = []
+            for card in opponent_status["bench_cards"]:
+                new_bench.append({"placeholder": "配置済"} if card else None)
+            opponent_status["bench_cards"] = new_bench
+
+    return data
+
+
+def build_sample_room(status: BattleRoomStatus) -> BattleRoom:
+    """対戦中を想定したサンプルのバトルルーム（デッキ12枚から手札・場にカードを配置）"""
+    def card(player: int, index: int) -> BattleCardInfo:
+        return BattleCardInfo(
+            id=f"{player}{index:02}",
+            name=f"カード{index}",
+            image=f"/static/images/cards/card{index + 1:02}.png",
+            energy=index % 3,
+            attack_needs_energy=2,
+            escape_needs_energy=1,
+            max_hp=100,
+            hp=100 - index,
+            attack=30,
+        )
+
+    def player_set(player: int) -> PlayerSet:
+        cards = [card(player, i) for i in range(12)]
+        return PlayerSet(
+            info=BattlePlayerInfo(id=str(player), name=f"player{player}", channel_name=f"channel{player}"),
+            status=BattlePlayerStatus(
+                battle_card=cards[0],
+                bench_cards=cards[1:3],
+                _hand_cards=cards[3:7],
+                hand_cards_count=4,
+                _deck_cards=cards[7:],
+                energy=1,
+            ),
+        )
+
+    return BattleRoom(
+        id="01BENCHMARKROOM",
+        slug="benchmark",
+        status=status,
+        player1=player_set(1),
+        player2=player_set(2),
+        player_map={"1": "player1", "2": "player2"},
+        turn=3,
+        turn_player_id="1",
+    )
+
+
+class Command(BaseCommand):
+    help = 'Benchmark battle.projection against the legacy to_json/json.loads battle status formatting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help='Number of battle updates per run')
+
+    def handle(self, *args, **options):
+        number = options['number']
+
+        for status in (BattleRoomStatus.SETUP, BattleRoomStatus.IN_PROGRESS):
+            room = build_sample_room(status)
+            # 対戦中の部屋は battle.state の状態として保持されている
+            state = BattleRoomState.from_document(room)
+
+            # 出力が一致することを確認する
+            views = project_views(state)
+            for you_are in ("player1", "player2"):
+                expected = legacy_format_battle_status(room, getattr(room, you_are))
+                if json.dumps(views[you_are], ensure_ascii=False) != json.dumps(expected, ensure_ascii=False):
+                    self.stdout.write(self.style.ERROR(f'Output mismatch for {you_are} ({status.value})'))
+                    return
+
+            # 1回の battle.update ＝ 両プレイヤー分の整形
+            legacy = min(timeit.repeat(
+                lambda: [legacy_format_battle_status(room, room.player1), legacy_format_battle_status(room, room.player2)],
+                number=number, repeat=3,
+            ))
+            projected = min(timeit.repeat(lambda: project_views(state), number=number, repeat=3))
+
+            self.stdout.write(
+                f'{status.value:>8}: legacy {legacy / number * 1e6:8.1f} us/update, '
+                f'projection {projected / number * 1e6:8.1f} us/update, '
+                f'speedup x{legacy / projected:.1f}'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Outputs are identical'))
@@ -0,0 +1,53 @@
+import json
+import sys
+import msgpack
+from django.core.management.base import BaseCommand, CommandError
+from battle.action_log import action_log
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream the battle action log (battle.action_log) of the given rooms, or of all finished matches with --finished. '
+        'Entries are written one by one in seq order as JSON lines (default) or as a msgpack stream'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_ids', nargs='*', help='Rooms to export')
+        parser.add_argument('--finished', action='store_true', help='Export all finished matches in the log')
+        parser.add_argument('--format', choices=['jsonl', 'msgpack'], default='jsonl')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        room_ids = list(options['room_ids'])
+        if options['finished']:
+            room_ids += [room_id for room_id in action_log.finished_room_ids() if room_id not in room_ids]
+        if not room_ids:
+            raise CommandError('Specify room ids or --finished')
+
+        binary = options['format'] == 'msgpack'
+        if options['output']:
+            out = open(options['output'], 'wb' if binary else 'w', encoding=None if binary else 'utf-8')
+        else:
+            out = sys.stdout.buffer if binary else self.stdout
+
+        count = 0
+        try:
+            for room_id in room_ids:
+                for entry in action_log.iter_entries(room_id):
+                    if binary:
+                        # data は記録された msgpack のまま書き出す
+                        out.write(msgpack.packb({
+                            "room_id": entry.room_id,
+                            "seq": entry.seq,
+                            "kind": entry.kind.value,
+                            "finished": entry.finished,
+                            "data": entry.data,
+                        }, use_bin_type=True))
+                    else:
+                        out.write(json.dumps(entry.decode(), ensure_ascii=False, default=str) + '\n')
+                    count += 1
+        finally:
+            if options['output']:
+                out.close()
+
+        self.stderr.write(f'Exported {count} entries from {len(room_ids)} rooms')
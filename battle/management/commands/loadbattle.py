@@ -0,0 +1,293 @@
+import asyncio
+import json
+import logging
+import statistics
+import time
+import msgpack
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from ulid import ULID
+from battle.codecs import CODECS, MSGPACK_SUBPROTOCOL
+from morisummon.models import Card, Deck
+
+PROTOCOLS = ("json", MSGPACK_SUBPROTOCOL)
+
+
+class BotTimeout(Exception):
+    pass
+
+
+class BotPlayer:
+    """
+    負荷試験用のボット1人分
+    受信したメッセージを読み続けて最新の battle.update を保持し、送ったアクションに対する battle.update までの時間を計る
+    """
+
+    def __init__(self, user, cookie: str, protocol: str, latencies: list[float], timeout: float):
+        self.user_id = str(user.id)
+        self.cookie = cookie
+        self.protocol = protocol
+        self.latencies = latencies
+        self.timeout = timeout
+        self.state: dict | None = None
+        self._communicator = None
+        self._reader: asyncio.Task | None = None
+        # (条件, 条件を満たした状態を受け取る Future)
+        self._waiters: list[tuple[callable, asyncio.Future]] = []
+
+    async def connect(self, application, slug: str) -> None:
+        from channels.testing import WebsocketCommunicator
+
+        self._communicator = WebsocketCommunicator(
+            application, f"/ws/battle/room/{slug}/",
+            headers=[(b"cookie", f"{settings.SESSION_COOKIE_NAME}={self.cookie}".encode())],
+            subprotocols=[] if self.protocol == "json" else [self.protocol],
+        )
+        connected, _ = await self._communicator.connect(timeout=self.timeout)
+        if not connected:
+            raise CommandError(f"Bot {self.user_id} could not connect to {slug}")
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def disconnect(self) -> None:
+        if self._reader:
+            self._reader.cancel()
+        if self._communicator:
+            await self._communicator.disconnect()
+
+    async def _read_loop(self) -> None:
+        while True:
+            output = await self._communicator.receive_output(timeout=3600)
+            if output["type"] == "websocket.close":
+                return
+            if output.get("bytes") is not None:
+                message = msgpack.unpackb(output["bytes"], raw=False, strict_map_key=False)
+            else:
+                message = json.loads(output["text"])
+
+            if message["type"] == "battle.update":
+                self.state = message["data"]
+                self._resolve()
+
+    def _resolve(self) -> None:
+        for waiter in list(self._waiters):
+            predicate, future = waiter
+            if not future.done() and predicate(self.state):
+                future.set_result(self.state)
+                self._waiters.remove(waiter)
+
+    async def wait_for(self, predicate) -> dict:
+        """predicate を満たす battle.update を受け取るまで待つ"""
+        if self.state is not None and predicate(self.state):
+            return self.state
+        future = asyncio.get_running_loop().create_future()
+        waiter = (predicate, future)
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise BotTimeout(f"Bot {self.user_id} timed out waiting for a battle update")
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    async def act(self, action: dict, after_version: int) -> dict:
+        """アクションを送り、それを反映した battle.update（version が after_version より新しいもの）を待つ"""
+        started = time.perf_counter()
+        waiting = asyncio.ensure_future(self.wait_for(lambda state: state["version"] > after_version))
+        await asyncio.sleep(0)
+        if self.protocol == "json":
+            await self._communicator.send_json_to(action)
+        else:
+            await self._communicator.send_to(bytes_data=CODECS[self.protocol].encode(action))
+        state = await waiting
+        self.latencies.append(time.perf_counter() - started)
+        return state
+
+
+SETUP_ACTIONS = (
+    {"type": "action.place_card", "card_index": 0, "to_field": "battle_card"},
+    {"type": "action.place_card", "card_index": 0, "to_field": "bench"},
+    {"type": "action.setup_complete"},
+)
+
+
+async def run_match(application, slug: str, bots: list[BotPlayer], max_turns: int, batch_setup: bool = False) -> bool:
+    """
+    2体のボットで1試合を行い、決着したかどうかを返す
+    セットアップ（place_card・setup_complete）の後、手番のボットが assign_energy → attack（エネルギー不足なら end_turn）を繰り返す
+    batch_setup の場合はセットアップを action.batch の1メッセージで送る
+    """
+    try:
+        for bot in bots:
+            await bot.connect(application, slug)
+        for bot in bots:
+            await bot.wait_for(lambda state: state["status"] == "setup")
+
+        version = max(bot.state["version"] for bot in bots)
+        for bot in bots:
+            if batch_setup:
+                version = (await bot.act({"type": "action.batch", "actions": list(SETUP_ACTIONS)}, version))["version"]
+                continue
+            for action in SETUP_ACTIONS:
+                version = (await bot.act(action, version))["version"]
+
+        by_id = {bot.user_id: bot for bot in bots}
+        state = await bots[0].wait_for(lambda state: state["status"] != "setup")
+        version = max(version, state["version"])
+        for _ in range(max_turns):
+            if state["status"] == "finished":
+                return True
+            bot = by_id[state["turn_player_id"]]
+            you = bot.state["you"]["status"]
+            if you["energy"] > 0:
+                state = await bot.act({"type": "action.assign_energy", "card_id": "battle_card"}, version)
+                version = state["version"]
+                you = state["you"]["status"]
+
+            card = you["battle_card"]
+            if card["energy"] >= (card["attack_needs_energy"] or 0):
+                action = {"type": "action.attack", "targetType": "battleCard"}
+            else:
+                action = {"type": "action.end_turn"}
+            state = await bot.act(action, version)
+            version = state["version"]
+        return state["status"] == "finished"
+    finally:
+        for bot in bots:
+            await bot.disconnect()
+
+
+def percentile(values: list[float], p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test BattleConsumer: run N concurrent matches of paired bots through config.asgi.application '
+        '(in-memory channel layer, mongomock and a throwaway test SQL database) and report matches/sec and '
+        'p50/p95/p99 action-to-update latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=50, help='Number of matches to play')
+        parser.add_argument('--concurrency', type=int, default=None, help='Matches in flight at once (default: all)')
+        parser.add_argument('--protocol', choices=PROTOCOLS, default='json', help='WebSocket codec (battle.codecs)')
+        parser.add_argument('--max-turns', type=int, default=200, help='Give up a match after this many turns')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for each battle update')
+        parser.add_argument('--batch-setup', action='store_true', help='Send each bot\'s setup as one action.batch message')
+        parser.add_argument('--mongo', action='store_true', help='Use the configured MongoDB instead of mongomock')
+        parser.add_argument('--output', '-o', help='Write the result as JSON to this file')
+
+    def handle(self, *args, **options):
+        if settings.CHANNEL_LAYERS['default']['BACKEND'] != 'channels.layers.InMemoryChannelLayer':
+            raise CommandError('loadbattle runs against the in-memory channel layer (CHANNEL_LAYER=memory)')
+        if not options['mongo']:
+            self._use_mongomock()
+        if options['verbosity'] < 2:
+            logging.disable(logging.INFO)
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            users, cookies = self._create_players(options['matches'] * 2)
+            result = asyncio.run(self._run(users, cookies, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            logging.disable(logging.NOTSET)
+
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"{result['completed']}/{result['matches']} matches in {result['elapsed']:.2f}s "
+            f"({result['matches_per_sec']:.1f} matches/s, {result['actions_per_sec']:.0f} actions/s, "
+            f"concurrency {result['concurrency']}, {result['protocol']})"
+        )
+        self.stdout.write(
+            f"action -> update latency: p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, "
+            f"p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms"
+        )
+        if result['errors']:
+            self.stdout.write(self.style.WARNING(f"{len(result['errors'])} matches failed: {result['errors'][0]}"))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2)
+
+    def _use_mongomock(self):
+        try:
+            import mongomock
+        except ImportError:
+            raise CommandError('mongomock is required as the MongoDB stand-in (pip install mongomock), or pass --mongo')
+        import mongoengine
+        mongoengine.disconnect()
+        mongoengine.connect(settings.MONGO_DATABASE, host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+
+    def _create_players(self, count: int):
+        """ボット用のユーザー・デッキとログイン済みのセッションを作る"""
+        cards = Card.objects.bulk_create([
+            Card(name=f'load{i}', hp=60, attack=30, attack_cost=i % 2, retreat_cost=1)
+            for i in range(settings.MORISUMMON_DECK_SIZE)
+        ])
+        card_ids = [card.id for card in cards]
+
+        User = get_user_model()
+        users = User.objects.bulk_create([User(username=f'loadbot{i}') for i in range(count)])
+        Deck.objects.bulk_create([Deck(user=user, card_ids=card_ids) for user in users])
+
+        cookies = []
+        client = Client()
+        for user in users:
+            client.force_login(user)
+            cookies.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+            client.cookies.clear()
+        return users, cookies
+
+    async def _run(self, users, cookies, options) -> dict:
+        from config.asgi import application
+
+        matches = options['matches']
+        concurrency = options['concurrency'] or matches
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: list[float] = []
+        errors: list[str] = []
+        run_id = str(ULID())
+
+        async def play(index: int) -> bool:
+            bots = [
+                BotPlayer(users[index * 2 + i], cookies[index * 2 + i], options['protocol'], latencies, options['timeout'])
+                for i in range(2)
+            ]
+            async with semaphore:
+                try:
+                    return await run_match(
+                        application, f'load-{run_id}-{index}', bots, options['max_turns'], options['batch_setup']
+                    )
+                except Exception as e:
+                    errors.append(f'{type(e).__name__}: {e}')
+                    return False
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(play(i) for i in range(matches)))
+        elapsed = time.perf_counter() - started
+
+        latencies_ms = [latency * 1000 for latency in latencies]
+        completed = sum(results)
+        return {
+            'matches': matches,
+            'completed': completed,
+            'concurrency': concurrency,
+            'protocol': options['protocol'],
+            'elapsed': elapsed,
+            'matches_per_sec': completed / elapsed if elapsed else 0.0,
+            'actions': len(latencies_ms),
+            'actions_per_sec': len(latencies_ms) / elapsed if elapsed else 0.0,
+            'latency_ms': {
+                'p50': percentile(latencies_ms, 50),
+                'p95': percentile(latencies_ms, 95),
+                'p99': percentile(latencies_ms, 99),
+                'max': max(latencies_ms, default=0.0),
+            },
+            'errors': errors,
+        }
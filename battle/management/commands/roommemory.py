@@ -0,0 +1,100 @@
+import gc
+import random
+import tracemalloc
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from battle import engine
+from battle.state import BattleRoomState, PlayerSetState, BattlePlayerInfoState, BattlePlayerStatusState
+from battle.store import RoomStore
+
+
+def build_card_templates(count: int) -> list[dict]:
+    """カードカタログ（battle.card_catalog）のひな形に相当するカードの初期値"""
+    return [
+        {
+            "id": str(i + 1),
+            "name": f"カード{i + 1}",
+            "image": f"/media/cards/card{i + 1:02}.png",
+            "energy": 0,
+            "attack_needs_energy": i % 3,
+            "escape_needs_energy": 1,
+            "hp": 60 + i,
+            "max_hp": 60 + i,
+            "attack": 20 + i,
+        }
+        for i in range(count)
+    ]
+
+
+def build_active_room(index: int, templates: list[dict], rng: random.Random) -> BattleRoomState:
+    """エンジンで対戦を開始し、両プレイヤーがカードを配置し終えた対戦中の部屋を作る"""
+    def player_set(user_id: str) -> PlayerSetState:
+        return PlayerSetState(
+            info=BattlePlayerInfoState(id=user_id, name=f"user{user_id}", channel_name=f"specific.{user_id}!channel"),
+            status=BattlePlayerStatusState(),
+        )
+
+    p1, p2 = str(index * 2 + 1), str(index * 2 + 2)
+    room = BattleRoomState(
+        id=f"{index:026}",
+        slug=f"room-{index}",
+        player1=player_set(p1),
+        player2=player_set(p2),
+        player_map={p1: "player1", p2: "player2"},
+    )
+    decks = {key: rng.sample(templates, len(templates)) for key in ("player1", "player2")}
+    engine.apply_internal(room, {"type": "battle.start", "decks": decks})
+    for player_id in (p1, p2):
+        engine.apply(room, {"type": "action.place_card", "player_id": player_id, "card_index": 0, "to_field": "battle_card"})
+        engine.apply(room, {"type": "action.place_card", "player_id": player_id, "card_index": 0, "to_field": "bench"})
+        engine.apply(room, {"type": "action.setup_complete", "player_id": player_id})
+    return room
+
+
+def measure(build) -> int:
+    """build() が確保したまま保持しているメモリ（バイト）を返す"""
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    del kept
+    return after - before
+
+
+class Command(BaseCommand):
+    help = 'Report bytes per active battle room (tracemalloc) for the runtime state, the room store and mongoengine documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=2000, help='Number of active rooms to build')
+        parser.add_argument('--deck-size', type=int, default=settings.MORISUMMON_DECK_SIZE, help='Cards per deck')
+
+    def handle(self, *args, **options):
+        count = options['rooms']
+        templates = build_card_templates(options['deck_size'])
+        rng = random.Random(0)
+        rooms = [build_active_room(i, templates, rng) for i in range(count)]
+
+        def store_rooms():
+            # ストアは保持する部屋を複製するため、部屋の状態・エントリ・インデックスの合計になる
+            store = RoomStore(flush_interval=0)
+            for room in rooms:
+                store._cache(room, dirty=False)
+            return store
+
+        tracemalloc.start()
+        try:
+            results = [
+                ('state', measure(lambda: [room.copy() for room in rooms])),
+                ('store', measure(store_rooms)),
+                ('document', measure(lambda: [room.to_document() for room in rooms])),
+                # 比較用：MongoDB に保存する SON（dict）のまま保持した場合
+                ('son', measure(lambda: [room.to_son() for room in rooms])),
+            ]
+        finally:
+            tracemalloc.stop()
+
+        self.stdout.write(f'{count} active rooms, {len(templates)} cards per deck')
+        for name, size in results:
+            per_room = size / count
+            self.stdout.write(f'{name:>8}: {per_room:9.0f} bytes/room, {2 ** 30 / per_room:9.0f} rooms/GiB')
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from uuid import uuid4
+from django.conf import settings
+from ulid import ULID
+from battle.card_catalog import card_catalog
+from morisummon.models import Deck
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKET = "default"
+
+
+@dataclass
+class MatchTicket:
+    """マッチングの待ち行列に並んでいる1ユーザー分の整理券"""
+    user_id: str
+    bucket: str = DEFAULT_BUCKET
+    id: str = field(default_factory=lambda: uuid4().hex)
+
+
+@dataclass(frozen=True)
+class Match:
+    """成立したマッチング（両者とも slug の部屋に接続する）"""
+    slug: str
+    # (先に待っていたユーザー, 後から来たユーザー)
+    players: tuple[str, str]
+
+
+def _new_match(waiting_user_id: str, user_id: str) -> Match:
+    return Match(slug=str(ULID()), players=(waiting_user_id, user_id))
+
+
+class MatchmakingBackend(ABC):
+    @abstractmethod
+    async def join(self, ticket: MatchTicket) -> Match | None:
+        """
+        同じ bucket で待っている相手がいれば取り出してマッチングを返す（取り出しは原子的に行う）
+        いなければ待ち行列に並べて None を返す
+        """
+
+    @abstractmethod
+    async def wait(self, ticket: MatchTicket, timeout: float | None = None) -> Match | None:
+        """並んでいる整理券のマッチングが成立するまで待つ（時間切れの場合は None）"""
+
+    @abstractmethod
+    async def cancel(self, ticket: MatchTicket) -> bool:
+        """待ち行列から取り除く。すでにマッチングが成立していた場合は False を返す"""
+
+
+class LocalMatchmakingBackend(MatchmakingBackend):
+    """
+    プロセス内の待ち行列によるマッチング
+    ・bucket ごとに user_id -> 整理券 の dict（挿入順＝並んだ順）を持ち、先頭の取り出し・取り消しとも O(1)
+    ・join() は await を挟まずに取り出しと登録を行うため、同じ相手を2人が取り合うことはない
+    """
+
+    def __init__(self):
+        self._queues: dict[str, dict[str, MatchTicket]] = {}
+        self._results: dict[str, asyncio.Future] = {}
+
+    async def join(self, ticket: MatchTicket) -> Match | None:
+        queue = self._queues.setdefault(ticket.bucket, {})
+
+        # 同じユーザーの古い整理券は取り消す（自分自身とはマッチングしない）
+        previous = queue.pop(ticket.user_id, None)
+        if previous is not None:
+            self._finish(previous, None)
+
+        waiting = next(iter(queue.values()), None)
+        if waiting is not None:
+            del queue[waiting.user_id]
+            if not queue:
+                del self._queues[ticket.bucket]
+            match = _new_match(waiting.user_id, ticket.user_id)
+            self._finish(waiting, match)
+            return match
+
+        queue[ticket.user_id] = ticket
+        self._results[ticket.id] = asyncio.get_running_loop().create_future()
+        return None
+
+    async def wait(self, ticket: MatchTicket, timeout: float | None = None) -> Match | None:
+        future = self._results.get(ticket.id)
+        if future is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if future.done():
+                self._results.pop(ticket.id, None)
+
+    async def cancel(self, ticket: MatchTicket) -> bool:
+        queue = self._queues.get(ticket.bucket)
+        if not queue or queue.get(ticket.user_id) is not ticket:
+            return False
+        del queue[ticket.user_id]
+        if not queue:
+            del self._queues[ticket.bucket]
+        self._finish(ticket, None)
+        self._results.pop(ticket.id, None)
+        return True
+
+    def _finish(self, ticket: MatchTicket, match: Match | None) -> None:
+        future = self._results.get(ticket.id)
+        if future is not None and not future.done():
+            future.set_result(match)
+
+
+class RedisMatchmakingBackend(MatchmakingBackend):
+    """
+    Redis の sorted set によるマッチング（複数ノード構成用）
+    ・bucket ごとの sorted set に user_id を並んだ時刻順に保持し、整理券は hash（user_id -> 整理券 id）に保持する
+    ・相手の取り出しと自分の登録は Lua スクリプトで原子的に行う
+    ・待っている間は生存確認用のキーを更新し続け、プロセスが落ちた整理券は取り出し時に読み飛ばす
+    ・成立したマッチングは整理券ごとのリストに書き込み、待っている側は BLPOP で受け取る
+    """
+
+    JOIN_SCRIPT = """
+local queue, tickets = KEYS[1], KEYS[2]
+local user_id, ticket_id, score, alive_prefix, ttl = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5]
+for _, member in ipairs(redis.call("zrange", queue, 0, 9)) do
+    if member ~= user_id then
+        local ticket = redis.call("hget", tickets, member)
+        redis.call("zrem", queue, member)
+        redis.call("hdel", tickets, member)
+        if ticket and redis.call("del", alive_prefix .. ticket) == 1 then
+            redis.call("zrem", queue, user_id)
+            redis.call("hdel", tickets, user_id)
+            return {member, ticket}
+        end
+    end
+end
+local previous = redis.call("hget", tickets, user_id)
+if previous then
+    redis.call("del", alive_prefix .. previous)
+end
+redis.call("zadd", queue, "NX", score, user_id)
+redis.call("hset", tickets, user_id, ticket_id)
+redis.call("set", alive_prefix .. ticket_id, "1", "PX", ttl)
+return false
+"""
+
+    CANCEL_SCRIPT = """
+if redis.call("hget", KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call("zrem", KEYS[1], ARGV[1])
+    redis.call("hdel", KEYS[2], ARGV[1])
+    redis.call("del", KEYS[3])
+    return 1
+end
+return 0
+"""
+
+    def __init__(self, url: str, ticket_ttl: float = 30.0, prefix: str = "morisummon:matchmaking:"):
+        self._url = url
+        self._ttl_ms = int(ticket_ttl * 1000)
+        self._heartbeat = ticket_ttl / 3
+        self._prefix = prefix
+        self._redis = None
+
+    def _client(self):
+        if self._redis is None:
+            from redis import asyncio as aioredis
+            self._redis = aioredis.from_url(self._url)
+        return self._redis
+
+    def _keys(self, bucket: str) -> list[str]:
+        return [f"{self._prefix}queue:{bucket}", f"{self._prefix}tickets:{bucket}"]
+
+    def _alive_key(self, ticket_id: str) -> str:
+        return f"{self._prefix}alive:{ticket_id}"
+
+    def _result_key(self, ticket_id: str) -> str:
+        return f"{self._prefix}result:{ticket_id}"
+
+    async def join(self, ticket: MatchTicket) -> Match | None:
+        client = self._client()
+        claimed = await client.eval(
+            self.JOIN_SCRIPT, 2, *self._keys(ticket.bucket),
+            ticket.user_id, ticket.id, time.time(), self._alive_key(""), self._ttl_ms,
+        )
+        if not claimed:
+            return None
+
+        waiting_user_id, waiting_ticket_id = (value.decode() for value in claimed)
+        match = _new_match(waiting_user_id, ticket.user_id)
+        result_key = self._result_key(waiting_ticket_id)
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.rpush(result_key, json.dumps({"slug": match.slug, "players": match.players}))
+            pipe.pexpire(result_key, self._ttl_ms)
+            await pipe.execute()
+        return match
+
+    async def wait(self, ticket: MatchTicket, timeout: float | None = None) -> Match | None:
+        client = self._client()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        result_key = self._result_key(ticket.id)
+        while True:
+            block = self._heartbeat if deadline is None else min(self._heartbeat, deadline - loop.time())
+            if block <= 0:
+                item = await client.lpop(result_key)
+            else:
+                item = await client.blpop([result_key], timeout=block)
+                item = item[1] if item else None
+            if item:
+                return self._decode_match(item)
+            if deadline is not None and loop.time() >= deadline:
+                return None
+            # 待っている間は整理券が有効であることを示し続ける
+            if not await client.set(self._alive_key(ticket.id), "1", px=self._ttl_ms, xx=True):
+                # 取り出し済み（結果は直後に書き込まれる）か、取り消し・並び直し済み
+                item = await client.blpop([result_key], timeout=1)
+                return self._decode_match(item[1]) if item else None
+
+    @staticmethod
+    def _decode_match(item: bytes) -> Match:
+        data = json.loads(item)
+        return Match(slug=data["slug"], players=tuple(data["players"]))
+
+    async def cancel(self, ticket: MatchTicket) -> bool:
+        client = self._client()
+        removed = await client.eval(
+            self.CANCEL_SCRIPT, 3, *self._keys(ticket.bucket), self._alive_key(ticket.id),
+            ticket.user_id, ticket.id,
+        )
+        return bool(removed)
+
+
+class MatchmakingManager:
+    """
+    対戦相手のマッチング
+    ・待ち行列の先頭から相手を取り出すだけなので、待っている人数に関わらず一定の時間でマッチングする
+    ・bucket（デッキの強さなど）が同じユーザー同士のみマッチングする
+    """
+
+    def __init__(self, backend: MatchmakingBackend = None):
+        self._backend = backend
+
+    @property
+    def backend(self) -> MatchmakingBackend:
+        if self._backend is None:
+            self._backend = self._create_backend()
+        return self._backend
+
+    def _create_backend(self) -> MatchmakingBackend:
+        name = getattr(settings, "MORISUMMON_MATCHMAKING_BACKEND", "local")
+        if name == "redis":
+            return RedisMatchmakingBackend(
+                url=settings.MORISUMMON_REDIS_URL,
+                ticket_ttl=getattr(settings, "MORISUMMON_MATCHMAKING_TICKET_TTL", 30.0),
+            )
+        if name == "local":
+            return LocalMatchmakingBackend()
+        raise ValueError(f"Unknown matchmaking backend: {name}")
+
+    async def join(self, user_id: str, bucket: str = DEFAULT_BUCKET) -> tuple[MatchTicket, Match | None]:
+        ticket = MatchTicket(user_id=str(user_id), bucket=bucket)
+        return ticket, await self.backend.join(ticket)
+
+    async def wait(self, ticket: MatchTicket, timeout: float | None = None) -> Match | None:
+        return await self.backend.wait(ticket, timeout)
+
+    async def cancel(self, ticket: MatchTicket) -> bool:
+        return await self.backend.cancel(ticket)
+
+    async def find_match(self, user_id: str, bucket: str = DEFAULT_BUCKET, timeout: float | None = None) -> Match | None:
+        """待ち行列に並び、timeout 秒以内にマッチングが成立しなければ取り消して None を返す"""
+        ticket, match = await self.join(user_id, bucket)
+        if match is not None:
+            return match
+        try:
+            match = await self.wait(ticket, timeout)
+        except asyncio.CancelledError:
+            await self.cancel(ticket)
+            raise
+        if match is None and not await self.cancel(ticket):
+            # 取り消す直前に相手が見つかっていた
+            match = await self.wait(ticket, 1.0)
+        return match
+
+
+DECK_NOT_READY_MESSAGE = f"デッキが{settings.MORISUMMON_DECK_SIZE}枚編成されていません。編成後、再度対戦をお試しください。"
+
+
+async def get_match_deck(user) -> Deck | None:
+    """対戦に使うデッキを取得する（規定の枚数で編成されていない場合は None）"""
+    deck = await Deck.objects.filter(user=user).afirst()
+    if not deck or len(deck.card_ids) != settings.MORISUMMON_DECK_SIZE:
+        return None
+    return deck
+
+
+async def get_match_bucket(deck: Deck) -> str:
+    """
+    マッチングの bucket を決める
+    MORISUMMON_MATCHMAKING_DECK_POWER_BUCKET が設定されている場合は、
+    デッキの強さ（カードの HP + 攻撃力の合計）をその幅で区切った bucket にする
+    """
+    width = getattr(settings, "MORISUMMON_MATCHMAKING_DECK_POWER_BUCKET", 0)
+    if not width:
+        return DEFAULT_BUCKET
+    templates = await card_catalog.get_templates()
+    power = 0
+    for card_id in deck.card_ids:
+        template = templates.get(card_id)
+        if template:
+            power += (template["hp"] or 0) + (template["attack"] or 0)
+    return f"power-{power // width}"
+
+
+matchmaking = MatchmakingManager()
@@ -1,5 +1,6 @@
 import datetime
 from enum import Enum
+from django.conf import settings
 from django.db import models
 from mongoengine import *
 
@@ -83,11 +84,60 @@ class BattleRoom(Document):
     turn_player_id = StringField(null=True)
     winner = StringField(null=True)
 
+    # 楽観的排他制御用のバージョン（保存のたびに1増える）
+    version = IntField(default=0)
+    # 反映済みの行動ログ（BattleLogEntry）の seq
+    log_seq = IntField(default=0)
+    # 観戦中の接続数（0 の間は観戦者向けのデータを作らない。battle.consumers.spectator_consumer）
+    spectator_count = IntField(default=0)
+
     created_at = DateTimeField(default=datetime.datetime.now)
+    # 最後に操作された日時（UTC）。MORISUMMON_BATTLE_ROOM_TTL 秒操作の無い部屋は TTL インデックスで削除される
+    last_activity_at = DateTimeField(default=lambda: datetime.datetime.now(datetime.timezone.utc))
 
     meta = {
-        'collection': 'battle_rooms'
+        'collection': 'battle_rooms',
+        # インデックスは cleanmongo --ensure-indexes で作成・更新する（TTL の設定を変更しても、
+        # 初回アクセス時の自動作成が IndexOptionsConflict で失敗しないようにする）
+        'auto_create_index': False,
+        'indexes': [
+            # slug からの部屋の取得（slug の無い部屋は対象外）
+            {'fields': ['slug'], 'unique': True, 'partialFilterExpression': {'slug': {'$type': 'string'}}},
+            # 相手待ちの部屋の検索
+            {'fields': ['player2', 'status', 'created_at']},
+            {'fields': ['last_activity_at'], 'expireAfterSeconds': settings.MORISUMMON_BATTLE_ROOM_TTL},
+        ],
     }
 
     def __str__(self):
         return f"{self.player1.name} vs {self.player2.name}"
+
+
+class BattleLogEntryKind(Enum):
+    ACTION = 'action'
+    SNAPSHOT = 'snapshot'
+
+class BattleLogEntry(Document):
+    """
+    バトルの行動ログ（追記のみ、battle.action_log）
+    data は msgpack で、ACTION は {"action": ..., "events": [...]}、SNAPSHOT はその時点のバトルルームの SON
+    """
+    room_id = StringField(required=True)
+    seq = IntField(required=True)
+    kind = EnumField(BattleLogEntryKind, required=True)
+    data = BinaryField()
+    # このエントリで決着した
+    finished = BooleanField(default=False)
+    created_at = DateTimeField(default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    meta = {
+        'collection': 'battle_log_entries',
+        # インデックスは cleanmongo --ensure-indexes で作成・更新する（BattleRoom と同じ）
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['room_id', 'seq'], 'unique': True},
+            # 決着した対戦の書き出し（exportbattlelog --finished）
+            {'fields': ['finished'], 'partialFilterExpression': {'finished': True}},
+            {'fields': ['created_at'], 'expireAfterSeconds': settings.MORISUMMON_BATTLE_LOG_TTL},
+        ],
+    }
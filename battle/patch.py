@@ -0,0 +1,57 @@
+"""
+2つの JSON 互換の値の差分を RFC 6902 (JSON Patch) 形式で求める
+"""
+
+
+def make_patch(old, new) -> list[dict]:
+    """old を new に変換する JSON Patch の操作リストを返す（差分が無ければ空リスト）"""
+    ops: list[dict] = []
+    _diff(old, new, "", ops)
+    return ops
+
+
+def _escape(key) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _diff(old, new, path: str, ops: list[dict]) -> None:
+    if old == new and type(old) is type(new):
+        return
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": child, "value": value})
+            else:
+                _diff(old[key], value, child, ops)
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, ops)
+    else:
+        ops.append({"op": "replace", "path": path, "value": new})
+
+
+def _diff_list(old: list, new: list, path: str, ops: list[dict]) -> None:
+    old_len = len(old)
+    new_len = len(new)
+
+    if new_len == old_len:
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            _diff(old_item, new_item, f"{path}/{index}", ops)
+    # 末尾への追加
+    elif new_len > old_len and new[:old_len] == old:
+        for item in new[old_len:]:
+            ops.append({"op": "add", "path": f"{path}/-", "value": item})
+    # 先頭から取り除いた
+    elif new_len < old_len and new == old[old_len - new_len:]:
+        for _ in range(old_len - new_len):
+            ops.append({"op": "remove", "path": f"{path}/0"})
+    # 末尾から取り除いた
+    elif new_len < old_len and new == old[:new_len]:
+        for index in range(old_len - 1, new_len - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{index}"})
+    else:
+        ops.append({"op": "replace", "path": path, "value": new})
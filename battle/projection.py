@@ -0,0 +1,173 @@
+"""
+BattleRoom から各プレイヤーに送る表示用データ（projection）を組み立てる
+
+バトルルーム（battle.state の状態、または battle.models のドキュメント）を1度だけたどって JSON 互換の dict にし、
+フィールドごとの公開範囲（battle/memo.txt 参照）に従って各プレイヤー用に組み立てる。
+観戦者用のデータ（spectator）は双方を相手側として扱い、公開される情報のみにする。
+"""
+import datetime
+from enum import Enum
+from bson import json_util
+from mongoengine.base import BaseDocument
+from battle.models import BattleRoom, BattleRoomStatus
+from battle.state import CompactState, BattleRoomState
+
+# 公開範囲
+PUBLIC = "public"   # .key   双方に公開
+OWNER = "owner"     # ._key  本人しか確認できない
+SERVER = "server"   # バックエンドでのみ処理する非公開状態
+
+# BattleRoom の公開範囲（指定の無いフィールドは PUBLIC）
+ROOM_VISIBILITY = {
+    "last_activity_at": SERVER,
+    "log_seq": SERVER,
+    "spectator_count": SERVER,
+}
+
+# BattlePlayerStatus の公開範囲（指定の無いフィールドは PUBLIC）
+STATUS_VISIBILITY = {
+    "_hand_cards": OWNER,
+    "_deck_cards": OWNER,
+}
+
+# セットアップフェーズ中、相手には配置済みであることだけを見せるフィールド
+SETUP_HIDDEN_FIELDS = ("battle_card", "bench_cards")
+PLACEHOLDER = {"placeholder": "配置済"}
+
+# ドキュメントクラスごとの (フィールド名, 保存名, null許可) の一覧
+_field_specs: dict[type, list[tuple[str, str, bool]]] = {}
+
+
+def _specs(cls) -> list[tuple[str, str, bool]]:
+    specs = _field_specs.get(cls)
+    if specs is None:
+        specs = [(name, cls._fields[name].db_field, cls._fields[name].null) for name in cls._fields_ordered]
+        # to_mongo() と同じく _id を先頭にする
+        specs.sort(key=lambda spec: spec[1] != "_id")
+        _field_specs[cls] = specs
+    return specs
+
+
+def to_plain(value):
+    """
+    ドキュメントを room.to_json() を json.loads() した場合と同じ dict に変換する
+    （JSON 文字列を経由しない）
+    """
+    if isinstance(value, CompactState):
+        data = {}
+        for name, db_field, null in _specs(value.document):
+            item = getattr(value, name)
+            if item is not None:
+                data[db_field] = to_plain(item)
+            elif null:
+                data[db_field] = None
+        return data
+    if isinstance(value, BaseDocument):
+        data = {}
+        values = value._data
+        for name, db_field, null in _specs(type(value)):
+            item = values.get(name)
+            if item is not None:
+                data[db_field] = to_plain(item)
+            elif null:
+                data[db_field] = None
+        return data
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime.datetime):
+        return json_util.default(value, json_options=json_util.LEGACY_JSON_OPTIONS)
+    return value
+
+
+def _is_setup(status) -> bool:
+    return status == BattleRoomStatus.SETUP or status == BattleRoomStatus.SETUP.value
+
+
+def _project_status(status: dict, is_owner: bool, is_setup: bool) -> dict:
+    view = {}
+    for key, value in status.items():
+        visibility = STATUS_VISIBILITY.get(key, PUBLIC)
+        if visibility == SERVER or (visibility == OWNER and not is_owner):
+            continue
+        if key == "_hand_cards":
+            # 手札は最後に hand_cards として追加する
+            continue
+        if is_setup and not is_owner and key in SETUP_HIDDEN_FIELDS and value:
+            if isinstance(value, list):
+                value = [dict(PLACEHOLDER) if card else None for card in value]
+            else:
+                value = dict(PLACEHOLDER)
+        view[key] = value
+
+    if is_owner:
+        view["hand_cards"] = status.get("_hand_cards", [])
+    else:
+        # 相手の手札は枚数のみ
+        hand_count = status.get("hand_cards_count", len(status.get("_hand_cards", [])))
+        view["hand_cards"] = f"{hand_count}枚"
+    return view
+
+
+def _project_player(player: dict, is_owner: bool, is_setup: bool) -> dict:
+    view = {}
+    for key, value in player.items():
+        if key == "status" and value is not None:
+            value = _project_status(value, is_owner, is_setup)
+        view[key] = value
+    return view
+
+
+def _project_spectator(common: dict, player1: dict | None, player2: dict | None, is_setup: bool) -> dict:
+    view = dict(common)
+    view["player1"] = _project_player(player1, is_owner=False, is_setup=is_setup) if player1 else None
+    view["player2"] = _project_player(player2, is_owner=False, is_setup=is_setup) if player2 else None
+    return view
+
+
+def project_views(room: BattleRoomState | BattleRoom, spectator: bool = False) -> dict[str, dict]:
+    """
+    player1 / player2 それぞれに送る表示用データを返す
+    {"player1": {...}, "player2": {...}}（player2 がいない場合は player1 のみ）
+    spectator=True の場合は観戦者用のデータ（両者の手札・山札を隠したもの）を "spectator" に加える
+    """
+    data = to_plain(room)
+    for key, visibility in ROOM_VISIBILITY.items():
+        if visibility == SERVER:
+            data.pop(key, None)
+    player1 = data.get("player1")
+    player2 = data.get("player2")
+    common = {key: value for key, value in data.items() if key not in ("player1", "player2")}
+    is_setup = _is_setup(room.status)
+
+    # 対戦相手がいない場合は waiting 状態にして opponent を空の辞書にする
+    if not player2:
+        data["status"] = "waiting"
+        data["opponent"] = {}
+        views = {"player1": data}
+        if spectator:
+            views["spectator"] = _project_spectator(dict(common, status="waiting"), player1, None, is_setup)
+        return views
+
+    views = {}
+    for you_are, you, opponent in (("player1", player1, player2), ("player2", player2, player1)):
+        view = dict(common)
+        view["you"] = _project_player(you, is_owner=True, is_setup=is_setup)
+        view["opponent"] = _project_player(opponent, is_owner=False, is_setup=is_setup) if opponent else {}
+        views[you_are] = view
+    if spectator:
+        views["spectator"] = _project_spectator(common, player1, player2, is_setup)
+    return views
+
+
+def project_view(room: BattleRoomState | BattleRoom, you_are: str) -> dict:
+    """指定したプレイヤーに送る表示用データを返す"""
+    return project_views(room)[you_are]
+
+
+def project_spectator_view(room: BattleRoomState | BattleRoom) -> dict:
+    """観戦者に送る表示用データを返す"""
+    return project_views(room, spectator=True)["spectator"]
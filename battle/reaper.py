@@ -0,0 +1,145 @@
+import asyncio
+import heapq
+import logging
+import time
+from channels.layers import get_channel_layer
+from django.conf import settings
+from battle.locks import room_locks, RoomLockTimeout
+from battle.models import BattleRoom
+from battle.state import BattleRoomState
+from battle.store import room_store
+
+logger = logging.getLogger(__name__)
+
+
+class RoomReaper:
+    """
+    切断されたまま再接続の無いバトルルームを期限切れにするバックグラウンドタスク
+    ・部屋ごとにタスクを作らず、期限を heap で管理する1つのタスクが一定間隔（MORISUMMON_BATTLE_REAPER_INTERVAL 秒）でまとめて処理する
+    ・期限までにプレイヤーが再接続した場合は cancel() で取り消す
+    ・期限切れの部屋は MongoDB からまとめて削除してから、残っているプレイヤーに通知する
+      （確認は部屋ごとにロックを取得して行い、次の部屋の前に解放する。確認から削除までの間に
+      再接続などで更新された部屋は、削除時の version の確認で除外する）
+    """
+
+    def __init__(self, grace: float | None = None, interval: float | None = None, batch_size: int = 100):
+        self._grace = grace
+        self._interval = interval
+        self._batch_size = batch_size
+        # room_id -> (期限, slug)
+        self._deadlines: dict[str, tuple[float, str]] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._task: asyncio.Task | None = None
+
+    @property
+    def grace(self) -> float:
+        if self._grace is not None:
+            return self._grace
+        return getattr(settings, "MORISUMMON_BATTLE_RECONNECT_GRACE", 0)
+
+    @property
+    def interval(self) -> float:
+        if self._interval is not None:
+            return self._interval
+        return getattr(settings, "MORISUMMON_BATTLE_REAPER_INTERVAL", 5.0)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._deadlines
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, room_id: str, slug: str, delay: float | None = None) -> None:
+        """delay 秒後（省略時は猶予期間後）に部屋を期限切れにする。すでに予定がある場合は早い方を残す"""
+        deadline = time.monotonic() + (self.grace if delay is None else delay)
+        current = self._deadlines.get(room_id)
+        if current is not None and current[0] <= deadline:
+            return
+        self._deadlines[room_id] = (deadline, slug)
+        heapq.heappush(self._heap, (deadline, room_id))
+        self._ensure_task()
+
+    def cancel(self, room_id: str) -> None:
+        """期限切れの予定を取り消す（heap からは取り出し時に読み飛ばす）"""
+        self._deadlines.pop(room_id, None)
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while self._deadlines:
+            await asyncio.sleep(self.interval)
+            try:
+                while await self.expire_due():
+                    pass
+            except Exception as e:
+                logger.error(f"バトルルームの期限切れ処理に失敗しました: {e}")
+        self._heap.clear()
+
+    def _pop_due(self, now: float) -> list[tuple[str, str]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self._batch_size:
+            deadline, room_id = heapq.heappop(self._heap)
+            current = self._deadlines.get(room_id)
+            if current is None or current[0] != deadline:
+                # 取り消し済み・予定が変更済み
+                continue
+            del self._deadlines[room_id]
+            due.append((room_id, current[1]))
+        return due
+
+    async def expire_due(self, now: float | None = None) -> list[str]:
+        """期限を過ぎた部屋をまとめて期限切れにし、削除した部屋の id を返す"""
+        due = self._pop_due(time.monotonic() if now is None else now)
+        if not due:
+            return []
+
+        # 操作中の部屋を待つ間も他の部屋のロックを保持しない（プレイヤーの操作を待たせない）
+        candidates: dict[str, BattleRoomState] = {}
+        for room_id, slug in due:
+            try:
+                async with room_locks.lock(slug):
+                    room = await self._expirable_room(room_id)
+            except RoomLockTimeout:
+                # 操作中の部屋は次回に回す
+                self.schedule(room_id, slug, delay=self.interval)
+                continue
+            if room is not None:
+                candidates[room_id] = room
+
+        if not candidates:
+            return []
+        expired = await room_store.delete_many(
+            list(candidates), versions={room_id: room.version for room_id, room in candidates.items()}
+        )
+        for room_id in expired:
+            await self._notify_players(candidates[room_id])
+
+        if expired:
+            logger.info(f"Expired {len(expired)} abandoned battle rooms")
+        return expired
+
+    async def _expirable_room(self, room_id: str) -> BattleRoomState | None:
+        """期限切れにする部屋を返す（猶予期間内に再接続した・削除済みの場合は None）"""
+        try:
+            room = await room_store.get(id=room_id)
+        except BattleRoom.DoesNotExist:
+            return None
+
+        players = [player for player in (room.player1, room.player2) if player]
+        if all(player.info.is_connected for player in players):
+            # 猶予期間内に再接続した
+            return None
+        return room
+
+    async def _notify_players(self, room: BattleRoomState) -> None:
+        channel_layer = get_channel_layer()
+        for player in (room.player1, room.player2):
+            if player and player.info.is_connected and not room.winner:
+                await channel_layer.send(player.info.channel_name, {
+                    "type": "error",
+                    "message": "相手が切断しました"
+                })
+
+room_reaper = RoomReaper()
@@ -1,7 +1,8 @@
 from django.urls import path
-from .consumers import battle_consumer
+from .consumers import battle_consumer, matchmaking_consumer, spectator_consumer
 
 websocket_urlpatterns = [
-    # path('ws/battle/find/', consumers.SearchBattleConsumer.as_asgi()),
+    path('ws/battle/find/', matchmaking_consumer.MatchmakingConsumer.as_asgi()),
     path('ws/battle/room/<str:slug>/', battle_consumer.BattleConsumer.as_asgi()),
+    path('ws/battle/room/<str:slug>/watch/', spectator_consumer.SpectatorConsumer.as_asgi()),
 ]
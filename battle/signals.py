@@ -0,0 +1,12 @@
+# signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from morisummon.models import Card
+from .card_catalog import card_catalog
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def invalidate_card_catalog(sender, instance, **kwargs):
+    # カード情報が変わった場合はカタログを読み込み直す
+    card_catalog.invalidate()
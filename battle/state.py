@@ -0,0 +1,178 @@
+"""
+対戦中のバトルルームを表す軽量な状態クラス
+
+mongoengine のドキュメント（battle.models）は1インスタンスごとに _data の dict や変更履歴を持つため、
+対戦中の部屋をメモリに多数保持するには重い。ここでは同じ属性名を持つ __slots__ のクラスで状態を表し、
+ドキュメント・SON との変換は MongoDB への読み書きの時だけ行う。
+
+・フィールドの定義（属性名・保存名・null 許可・デフォルト値）は対応するドキュメントクラスから取得する
+  （battle.models にフィールドを追加すれば、こちらにもそのまま反映される）
+・to_son() は Document.to_mongo() と同じ内容の dict を返す
+"""
+from enum import Enum
+from mongoengine.base import BaseDocument
+from mongoengine.fields import DictField, EmbeddedDocumentField, EnumField, ListField
+from battle.models import BattleRoom, PlayerSet, BattlePlayerInfo, BattlePlayerStatus, BattleCardInfo
+
+# フィールドの種類
+SCALAR = 0
+ENUM = 1
+EMBEDDED = 2
+EMBEDDED_LIST = 3
+LIST = 4
+DICT = 5
+
+_MISSING = object()
+
+# ドキュメントクラス -> 状態クラス
+_state_classes: dict[type[BaseDocument], type["CompactState"]] = {}
+
+
+def _field_spec(field) -> tuple:
+    """(属性名, 保存名, null許可, 種類, 参照先, デフォルト値) を返す"""
+    ref = None
+    if isinstance(field, EmbeddedDocumentField):
+        kind, ref = EMBEDDED, _state_classes[field.document_type]
+    elif isinstance(field, ListField) and isinstance(field.field, EmbeddedDocumentField):
+        kind, ref = EMBEDDED_LIST, _state_classes[field.field.document_type]
+    elif isinstance(field, ListField):
+        kind = LIST
+    elif isinstance(field, EnumField):
+        kind, ref = ENUM, field._enum_cls
+    elif isinstance(field, DictField):
+        kind = DICT
+    else:
+        kind = SCALAR
+    return field.name, field.db_field, field.null, kind, ref, field.default
+
+
+def _default(default):
+    if callable(default):
+        return default()
+    if isinstance(default, (list, dict)):
+        return type(default)(default)
+    return default
+
+
+class CompactState:
+    """状態クラスの基底クラス（サブクラスは document と __slots__ を定義する）"""
+    __slots__ = ()
+    document: type[BaseDocument]
+    _specs: tuple = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _state_classes[cls.document] = cls
+        specs = [_field_spec(cls.document._fields[name]) for name in cls.document._fields_ordered]
+        # to_mongo() と同じく _id を先頭にする
+        specs.sort(key=lambda spec: spec[1] != "_id")
+        cls._specs = tuple(specs)
+
+    def __init__(self, **values):
+        for name, _, _, _, _, default in self._specs:
+            value = values.pop(name, _MISSING)
+            setattr(self, name, _default(default) if value is _MISSING else value)
+        if values:
+            raise TypeError(f"{type(self).__name__} has no field(s) {', '.join(values)}")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{spec[0]}={getattr(self, spec[0])!r}' for spec in self._specs)})"
+
+    @classmethod
+    def from_son(cls, son: dict):
+        """MongoDB から読み込んだ SON（dict）から状態を作る"""
+        obj = object.__new__(cls)
+        for name, db_field, _, kind, ref, default in cls._specs:
+            value = son.get(db_field, _MISSING)
+            if value is _MISSING:
+                value = _default(default)
+            elif value is not None:
+                if kind == EMBEDDED:
+                    value = ref.from_son(value)
+                elif kind == EMBEDDED_LIST:
+                    value = [ref.from_son(item) if item is not None else None for item in value]
+                elif kind == ENUM:
+                    value = ref(value)
+                elif kind == LIST:
+                    value = list(value)
+                elif kind == DICT:
+                    value = dict(value)
+            setattr(obj, name, value)
+        return obj
+
+    @classmethod
+    def from_document(cls, document: BaseDocument):
+        return _state_classes[type(document)].from_son(document.to_mongo())
+
+    def to_son(self) -> dict:
+        """Document.to_mongo() と同じ内容の dict を返す"""
+        son = {}
+        for name, db_field, null, kind, ref, _ in self._specs:
+            value = getattr(self, name)
+            if value is not None:
+                if kind == EMBEDDED:
+                    value = value.to_son()
+                elif kind == EMBEDDED_LIST:
+                    value = [item.to_son() if item is not None else None for item in value]
+                elif kind == ENUM:
+                    # 文字列で代入された場合も Enum の値にそろえる
+                    value = ref(value).value
+                elif kind == LIST:
+                    value = list(value)
+                elif kind == DICT:
+                    value = dict(value)
+            if value is not None or null:
+                son[db_field] = value
+        return son
+
+    def to_document(self, created: bool = False) -> BaseDocument:
+        return self.document._from_son(self.to_son(), created=created)
+
+    def copy(self):
+        """状態を複製する（埋め込みの状態・リスト・辞書も複製する）"""
+        obj = object.__new__(type(self))
+        for name, _, _, kind, _, _ in self._specs:
+            value = getattr(self, name)
+            if value is not None:
+                if kind == EMBEDDED:
+                    value = value.copy()
+                elif kind == EMBEDDED_LIST:
+                    value = [item.copy() if item is not None else None for item in value]
+                elif kind == LIST:
+                    value = list(value)
+                elif kind == DICT:
+                    value = dict(value)
+            setattr(obj, name, value)
+        return obj
+
+    def assign(self, other) -> None:
+        """other（同じ型の状態）の内容で置き換える（複製はしないため、以後 other は変更しないこと）"""
+        for name, _, _, _, _, _ in self._specs:
+            setattr(self, name, getattr(other, name))
+
+
+class BattleCardState(CompactState):
+    document = BattleCardInfo
+    __slots__ = BattleCardInfo._fields_ordered
+
+
+class BattlePlayerInfoState(CompactState):
+    document = BattlePlayerInfo
+    __slots__ = BattlePlayerInfo._fields_ordered
+
+
+class BattlePlayerStatusState(CompactState):
+    document = BattlePlayerStatus
+    __slots__ = BattlePlayerStatus._fields_ordered
+
+
+class PlayerSetState(CompactState):
+    document = PlayerSet
+    __slots__ = PlayerSet._fields_ordered
+
+
+class BattleRoomState(CompactState):
+    document = BattleRoom
+    __slots__ = BattleRoom._fields_ordered
+
+    DoesNotExist = BattleRoom.DoesNotExist
@@ -0,0 +1,272 @@
+import asyncio
+import datetime
+import logging
+from dataclasses import dataclass, field
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from battle.action_log import action_log
+from battle.models import BattleRoom
+from battle.state import BattleRoomState
+from battle.updates import build_update
+
+logger = logging.getLogger(__name__)
+
+
+class BattleRoomConflict(Exception):
+    """別の処理が先にバトルルームを更新していた場合に送出する（読み直して再試行すること）"""
+
+    def __init__(self, room_id: str):
+        super().__init__(f"BattleRoom {room_id} was modified concurrently")
+        self.room_id = room_id
+
+
+@dataclass(slots=True)
+class RoomEntry:
+    """ストア内の1部屋分の状態"""
+    state: BattleRoomState
+    # MongoDB に書き出し済みの状態（変更が無い間は state と同じオブジェクト）
+    persisted: BattleRoomState
+    slug: str | None = None
+    dirty: bool = False
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class RoomStore:
+    """
+    対戦中のバトルルームをプロセス内メモリに保持するストア
+    ・読み込みはメモリから行い、MongoDB へのアクセスはキャッシュに無い場合のみ
+    ・書き込みは一定間隔（MORISUMMON_BATTLE_FLUSH_INTERVAL 秒）またはターンの区切りでまとめて MongoDB に反映する
+    ・保持するのは軽量な状態（battle.state.BattleRoomState）で、取得・保存のたびに複製する
+      （保存されていない変更が他の処理から見えてしまうことを防ぐ）
+    ・ドキュメント・SON との変換は MongoDB への読み書きの時だけ行う
+    ・書き出しは MongoDB 上の内容との差分のみを送る（battle.updates.build_update）
+    ・BattleRoom.version による楽観的排他制御を行い、競合時は BattleRoomConflict を送出する
+      複数のプロセスが同じ部屋を扱う構成（MORISUMMON_BATTLE_STORE_SHARED）では保存のたびに書き出し、
+      競合を put() の呼び出し元（ユニットオブワークの再試行）に返す
+      まとめて書き出す構成で書き出しが競合した場合は、部屋の参加者に最新の状態を送り直させる（battle.resync）
+    ・MORISUMMON_BATTLE_STORE_SHARED の場合、キャッシュから返す前に MongoDB 上の version と比べ、
+      他のプロセスが更新していれば読み直す（部屋のロックを取得した後の get() が古い状態を返さないようにする）
+    ・MongoDB から読み込んだ部屋に書き出されていない行動は、行動ログ（battle.action_log）から再生して復元する
+    """
+
+    def __init__(self, flush_interval: float | None = None):
+        self._flush_interval = flush_interval
+        self._entries: dict[str, RoomEntry] = {}
+        self._slugs: dict[str, str] = {}
+        self._flusher: asyncio.Task | None = None
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, "MORISUMMON_BATTLE_FLUSH_INTERVAL", 0)
+
+    @property
+    def shared(self) -> bool:
+        """他のプロセスも同じ部屋を更新し得るかどうか"""
+        return getattr(settings, "MORISUMMON_BATTLE_STORE_SHARED", False)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, id: str = None, slug: str = None) -> BattleRoomState:
+        """
+        バトルルームを取得する
+        キャッシュに無い場合は MongoDB から読み込んでキャッシュする
+        見つからない場合は BattleRoom.DoesNotExist を送出する
+        """
+        room_id = id if id else self._slugs.get(slug)
+        entry = self._entries.get(room_id) if room_id else None
+        if entry is not None and self.shared and not entry.dirty:
+            if await self._load_version(room_id) != entry.persisted.version:
+                logger.debug(f"Battle room {room_id} was updated by another process, reloading")
+                self.evict(room_id)
+                entry = None
+        if entry is not None:
+            return entry.state.copy()
+
+        room = await self._load(id=id, slug=slug)
+        # 最後の書き出し以降の行動が行動ログにあれば再生する（書き出す前にプロセスが落ちた場合など）
+        recovered = await action_log.recover(room)
+        if room.id in self._entries:
+            # 読み込み中に別の処理がキャッシュした場合はそちらを正とする
+            return self._entries[room.id].state.copy()
+
+        self._cache(room, dirty=False)
+        if recovered is not None:
+            logger.info(f"Recovered battle room {room.id} from the action log (seq {room.log_seq} -> {recovered.log_seq})")
+            self._cache(recovered, dirty=True)
+            if self.flush_interval <= 0 or self.shared:
+                await self.flush(room.id)
+            else:
+                self._ensure_flusher()
+            return recovered
+        return room
+
+    async def insert(self, room: BattleRoomState) -> None:
+        """新しいバトルルームを作成する（マッチングで参照されるため即時書き込み）"""
+        await database_sync_to_async(room.to_document(created=True).save)()
+        self._cache(room, dirty=False)
+
+    async def put(self, room: BattleRoomState) -> None:
+        """
+        バトルルームの変更をストアに反映する
+        取得後に別の処理が先に保存していた場合は BattleRoomConflict を送出する
+        """
+        entry = self._entries.get(room.id)
+        if entry is not None and room.version != entry.state.version:
+            raise BattleRoomConflict(room.id)
+
+        room.version += 1
+        # TTL インデックス（BattleRoom.last_activity_at）による削除を先送りする
+        room.last_activity_at = datetime.datetime.now(datetime.timezone.utc)
+        self._cache(room, dirty=True)
+        if self.flush_interval <= 0 or self.shared:
+            await self.flush(room.id)
+        else:
+            self._ensure_flusher()
+
+    async def flush(self, room_id: str = None) -> None:
+        """
+        未保存の変更を MongoDB に書き出す（room_id 省略時は全ての部屋）
+        他のプロセスが先に書き込んでいた場合はキャッシュを破棄して BattleRoomConflict を送出する
+        """
+        room_ids = [room_id] if room_id else list(self._entries)
+        for rid in room_ids:
+            entry = self._entries.get(rid)
+            if entry is None:
+                continue
+
+            async with entry.lock:
+                if not entry.dirty:
+                    continue
+
+                entry.dirty = False
+                state = entry.state
+                try:
+                    written = await self._write(rid, entry.persisted.to_son(), state.to_son())
+                except Exception:
+                    # 次回の書き出しで再試行する
+                    if self._entries.get(rid) is entry:
+                        entry.dirty = True
+                    raise
+
+                if not written:
+                    self.evict(rid)
+                    raise BattleRoomConflict(rid)
+                entry.persisted = state
+
+    async def delete(self, room_id: str) -> None:
+        """バトルルームをストアと MongoDB の両方から削除する"""
+        self.evict(room_id)
+        await database_sync_to_async(self._delete)(room_id)
+
+    async def delete_many(self, room_ids: list[str], versions: dict[str, int] | None = None) -> list[str]:
+        """
+        複数のバトルルームをストアと MongoDB の両方から削除し、削除した部屋の id を返す（MongoDB への削除は1回）
+        versions（room_id -> version）を指定した場合は、その version から更新されていない部屋のみ削除する
+        """
+        if versions is not None:
+            room_ids = [
+                room_id for room_id in room_ids
+                if (entry := self._entries.get(room_id)) is None or entry.state.version == versions[room_id]
+            ]
+        for room_id in room_ids:
+            self.evict(room_id)
+        if not room_ids:
+            return []
+        return await database_sync_to_async(self._delete_many)(room_ids, versions)
+
+    def evict(self, room_id: str) -> None:
+        """バトルルームをストアから取り除く（MongoDB には書き出さない）"""
+        entry = self._entries.pop(room_id, None)
+        if entry is not None and entry.slug and self._slugs.get(entry.slug) == room_id:
+            del self._slugs[entry.slug]
+
+    def _cache(self, room: BattleRoomState, dirty: bool) -> None:
+        entry = self._entries.get(room.id)
+        state = room.copy()
+        if entry is None:
+            entry = RoomEntry(state=state, persisted=state, slug=room.slug, dirty=dirty)
+            self._entries[room.id] = entry
+        else:
+            entry.state = state
+            entry.dirty = entry.dirty or dirty
+        if room.slug:
+            self._slugs[room.slug] = room.id
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while self._entries:
+            await asyncio.sleep(self.flush_interval)
+            for room_id in list(self._entries):
+                try:
+                    await self.flush(room_id)
+                except BattleRoomConflict as e:
+                    # 書き出せなかった変更は送信済みのため、参加者に MongoDB 上の状態を送り直させる
+                    logger.warning(f"バトルルームの書き出しが競合しました: {e}")
+                    await self._request_resync(e.room_id)
+                except Exception as e:
+                    logger.error(f"バトルルーム {room_id} の書き出しに失敗しました: {e}")
+
+    async def _request_resync(self, room_id: str) -> None:
+        try:
+            await get_channel_layer().group_send(f"battle_rooms_{room_id}", {"type": "battle.resync"})
+        except Exception as e:
+            logger.error(f"バトルルーム {room_id} の再同期を要求できませんでした: {e}")
+
+    @database_sync_to_async
+    def _load(self, id: str = None, slug: str = None) -> BattleRoomState:
+        # ドキュメントを経由せず SON から直接状態を作る
+        son = BattleRoom._get_collection().find_one({"_id": id} if id else {"slug": slug})
+        if son is None:
+            raise BattleRoom.DoesNotExist("BattleRoom matching query does not exist.")
+        return BattleRoomState.from_son(son)
+
+    @database_sync_to_async
+    def _load_version(self, room_id: str) -> int | None:
+        """MongoDB 上の version のみを読み込む（削除済みの場合は None）"""
+        son = BattleRoom._get_collection().find_one({"_id": room_id}, {"version": 1})
+        if son is None:
+            return None
+        return son.get("version", 0)
+
+    @database_sync_to_async
+    def _write(self, room_id: str, persisted: dict, son: dict) -> bool:
+        """変更されたフィールドのみを書き込む。version が一致しない場合は False を返す"""
+        update = build_update(persisted, son)
+        if not update:
+            return True
+
+        version = persisted.get("version", 0)
+        # version フィールドを持たない古いドキュメントは version 0 として扱う
+        query = {"_id": room_id, "version": {"$in": [version, None]} if version == 0 else version}
+        # 削除済みの部屋を復活させないよう upsert はしない
+        result = BattleRoom._get_collection().update_one(query, update)
+        return result.matched_count > 0
+
+    def _delete(self, room_id: str) -> None:
+        BattleRoom.objects.filter(id=room_id).delete()
+
+    def _delete_many(self, room_ids: list[str], versions: dict[str, int] | None = None) -> list[str]:
+        collection = BattleRoom._get_collection()
+        if versions is None:
+            collection.delete_many({"_id": {"$in": list(room_ids)}})
+            return list(room_ids)
+
+        # 書き出し前の変更があるため MongoDB 上の version は指定より小さいことがある（大きい場合は他のプロセスが更新した）
+        collection.delete_many({"$or": [
+            {"_id": room_id, "version": {"$not": {"$gt": versions[room_id]}}} for room_id in room_ids
+        ]})
+        remaining = {son["_id"] for son in collection.find({"_id": {"$in": list(room_ids)}}, {"_id": 1})}
+        return [room_id for room_id in room_ids if room_id not in remaining]
+
+
+room_store = RoomStore()
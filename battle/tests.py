@@ -1,3 +1,240 @@
-from django.test import TestCase
+import base64
+import contextlib
+import copy
+import random
+from types import SimpleNamespace
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from battle import engine
+from battle.consumers.battle_consumer import ROOM_CONFLICT_RETRIES, BattleConsumer
+from battle.matchmaking import DECK_NOT_READY_MESSAGE
+from battle.models import BattleRoomStatus
+from battle.patch import make_patch
+from battle.projection import project_views
+from battle.store import BattleRoomConflict, RoomStore
+from battle.state import BattlePlayerInfoState, BattlePlayerStatusState, BattleRoomState, PlayerSetState
 
-# Create your tests here.
+
+def make_card(i: int) -> dict:
+    return dict(id=str(i), name=f"card{i}", image=None, energy=0, attack_needs_energy=1,
+                escape_needs_energy=1, hp=50, max_hp=50, attack=20)
+
+
+def make_room() -> BattleRoomState:
+    return BattleRoomState(
+        id="room", slug="room",
+        player1=PlayerSetState(info=BattlePlayerInfoState(id="1", name="a"), status=BattlePlayerStatusState()),
+        player2=PlayerSetState(info=BattlePlayerInfoState(id="2", name="b"), status=BattlePlayerStatusState()),
+        player_map={"1": "player1", "2": "player2"},
+    )
+
+
+def start_action() -> dict:
+    return {"type": "battle.start", "decks": {key: [make_card(i) for i in range(20)] for key in ("player1", "player2")}}
+
+
+# ランダムに選ぶ対戦中のアクション（受け付けられなかった場合は次の候補を試す）
+PLAY_ACTIONS = (
+    {"type": "action.assign_energy", "card_id": "battle_card"},
+    {"type": "action.place_card", "card_index": 0, "to_field": "bench"},
+    {"type": "action.attack", "targetType": "battleCard"},
+    {"type": "action.end_turn"},
+)
+
+
+def play(seed: int, max_actions: int = 200):
+    """決着まで（または max_actions 件まで）ランダムに対戦し、状態が変わるたびに部屋を返す"""
+    rng = random.Random(seed)
+    room, _ = engine.apply_internal(make_room(), start_action())
+    yield room
+    for player_id in ("1", "2"):
+        for action in (
+            {"type": "action.place_card", "card_index": 0, "to_field": "battle_card"},
+            {"type": "action.place_card", "card_index": 0, "to_field": "bench"},
+            {"type": "action.setup_complete"},
+        ):
+            room, _ = engine.apply(room, dict(action, player_id=player_id))
+            yield room
+
+    for _ in range(max_actions):
+        if room.winner is not None:
+            return
+        for action in rng.sample(PLAY_ACTIONS, len(PLAY_ACTIONS)):
+            room, events = engine.apply(room, dict(action, player_id=room.turn_player_id))
+            if not engine.is_rejected(events):
+                yield room
+                break
+
+
+def apply_patch(document, ops: list[dict]):
+    """JSON Patch（battle.patch が出力する add / remove / replace）を適用した複製を返す（クライアントの処理）"""
+    document = copy.deepcopy(document)
+    for op in ops:
+        parts = [part.replace("~1", "/").replace("~0", "~") for part in op["path"].split("/")[1:]]
+        value = copy.deepcopy(op.get("value"))
+        if not parts:
+            document = value
+            continue
+        parent = document
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+        key = parts[-1]
+        if isinstance(parent, list):
+            if op["op"] == "remove":
+                del parent[int(key)]
+            elif op["op"] == "add":
+                parent.append(value) if key == "-" else parent.insert(int(key), value)
+            else:
+                parent[int(key)] = value
+        elif op["op"] == "remove":
+            del parent[key]
+        else:
+            parent[key] = value
+    return document
+
+
+class ServerActionTests(SimpleTestCase):
+    """battle.start などサーバー側の処理はクライアントから実行できない"""
+
+    def test_internal_start(self):
+        room, events = engine.apply_internal(make_room(), start_action())
+        self.assertFalse(engine.is_rejected(events))
+        self.assertEqual(room.status, BattleRoomStatus.SETUP)
+        self.assertEqual(room.player1.status.hand_cards_count, engine.INITIAL_HAND_SIZE)
+
+    def test_client_start_is_rejected(self):
+        room = make_room()
+        before = room.to_son()
+        room, events = engine.apply(room, dict(start_action(), player_id="1"))
+        self.assertTrue(engine.is_rejected(events))
+        self.assertEqual(room.to_son(), before)
+
+    def test_start_with_player_id_is_rejected(self):
+        room, events = engine.apply_internal(make_room(), dict(start_action(), player_id="1"))
+        self.assertTrue(engine.is_rejected(events))
+
+    def test_start_in_batch_is_rejected(self):
+        room, _ = engine.apply_internal(make_room(), start_action())
+        before = room.to_son()
+        room, events = engine.apply(room, {"type": "action.batch", "player_id": "1", "actions": [start_action()]})
+        self.assertTrue(engine.is_rejected(events))
+        self.assertEqual(room.to_son(), before)
+
+    def test_consumer_refuses_start(self):
+        consumer = BattleConsumer()
+        consumer.user = SimpleNamespace(id=1)
+        consumer.get_room = mock.AsyncMock(return_value=make_room())
+        consumer.send_json = mock.AsyncMock()
+        consumer._apply_engine_action = mock.AsyncMock()
+
+        async_to_sync(consumer._apply_action)(start_action())
+
+        consumer._apply_engine_action.assert_not_called()
+        consumer.send_json.assert_awaited_once_with({"type": "error", "message": "不明なアクションです"})
+
+
+class ProjectionPatchTests(SimpleTestCase):
+    """表示用データ（battle.projection）の差分（battle.patch）を前の状態に適用すると次の状態になる"""
+
+    def test_round_trip(self):
+        for seed in range(5):
+            previous = None
+            for room in play(seed):
+                views = project_views(room, spectator=True)
+                if previous is not None:
+                    for key, view in views.items():
+                        self.assertEqual(apply_patch(previous[key], make_patch(previous[key], view)), view)
+                # 次の状態と比べるため、部屋の変更の影響を受けないよう複製する
+                previous = copy.deepcopy(views)
+
+    def test_no_change(self):
+        room, _ = engine.apply_internal(make_room(), start_action())
+        view = project_views(room)["player1"]
+        self.assertEqual(make_patch(view, copy.deepcopy(view)), [])
+
+
+@override_settings(MORISUMMON_BATTLE_STORE_SHARED=False)
+class RoomConflictTests(SimpleTestCase):
+    """バトルルームの楽観的排他制御（battle.store）と、競合時の BattleConsumer の再試行"""
+
+    def _store(self, written: bool = True) -> RoomStore:
+        store = RoomStore(flush_interval=0)
+        store._write = mock.AsyncMock(return_value=written)
+        store._cache(make_room(), dirty=False)
+        return store
+
+    def test_stale_put(self):
+        store = self._store()
+        first = async_to_sync(store.get)("room")
+        stale = async_to_sync(store.get)("room")
+
+        async_to_sync(store.put)(first)
+        with self.assertRaises(BattleRoomConflict):
+            async_to_sync(store.put)(stale)
+
+        store._write.assert_awaited_once()
+        self.assertEqual(async_to_sync(store.get)("room").version, first.version)
+
+    def test_failed_write_evicts(self):
+        store = self._store(written=False)
+        room = async_to_sync(store.get)("room")
+        with self.assertRaises(BattleRoomConflict):
+            async_to_sync(store.put)(room)
+        self.assertNotIn("room", store)
+
+    def _consumer(self, conflicts: int) -> BattleConsumer:
+        consumer = BattleConsumer()
+        consumer.unit_of_work = contextlib.nullcontext
+        consumer.send_json = mock.AsyncMock()
+        consumer._dispatch_action = mock.AsyncMock(
+            side_effect=[BattleRoomConflict("room")] * conflicts + [None]
+        )
+        return consumer
+
+    def test_consumer_retries(self):
+        consumer = self._consumer(conflicts=1)
+        self.assertTrue(async_to_sync(consumer._receive_action)({"type": "action.end_turn"}))
+        self.assertEqual(consumer._dispatch_action.await_count, 2)
+        consumer.send_json.assert_not_awaited()
+
+    def test_consumer_gives_up(self):
+        consumer = self._consumer(conflicts=ROOM_CONFLICT_RETRIES)
+        self.assertFalse(async_to_sync(consumer._receive_action)({"type": "action.end_turn"}))
+        self.assertEqual(consumer._dispatch_action.await_count, ROOM_CONFLICT_RETRIES)
+        consumer.send_json.assert_awaited_once_with(
+            {"type": "error", "message": "他の操作と競合しました。もう一度お試しください"}
+        )
+
+
+class ClaimSlugAuthenticationTests(TestCase):
+    """api/battle/claim-slug/ は api_view と同じくセッションと Basic 認証を受け付ける"""
+
+    URL = "/api/battle/claim-slug/"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="battle", password="password")
+
+    def _basic(self, password: str) -> str:
+        return "Basic " + base64.b64encode(f"battle:{password}".encode()).decode()
+
+    def test_anonymous(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"error": "ログインしてください"})
+
+    def test_session(self):
+        self.client.force_login(self.user)
+        # デッキが無いため、認証された上でマッチングの前に 516 を返す
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 516)
+        self.assertEqual(response.json(), {"error": DECK_NOT_READY_MESSAGE})
+
+    def test_basic(self):
+        response = self.client.get(self.URL, HTTP_AUTHORIZATION=self._basic("password"))
+        self.assertEqual(response.status_code, 516)
+
+    def test_basic_wrong_password(self):
+        response = self.client.get(self.URL, HTTP_AUTHORIZATION=self._basic("wrong"))
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,75 @@
+"""
+BattleRoom の変更差分から MongoDB の更新オペレータを組み立てる
+
+ドキュメント全体を書き換える代わりに、変更があったフィールドだけを
+$set / $unset / $inc / $push / $pop で更新する。
+"""
+
+
+def build_update(old: dict, new: dict) -> dict:
+    """
+    保存済みの SON（old）と現在の SON（new）を比較し、update_one に渡す更新内容を返す
+    変更が無い場合は空の dict を返す
+    """
+    ops: dict = {}
+    _diff_dict(old, new, "", ops)
+    return ops
+
+
+def _add(ops: dict, operator: str, path: str, value) -> None:
+    ops.setdefault(operator, {})[path] = value
+
+
+def _is_number(value) -> bool:
+    # bool は int のサブクラスだが $inc の対象にはしない
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _diff_dict(old: dict, new: dict, prefix: str, ops: dict) -> None:
+    for key, value in new.items():
+        if not prefix and key == "_id":
+            continue
+        path = f"{prefix}{key}"
+        if key not in old:
+            _add(ops, "$set", path, value)
+        else:
+            _diff_value(old[key], value, path, ops)
+
+    for key in old:
+        if key not in new:
+            _add(ops, "$unset", f"{prefix}{key}", "")
+
+
+def _diff_value(old, new, path: str, ops: dict) -> None:
+    if old == new:
+        return
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        _diff_dict(old, new, f"{path}.", ops)
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, ops)
+    elif _is_number(old) and _is_number(new) and type(old) is type(new):
+        _add(ops, "$inc", path, new - old)
+    else:
+        _add(ops, "$set", path, new)
+
+
+def _diff_list(old: list, new: list, path: str, ops: dict) -> None:
+    old_len = len(old)
+    new_len = len(new)
+
+    # 末尾への追加（手札へのドロー、ベンチへの配置など）
+    if new_len > old_len and new[:old_len] == old:
+        _add(ops, "$push", path, {"$each": new[old_len:]})
+    # 先頭の1枚を取り出した（山札からのドロー）
+    elif new_len == old_len - 1 and new == old[1:]:
+        _add(ops, "$pop", path, -1)
+    # 末尾の1枚を取り出した
+    elif new_len == old_len - 1 and new == old[:-1]:
+        _add(ops, "$pop", path, 1)
+    # 要素数が同じ場合は要素ごとに比較する（ベンチのカードのエネルギー変更など）
+    elif new_len == old_len:
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            _diff_value(old_item, new_item, f"{path}.{index}", ops)
+    else:
+        _add(ops, "$set", path, new)
@@ -1,22 +1,49 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.http import JsonResponse
-from ulid import ULID
-from battle.models import BattleRoom
-from rest_framework.decorators import api_view
-from morisummon.models import Deck
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from battle.matchmaking import matchmaking, get_match_deck, get_match_bucket, DECK_NOT_READY_MESSAGE
 
 
-@api_view(["GET"])
-def get_room_slug(request):
-    if not request.user.is_authenticated:
+@sync_to_async
+def _authenticate(request):
+    """
+    api_view と同じく REST_FRAMEWORK の DEFAULT_AUTHENTICATION_CLASSES（セッション・Basic 認証）でユーザーを取得する
+    認証情報が誤っている場合は AuthenticationFailed を送出する
+    """
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    return Request(request, authenticators=authenticators).user
+
+
+@require_GET
+async def get_room_slug(request):
+    """
+    対戦相手を探す（ロングポーリング）
+    ・マッチングが成立したら {"found": true, "slug": ...} を返し、両者ともその slug の部屋に接続する
+    ・MORISUMMON_MATCHMAKING_POLL_TIMEOUT 秒以内に相手が見つからない場合は {"found": false, "slug": null} を返す
+      （クライアントは再度リクエストする）
+    ※待っている間スレッドを占有しないよう async ビューにしている（認証は api_view と同じクラスで行う）
+    """
+    try:
+        user = await _authenticate(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"error": str(e.detail)}, status=401)
+    if not user.is_authenticated:
         return JsonResponse({"error": "ログインしてください"}, status=401)
 
-    deck = Deck.objects.filter(user=request.user).first()
-    if not deck or len(deck.card_ids) != 12:
-        return JsonResponse({"error": "デッキが12枚編成されていません。編成後、再度対戦をお試しください。"}, status=516)
+    deck = await get_match_deck(user)
+    if deck is None:
+        return JsonResponse({"error": DECK_NOT_READY_MESSAGE}, status=516)
 
-    room = BattleRoom.objects.filter(player2=None).first()
-    if room:
-        return JsonResponse({"found": True, "slug": room.slug})
+    match = await matchmaking.find_match(
+        user.id,
+        bucket=await get_match_bucket(deck),
+        timeout=settings.MORISUMMON_MATCHMAKING_POLL_TIMEOUT,
+    )
+    if match:
+        return JsonResponse({"found": True, "slug": match.slug})
     else:
-        new_slug = str(ULID())
-        return JsonResponse({"found": False, "slug": new_slug})
+        return JsonResponse({"found": False, "slug": None})
@@ -1,5 +1,4 @@
 import os
-from django.core.management import call_command
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
@@ -18,5 +17,3 @@ application = ProtocolTypeRouter({
         )
     ),
 })
-
-call_command('cleanmongo')
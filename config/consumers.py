@@ -5,6 +5,7 @@ from asgiref.sync import sync_to_async
 import json
 from morisummon.models import ChatGroup, ChatMessage, Card
 from accounts.models import User
+from morisummon.metrics import metrics
 
 class ChatConsumer(AsyncWebsocketConsumer):
     user: User | AnonymousUser = None
@@ -49,31 +50,32 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
 
     async def receive(self, text_data=None):
-        if text_data:
-            data = json.loads(text_data)
-            message = data.get('message')
+        with metrics.track("ws", "chat.message"):
+            if text_data:
+                data = json.loads(text_data)
+                message = data.get('message')
 
-            chat_group, created = await sync_to_async(ChatGroup.objects.get_or_create)(name=self.group_name)
+                chat_group, created = await sync_to_async(ChatGroup.objects.get_or_create)(name=self.group_name)
 
-            chat_message = await sync_to_async(ChatMessage.objects.create)(
-                group=chat_group,
-                sender=self.user,
-                message=message
-            )
+                chat_message = await sync_to_async(ChatMessage.objects.create)(
+                    group=chat_group,
+                    sender=self.user,
+                    message=message
+                )
 
-            # データ形式はフロント側と形式を合わせた
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'sender': {
-                        'id': self.user.id,
-                        'name': self.user.username,
-                    },
-                    'timestamp': chat_message.timestamp.isoformat()
-                }
-            )
+                # データ形式はフロント側と形式を合わせた
+                await self.channel_layer.group_send(
+                    self.group_name,
+                    {
+                        'type': 'chat_message',
+                        'message': message,
+                        'sender': {
+                            'id': self.user.id,
+                            'name': self.user.username,
+                        },
+                        'timestamp': chat_message.timestamp.isoformat()
+                    }
+                )
 
     async def chat_message(self, event):
         await self.send(text_data=json.dumps({
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'morisummon.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -100,6 +101,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 複数スレッドから同時に書き込むテスト（morisummon.tests）のため、テスト用のデータベースもファイルにする
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -160,6 +163,8 @@ DJANGO_VITE = {
 
 ASGI_APPLICATION = 'config.asgi.application'
 
+MORISUMMON_REDIS_URL = env.str('CHANNEL_LAYER_REDIS_URL', 'redis://127.0.0.1:6379')
+
 channel_layer_defaults = {
     'memory': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer'
@@ -168,7 +173,7 @@ channel_layer_defaults = {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             'hosts': [{
-                'address': env.str('CHANNEL_LAYER_REDIS_URL', 'redis://127.0.0.1:6379'),
+                'address': MORISUMMON_REDIS_URL,
             }],
         },
     },
@@ -178,8 +183,83 @@ CHANNEL_LAYERS = {
     'default': channel_layer_defaults[env.str('CHANNEL_LAYER', 'memory')],
 }
 
+# キャッシュ（カードのシリアライズ結果など。複数のプロセスで共有する場合は Redis などに変更する）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'morisummon',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 MORISUMMON_DECK_SIZE = 12 # デッキのサイズ
 
+# ガチャで排出される重み（カード1枚あたり。同じパック内ではこの比で排出される）
+MORISUMMON_GACHA_RARITY_WEIGHTS = {
+    'common': 100,
+    'uncommon': 40,
+    'rare': 10,
+    'super_rare': 2,
+}
+# ガチャ1回（カード1枚）に必要な魔石と、1度に引ける回数
+MORISUMMON_GACHA_STONES_PER_CARD = 2
+MORISUMMON_GACHA_PULL_COUNTS = (1, 5, 10)
+
+# 所持カードの差分（api/collection/changes/）で返す上限。超える場合はコレクション全体を取得し直させる
+MORISUMMON_COLLECTION_CHANGES_LIMIT = 500
+
+# 対戦中のバトルルームを MongoDB に書き出す間隔（秒）。0 の場合は保存のたびに即時書き込み
+MORISUMMON_BATTLE_FLUSH_INTERVAL = env.float('MORISUMMON_BATTLE_FLUSH_INTERVAL', 2.0)
+
+# 最後の操作からこの秒数が経過したバトルルームは MongoDB の TTL インデックスで削除される
+# （変更した場合は manage.py cleanmongo --ensure-indexes で既存のインデックスに反映する）
+MORISUMMON_BATTLE_ROOM_TTL = env.int('MORISUMMON_BATTLE_ROOM_TTL', 60 * 60)
+
+# 処理ごとの回数・所要時間の計測（morisummon.metrics）。/metrics で取得する
+MORISUMMON_METRICS_ENABLED = env.bool('MORISUMMON_METRICS_ENABLED', True)
+# 設定した場合、/metrics の取得に Authorization: Bearer <token> が必要
+# 設定しない場合はスタッフのユーザーのみ取得できる
+MORISUMMON_METRICS_TOKEN = env.str('MORISUMMON_METRICS_TOKEN', '')
+# True の場合、トークンが無くてもループバックアドレスからは取得できる
+# （同じホストのリバースプロキシ経由のリクエストも 127.0.0.1 からになるため、プロキシを置く構成では有効にしないこと）
+MORISUMMON_METRICS_TRUST_LOOPBACK = env.bool('MORISUMMON_METRICS_TRUST_LOOPBACK', False)
+
+# バトルの行動ログ（battle.action_log）を記録する
+MORISUMMON_BATTLE_LOG_ENABLED = env.bool('MORISUMMON_BATTLE_LOG_ENABLED', True)
+# 行動ログにバトルルーム全体のスナップショットを残す間隔（行動数）
+MORISUMMON_BATTLE_LOG_SNAPSHOT_INTERVAL = 20
+# 行動ログを保持する期間（秒）。TTL インデックスで削除される（変更の反映は cleanmongo --ensure-indexes）
+MORISUMMON_BATTLE_LOG_TTL = env.int('MORISUMMON_BATTLE_LOG_TTL', 60 * 60 * 24 * 7)
+
+# 切断したプレイヤーの再接続を待つ時間（秒）。0 の場合は切断と同時に部屋を削除する
+MORISUMMON_BATTLE_RECONNECT_GRACE = env.float('MORISUMMON_BATTLE_RECONNECT_GRACE', 30.0)
+# 再接続の無かった部屋をまとめて削除する間隔（秒）
+MORISUMMON_BATTLE_REAPER_INTERVAL = 5.0
+
+# バトルルームごとのロック（local: プロセス内のみ, redis: 複数ノード間で共有）
+MORISUMMON_BATTLE_LOCK_BACKEND = env.str(
+    'MORISUMMON_BATTLE_LOCK_BACKEND',
+    'redis' if env.str('CHANNEL_LAYER', 'memory') == 'redis' else 'local'
+)
+MORISUMMON_BATTLE_LOCK_LEASE = 10.0   # Redis ロックの有効期間（秒）
+MORISUMMON_BATTLE_LOCK_TIMEOUT = 5.0  # Redis ロックの取得待ちの上限（秒）
+# 複数のプロセスが同じバトルルームを扱う構成か（True の場合は保存のたびに MongoDB に書き出して競合を検知し、
+# キャッシュから返す前に MongoDB 上の version を確認する）。部屋ごとに接続先を固定する構成なら False でよい
+MORISUMMON_BATTLE_STORE_SHARED = env.bool(
+    'MORISUMMON_BATTLE_STORE_SHARED',
+    MORISUMMON_BATTLE_LOCK_BACKEND == 'redis'
+)
+
+# マッチングの待ち行列（local: プロセス内のみ, redis: 複数ノード間で共有）
+MORISUMMON_MATCHMAKING_BACKEND = env.str(
+    'MORISUMMON_MATCHMAKING_BACKEND',
+    'redis' if env.str('CHANNEL_LAYER', 'memory') == 'redis' else 'local'
+)
+MORISUMMON_MATCHMAKING_TICKET_TTL = 30.0   # 待っているクライアントからの応答が途絶えた整理券を破棄するまでの時間（秒）
+MORISUMMON_MATCHMAKING_POLL_TIMEOUT = 25.0  # claim-slug（ロングポーリング）でマッチングを待つ上限（秒）
+# デッキの強さ（カードの HP + 攻撃力の合計）でマッチング相手を分ける幅。0 の場合は分けない
+MORISUMMON_MATCHMAKING_DECK_POWER_BUCKET = env.int('MORISUMMON_MATCHMAKING_DECK_POWER_BUCKET', 0)
+
 AUTH_USER_MODEL = 'accounts.User'
 
 # Logging
@@ -236,12 +316,16 @@ MONGO_USERNAME = env.str('MONGO_USERNAME', '')
 MONGO_PASSWORD = env.str('MONGO_PASSWORD', '')
 MONGO_TIMEOUT = env.int('MONGO_TIMEOUT', 5000)
 
+from morisummon.metrics import MongoCommandTimer
+
 mongoengine.connect(
     db=MONGO_DATABASE,
     host=MONGO_HOST,
     username=MONGO_USERNAME,
     password=MONGO_PASSWORD,
     timeoutms=MONGO_TIMEOUT,
+    # 処理ごとの MongoDB の所要時間を計測する（morisummon.metrics）
+    event_listeners=[MongoCommandTimer()],
 )
 
 try:
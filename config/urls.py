@@ -4,11 +4,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
+from morisummon.views import metrics_endpoint
 
 from config.settings import BASE_DIR
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # morisummon の index（SPA）より先に解決する
+    path('metrics', metrics_endpoint, name='metrics'),
 
     path('', include('accounts.urls')),
     path('', include('morisummon.urls')),
@@ -57,10 +57,20 @@ export default function Page() {
   const [roomSlug, setRoomSlug] = useState<string | null>(null);
 
   useEffect(() => {
+    let cancelled = false;
     (async () => {
-      const url = await ky.get('api/battle/claim-slug/').json<{ slug: string }>();
-      setRoomSlug(url.slug);
+      // マッチングが成立するまでサーバー側で待つ（時間切れの場合は再度リクエストする）
+      while (!cancelled) {
+        const res = await ky.get('api/battle/claim-slug/', { timeout: false }).json<{ found: boolean; slug: string | null }>();
+        if (res.found && res.slug) {
+          if (!cancelled) setRoomSlug(res.slug);
+          return;
+        }
+      }
     })();
+    return () => {
+      cancelled = true;
+    };
   }, []);
 
   if (roomSlug === null) {
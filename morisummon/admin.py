@@ -9,9 +9,9 @@ class UserCardInline(admin.TabularInline):
 
 @admin.register(Card)
 class CardAdmin(admin.ModelAdmin):
-    list_display = ('name', 'hp', 'attack', 'image', 'retreat_cost', 'attack_cost', 'type', 'category','attack_name', 'pack', 'ability')
+    list_display = ('name', 'hp', 'attack', 'image', 'retreat_cost', 'attack_cost', 'type', 'category','attack_name', 'pack', 'rarity', 'ability')
     search_fields = ('name',)
-    list_filter = ('hp', 'attack')
+    list_filter = ('hp', 'attack', 'pack', 'rarity')
     inlines = [UserCardInline]
 
 @admin.register(UserCard)
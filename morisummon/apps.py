@@ -7,3 +7,7 @@ class MorisummonConfig(AppConfig):
 
     def ready(self):
         import morisummon.signals
+        from django.db.backends.signals import connection_created
+        from morisummon.metrics import install_sql_timer
+        # 処理ごとの SQL の所要時間を計測する
+        connection_created.connect(install_sql_timer)
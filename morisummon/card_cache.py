@@ -0,0 +1,85 @@
+"""
+CardSerializer の出力のキャッシュ
+
+・カードの内容は管理画面で編集された時にしか変わらないため、シリアライズ結果をカード id ごとに使い回す
+・2段構成：プロセス内の dict（1段目）と Django のキャッシュ（settings.CACHES、2段目）
+・キーにはカタログのバージョンを含める。Card の保存・削除時にはシグナル（morisummon.signals）から
+  invalidate() が呼ばれ、バージョンを進めて古い結果を使わないようにする
+  （2段目を Redis などで共有すれば、他のプロセスもバージョンの変化で読み直す）
+・返す dict はキャッシュしているものそのものなので変更しないこと
+"""
+import logging
+import time
+from typing import Callable, Iterable
+from django.core.cache import caches
+from .models import Card
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "default"
+VERSION_KEY = "morisummon:cards:version"
+
+
+class CardCache:
+    def __init__(self, alias: str = CACHE_ALIAS):
+        self.alias = alias
+        # (バージョン, {カード id: シリアライズ結果})
+        self._local: tuple[int, dict[int, dict]] = (0, {})
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version(self) -> int:
+        # 連番ではなく時刻にする（キャッシュから追い出されて作り直した場合に古いバージョンと重ならない）
+        return self.cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+    def invalidate(self) -> None:
+        self.cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+        self._local = (0, {})
+
+    def get_many(self, card_ids: Iterable[int]) -> dict[int, dict]:
+        """カード id ごとのシリアライズ結果を返す（存在しないカードは含まない）"""
+        return self._lookup(set(card_ids), lambda ids: Card.objects.in_bulk(ids).values())
+
+    def serialize(self, cards: Iterable[Card]) -> list[dict]:
+        """読み込み済みの Card のシリアライズ結果を同じ順番で返す（キャッシュに無いものだけシリアライズする）"""
+        cards = list(cards)
+        by_id = {card.id: card for card in cards}
+        data = self._lookup(set(by_id), lambda ids: [by_id[card_id] for card_id in ids])
+        return [data[card.id] for card in cards]
+
+    def _lookup(self, card_ids: set[int], load: Callable[[list[int]], Iterable[Card]]) -> dict[int, dict]:
+        version = self.version()
+        local_version, local = self._local
+        if local_version != version:
+            local = {}
+            self._local = (version, local)
+
+        result = {card_id: local[card_id] for card_id in card_ids if card_id in local}
+        missing = [card_id for card_id in card_ids if card_id not in result]
+        if not missing:
+            return result
+
+        keys = {self._key(version, card_id): card_id for card_id in missing}
+        for key, data in self.cache.get_many(keys).items():
+            result[keys[key]] = local[keys[key]] = data
+        missing = [card_id for card_id in missing if card_id not in result]
+        if not missing:
+            return result
+
+        # serializers が card_cache を使うため、ここで読み込む
+        from .serializers import CardSerializer
+
+        serialized = {card.id: dict(CardSerializer(card).data) for card in load(missing)}
+        logger.debug(f"Serialized {len(serialized)} cards (catalog version {version})")
+        self.cache.set_many({self._key(version, card_id): data for card_id, data in serialized.items()}, timeout=None)
+        local.update(serialized)
+        result.update(serialized)
+        return result
+
+    def _key(self, version: int, card_id: int) -> str:
+        return f"morisummon:cards:{version}:{card_id}"
+
+
+card_cache = CardCache()
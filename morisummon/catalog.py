@@ -0,0 +1,71 @@
+"""
+カードカタログ（全カードの一覧）
+
+・全カードの CardSerializer の出力を列ごとの配列にまとめた JSON を返す（api/catalog/）
+  {"version": ハッシュ, "fields": ["id", "name", ...], "columns": [[id...], [name...], ...]}
+・version は内容のハッシュで、ETag にもそのまま使う。内容が同じならプロセスが違っても同じ値になる
+・符号化済みの本文をカードカタログのバージョン（morisummon.card_cache）ごとにキャッシュする
+・?compact=1 を指定した API はカードの内容の代わりに id のみを返し、レスポンスヘッダ
+  X-Catalog-Version で対応するカタログの version を伝える
+"""
+import hashlib
+import json
+from dataclasses import dataclass
+from .card_cache import card_cache
+from .models import Card
+
+CATALOG_VERSION_HEADER = 'X-Catalog-Version'
+
+
+@dataclass(frozen=True, slots=True)
+class EncodedCatalog:
+    version: str
+    body: bytes
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}"'
+
+
+class CardCatalogEndpoint:
+    """api/catalog/ の本文を作ってキャッシュする"""
+
+    def __init__(self):
+        # (カードカタログのバージョン, 符号化済みの本文)
+        self._local: tuple[int, EncodedCatalog] | None = None
+
+    def get(self) -> EncodedCatalog:
+        version = card_cache.version()
+        local = self._local
+        if local is not None and local[0] == version:
+            return local[1]
+
+        key = f'morisummon:catalog:{version}'
+        catalog = card_cache.cache.get(key)
+        if catalog is None:
+            catalog = self._build()
+            card_cache.cache.set(key, catalog, timeout=None)
+        self._local = (version, catalog)
+        return catalog
+
+    def _build(self) -> EncodedCatalog:
+        # シリアライズ結果はカードごとのキャッシュを使う（CardSerializer の fields の順に列を並べる）
+        from .serializers import CardSerializer
+
+        fields = list(CardSerializer.Meta.fields)
+        cards = card_cache.get_many(Card.objects.order_by('id').values_list('id', flat=True))
+        rows = [cards[card_id] for card_id in sorted(cards)]
+        content = {'fields': fields, 'columns': [[row[field] for row in rows] for field in fields]}
+
+        encoded = json.dumps(content, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode()
+        version = hashlib.sha256(encoded).hexdigest()[:16]
+        body = json.dumps({'version': version, **content}, ensure_ascii=False, separators=(',', ':')).encode()
+        return EncodedCatalog(version=version, body=body)
+
+
+catalog_endpoint = CardCatalogEndpoint()
+
+
+def catalog_version() -> str:
+    """現在のカタログの version（?compact=1 のレスポンスヘッダに付ける）"""
+    return catalog_endpoint.get().version
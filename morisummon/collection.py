@@ -0,0 +1,90 @@
+"""
+所持カード（コレクション）の取得
+
+・UserCard の id 順のカーソルでページ分割し、パック・属性・カテゴリで絞り込める
+・カードの内容はシリアライズ結果のキャッシュ（morisummon.card_cache）から取得し、Card は読み込まない
+・ETag は所持カードのバージョン（User.collection_version）とカードカタログのバージョンから作るため、
+  変更が無ければ認証で読み込んだユーザー以外のクエリを使わずに 304 を返せる
+・所持カードを変更した時は、変更した UserCard の seq に進めた collection_version を記録する（record_changes）
+  クライアントは最後に受け取った seq 以降に変更された行だけを取得できる（collection_changes）
+"""
+from django.conf import settings
+from django.utils.http import parse_etags
+from rest_framework.pagination import CursorPagination
+from .card_cache import card_cache
+from .models import UserCard
+
+# 絞り込みに使えるクエリパラメータ -> Card のフィールド
+COLLECTION_FILTERS = {
+    'pack': 'card__pack',
+    'type': 'card__type',
+    'category': 'card__category',
+}
+
+
+class CollectionPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 500
+
+
+def collection_etag(user) -> str:
+    return f'"{user.pk}-{user.collection_version}-{card_cache.version()}"'
+
+
+def is_not_modified(request, etag: str) -> bool:
+    """If-None-Match が etag と一致するかどうか"""
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in etags or etag in etags or f'W/{etag}' in etags
+
+
+def collection_queryset(user, params):
+    filters = {field: params[param] for param, field in COLLECTION_FILTERS.items() if params.get(param)}
+    return UserCard.objects.filter(user=user, **filters).values('id', 'card_id', 'amount')
+
+
+def hydrate_collection(rows) -> list[dict]:
+    """UserCard の行を {'card': ..., 'amount': ...} のリストにする（削除されたカードは含まない）"""
+    cards = card_cache.get_many(row['card_id'] for row in rows)
+    return [{'card': cards[row['card_id']], 'amount': row['amount']} for row in rows if row['card_id'] in cards]
+
+
+def record_changes(user, card_ids) -> int:
+    """
+    所持カードの変更を記録する（collection_version を進め、変更した UserCard の seq にする）
+    変更と同じトランザクションで呼ぶこと（同じユーザーの変更が seq の順に確定するようにする）
+    """
+    version = user.touch_collection()
+    UserCard.objects.filter(user=user, card_id__in=list(card_ids)).update(seq=version)
+    return version
+
+
+def collection_changes(user, since: int | None, catalog: int | None) -> dict:
+    """
+    since より後に変更された所持カードを返す
+    {"seq": 現在のバージョン, "catalog": カードカタログのバージョン, "resync": bool, "changes": [...]}
+    次のいずれかの場合は resync を True にして changes を返さない（コレクションを取得し直す）
+    ・since が無い・現在のバージョンより新しい
+    ・カードカタログが変わった（削除されたカードは差分で表せない）
+    ・変更が MORISUMMON_COLLECTION_CHANGES_LIMIT 件を超える
+    """
+    seq = user.collection_version
+    version = card_cache.version()
+    data = {'seq': seq, 'catalog': version, 'resync': True, 'changes': []}
+    if since is None or since > seq or catalog != version:
+        return data
+    if since == seq:
+        data['resync'] = False
+        return data
+
+    limit = settings.MORISUMMON_COLLECTION_CHANGES_LIMIT
+    rows = list(
+        UserCard.objects.filter(user=user, seq__gt=since).order_by('seq').values('card_id', 'amount')[:limit + 1]
+    )
+    if len(rows) > limit:
+        return data
+
+    data['resync'] = False
+    data['changes'] = hydrate_collection(rows)
+    return data
@@ -0,0 +1,78 @@
+"""
+デッキの検証と表示用データの組み立て
+
+・カードの存在確認は1回の in_bulk、所持の確認は1回の UserCard の IN クエリで行う（スロット数によらず一定）
+・スロットの順番は保ったまま扱い、カード id 以外のスロットは None にする
+"""
+from django.conf import settings
+from .card_cache import card_cache
+from .models import Card, UserCard
+
+
+class DeckError(Exception):
+    """デッキを保存できない場合に送出する（code を指定した場合は error に code、message に理由を返す）"""
+
+    def __init__(self, message: str, code: str | None = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+    def to_data(self) -> dict:
+        if self.code:
+            return {'error': self.code, 'message': self.message}
+        return {'error': self.message}
+
+
+def _slot_card_ids(card_ids: list) -> list[int]:
+    return [card_id for card_id in card_ids if isinstance(card_id, int)]
+
+
+def validate_deck(user, card_ids: list) -> list[int | None]:
+    """
+    保存するデッキを検証し、スロット順のカード id のリストを返す
+    先頭のスロットから順に確認し、最初に見つかった問題を DeckError で送出する
+    """
+    if len(card_ids) != settings.MORISUMMON_DECK_SIZE:
+        raise DeckError(f'デッキは{settings.MORISUMMON_DECK_SIZE}枚で構成されている必要があります')
+
+    if len(card_ids) != len(set(card_ids)):
+        raise DeckError('同一カードを複数枚デッキに追加することはできません', code='duplicate_card')
+
+    ids = _slot_card_ids(card_ids)
+    cards = Card.objects.in_bulk(ids)
+    owned = set(UserCard.objects.filter(user=user, card_id__in=ids).values_list('card_id', flat=True))
+
+    slots = []
+    for card_id in card_ids:
+        if not isinstance(card_id, int):
+            slots.append(None)
+        elif card_id not in cards:
+            raise DeckError('存在しないカードが含まれています')
+        elif card_id not in owned:
+            raise DeckError('所有していないカードが含まれています')
+        else:
+            slots.append(card_id)
+    return slots
+
+
+def load_deck_cards(card_ids: list) -> list[Card | None]:
+    """スロット順の Card のリストを返す（カード id 以外のスロットは None、存在しないカードは DeckError）"""
+    cards = Card.objects.in_bulk(_slot_card_ids(card_ids))
+    slots = [None for _ in range(settings.MORISUMMON_DECK_SIZE)]
+    for i, card_id in enumerate(card_ids):
+        if not isinstance(card_id, int):
+            continue
+        if card_id not in cards:
+            raise DeckError('存在しないカードが含まれています')
+        slots[i] = cards[card_id]
+    return slots
+
+
+def hydrate_deck(card_ids: list) -> list[dict | None]:
+    """スロット順の表示用のカード（CardSerializer の出力）を返す（存在しないカードのスロットは None）"""
+    data = card_cache.get_many(card_id for card_id in card_ids if card_id is not None)
+    slots = [None for _ in range(settings.MORISUMMON_DECK_SIZE)]
+    for i, card_id in enumerate(card_ids):
+        if card_id is not None:
+            slots[i] = data.get(card_id)
+    return slots
@@ -0,0 +1,168 @@
+"""
+ガチャの抽選
+
+・パックごとの排出テーブル（AliasTable）を初回の抽選時に1度だけ作り、プロセス内で共有する
+・抽選は Walker / Vose のエイリアス法で、パックのカード枚数によらず1枚あたり O(1)
+・Card の保存・削除時にはシグナル（morisummon.signals）から invalidate() が呼ばれ、次回作り直す
+  （QuerySet.update() / bulk_create() などシグナルの発生しない変更の後は invalidate() を呼ぶこと）
+・pull() は魔石の消費と所持カードの加算を1つのトランザクションで行い、回数によらずクエリ数は一定
+"""
+import logging
+import random
+import threading
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, Subquery, Value, When
+from .models import Card, UserCard
+
+logger = logging.getLogger(__name__)
+
+
+class AliasTable:
+    """重み付きの抽選表（Vose のエイリアス法）"""
+    __slots__ = ("items", "_prob", "_alias")
+
+    def __init__(self, items: list, weights: list[float]):
+        n = len(items)
+        total = sum(weights)
+        if n == 0 or total <= 0:
+            raise ValueError("AliasTable needs at least one item with a positive weight")
+
+        self.items = items
+        self._prob = [0.0] * n
+        self._alias = list(range(n))
+
+        # 平均を 1 とした重みを、1 未満（small）と 1 以上（large）に分けて組み合わせる
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 誤差で残ったものは必ず自身を選ぶ
+        for i in small + large:
+            self._prob[i] = 1.0
+
+    def sample(self, k: int, rng: random.Random = random) -> list:
+        """k 件を抽選する（重複あり）"""
+        items, prob, alias = self.items, self._prob, self._alias
+        n = len(items)
+        result = []
+        for _ in range(k):
+            i = int(rng.random() * n)
+            result.append(items[i] if rng.random() < prob[i] else items[alias[i]])
+        return result
+
+
+def card_weight(card: Card) -> float:
+    """カード1枚の排出の重み（MORISUMMON_GACHA_RARITY_WEIGHTS に無いレアリティは 0 = 排出しない）"""
+    return settings.MORISUMMON_GACHA_RARITY_WEIGHTS.get(card.rarity, 0)
+
+
+class GachaTables:
+    """
+    パックごとの排出テーブルのキャッシュ（プロセス全体で共有する）
+    ・表には Card のインスタンスを保持するため、抽選結果はそのまま UserCard の作成・シリアライズに使える
+    ・排出できるカードが無いパックはキャッシュしない（存在しないパック名でキャッシュが増えないようにする）
+    """
+
+    def __init__(self):
+        self._tables: dict[str, AliasTable] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._tables = {}
+
+    def get(self, pack: str) -> AliasTable | None:
+        """パックの排出テーブルを返す（排出できるカードが無い場合は None）"""
+        table = self._tables.get(pack)
+        if table is not None:
+            return table
+
+        generation = self._generation
+        table = self._build(pack)
+        if table is not None:
+            with self._lock:
+                # 作成中に Card が更新された場合は保持しない（次回作り直す）
+                if generation == self._generation:
+                    self._tables[pack] = table
+        return table
+
+    def _build(self, pack: str) -> AliasTable | None:
+        cards = [card for card in Card.objects.filter(pack=pack).order_by('id') if card_weight(card) > 0]
+        if not cards:
+            return None
+        logger.debug(f"Built the gacha table for pack {pack} ({len(cards)} cards)")
+        return AliasTable(cards, [card_weight(card) for card in cards])
+
+
+gacha_tables = GachaTables()
+
+
+class GachaError(Exception):
+    """ガチャを引けない場合に送出する（status は返す HTTP ステータス）"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def pull(user, pack: str, count: int) -> list[Card]:
+    """
+    パックから count 枚を引き、魔石を消費して所持カードに加える
+    ・魔石は残高が足りる場合のみ減らす条件付きの UPDATE で消費する（同時に引いても二重に消費されない）
+    ・所持カードは未所持の行の作成と加算の UPDATE の2回のクエリで加算する
+    """
+    if count not in settings.MORISUMMON_GACHA_PULL_COUNTS:
+        counts = "・".join(str(n) for n in settings.MORISUMMON_GACHA_PULL_COUNTS)
+        raise GachaError(f"ガチャは{counts}回のいずれかで引いてください")
+
+    table = gacha_tables.get(pack)
+    if table is None:
+        raise GachaError("選択されたパックにカードが存在しません", status=404)
+
+    cost = settings.MORISUMMON_GACHA_STONES_PER_CARD * count
+    drawn_cards = table.sample(count)
+    with transaction.atomic():
+        # 所持カードのバージョン（コレクションの ETag・差分の seq）も同じ UPDATE で進める
+        spent = get_user_model().objects.filter(pk=user.pk, magic_stones__gte=cost).update(
+            magic_stones=F("magic_stones") - cost,
+            collection_version=F("collection_version") + 1,
+        )
+        if not spent:
+            raise GachaError("ガチャ石が足りません")
+        _add_user_cards(user.pk, Counter(card.id for card in drawn_cards))
+
+    user.refresh_from_db(fields=["magic_stones", "collection_version"])
+    return drawn_cards
+
+
+def _add_user_cards(user_id: int, amounts: Counter) -> None:
+    """
+    所持数を加算する（未所持のカードは作成する）
+    変更した行の seq には、同じトランザクションで進めた User.collection_version を入れる
+    データベースによらず動くよう、未所持の行を所持数 0 で作成（重複は無視）してから、
+    1回の UPDATE で F() に加算する（同時に引いても加算は失われない）
+    """
+    UserCard.objects.bulk_create(
+        [UserCard(user_id=user_id, card_id=card_id) for card_id in amounts],
+        ignore_conflicts=True,
+    )
+    version = get_user_model().objects.filter(pk=user_id).values("collection_version")
+    UserCard.objects.filter(user_id=user_id, card_id__in=list(amounts)).update(
+        amount=F("amount") + Case(
+            *[When(card_id=card_id, then=Value(amount)) for card_id, amount in amounts.items()],
+            default=Value(0),
+        ),
+        seq=Subquery(version),
+    )
@@ -1,13 +1,81 @@
+import datetime
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from pymongo.errors import OperationFailure
 
-from battle.models import BattleRoom
+from battle.models import BattleLogEntry, BattleRoom, BattleRoomStatus
+
+# TTL インデックスを持つドキュメント -> (フィールド, 有効期間の設定名)
+TTL_INDEXES = (
+    (BattleRoom, 'last_activity_at', 'MORISUMMON_BATTLE_ROOM_TTL'),
+    (BattleLogEntry, 'created_at', 'MORISUMMON_BATTLE_LOG_TTL'),
+)
 
 class Command(BaseCommand):
-    help = 'Refresh MongoDB by removing all documents from the rooms collection'
+    help = (
+        'Maintain the rooms collection. Without options, remove all documents. '
+        'With --finished / --stale, remove only the matching rooms. '
+        'With --ensure-indexes alone, only create the indexes declared in BattleRoom.meta and BattleLogEntry.meta '
+        '(automatic index creation is disabled on both, so run this after deploying or changing a TTL setting)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--finished', action='store_true', help='Remove finished rooms')
+        parser.add_argument(
+            '--stale', type=int, metavar='SECONDS',
+            help='Remove rooms with no activity for SECONDS (including rooms without last_activity_at)',
+        )
+        parser.add_argument('--ensure-indexes', action='store_true', help='Create or update the indexes of the rooms and battle log collections')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rooms that would be removed')
 
-    def handle(self, *args, **kwargs):
+    def handle(self, *args, **options):
         try:
-            BattleRoom.objects.delete()
-            self.stdout.write(self.style.SUCCESS('Successfully removed all documents from the rooms collection'))
+            if options['ensure_indexes']:
+                self._ensure_indexes()
+
+            query = self._build_query(options)
+            if query is None:
+                return
+
+            collection = BattleRoom._get_collection()
+            if options['dry_run']:
+                count = collection.count_documents(query)
+                self.stdout.write(f'{count} documents would be removed from the rooms collection')
+                return
+
+            result = collection.delete_many(query)
+            self.stdout.write(self.style.SUCCESS(f'Successfully removed {result.deleted_count} documents from the rooms collection'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error occurred: {e}'))
+
+    def _build_query(self, options) -> dict | None:
+        """削除対象の条件を返す（インデックスの作成のみの場合は None）"""
+        conditions = []
+        if options['finished']:
+            conditions.append({'status': BattleRoomStatus.FINISHED.value})
+        if options['stale'] is not None:
+            cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=options['stale'])
+            conditions.append({'$or': [
+                {'last_activity_at': {'$lt': cutoff}},
+                {'last_activity_at': {'$exists': False}, 'created_at': {'$lt': cutoff}},
+            ]})
+
+        if not conditions:
+            # オプション無しの場合は従来通り全て削除する
+            return None if options['ensure_indexes'] else {}
+        return conditions[0] if len(conditions) == 1 else {'$or': conditions}
+
+    def _ensure_indexes(self):
+        for document, field, setting in TTL_INDEXES:
+            try:
+                document.ensure_indexes()
+            except OperationFailure as e:
+                # TTL の設定を変更した場合は既存の TTL インデックスの有効期間を更新する
+                if e.code != 85:  # IndexOptionsConflict
+                    raise
+                document._get_db().command(
+                    'collMod', document._get_collection_name(),
+                    index={'keyPattern': {field: 1}, 'expireAfterSeconds': getattr(settings, setting)},
+                )
+                document.ensure_indexes()
+            self.stdout.write(self.style.SUCCESS(f'Successfully ensured indexes on {document._get_collection_name()}'))
@@ -0,0 +1,50 @@
+import json
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Dump a snapshot of the request metrics (morisummon.metrics) of a running server. '
+        'Metrics are kept per process, so the snapshot is read from the /metrics endpoint of the worker'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/metrics', help='The /metrics endpoint to read')
+        parser.add_argument('--token', default='', help='Bearer token (MORISUMMON_METRICS_TOKEN)')
+        parser.add_argument('--format', choices=['table', 'json', 'prometheus'], default='table')
+
+    def handle(self, *args, **options):
+        headers = {'Authorization': f"Bearer {options['token']}"} if options['token'] else {}
+        params = {} if options['format'] == 'prometheus' else {'format': 'json'}
+        try:
+            response = requests.get(options['url'], params=params, headers=headers, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise CommandError(f"Could not read {options['url']}: {e}")
+
+        if options['format'] == 'prometheus':
+            self.stdout.write(response.text, ending='')
+            return
+        data = response.json()
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(data, indent=2, ensure_ascii=False))
+            return
+
+        self.stdout.write(
+            f"{'kind':<5} {'name':<40} {'count':>8} {'errors':>7} {'avg ms':>8} {'p50 ms':>8} "
+            f"{'p95 ms':>8} {'p99 ms':>8} {'mongo ms':>9} {'sql ms':>8}"
+        )
+        for row in data['requests']:
+            count = row['count'] or 1
+            self.stdout.write(
+                f"{row['kind']:<5} {row['name'][:40]:<40} {row['count']:>8} {row['errors']:>7} "
+                f"{row['avg_seconds'] * 1000:>8.2f} {row['p50_seconds'] * 1000:>8.2f} "
+                f"{row['p95_seconds'] * 1000:>8.2f} {row['p99_seconds'] * 1000:>8.2f} "
+                f"{row['mongo_seconds'] / count * 1000:>9.2f} {row['sql_seconds'] / count * 1000:>8.2f}"
+            )
+        wait = data['room_lock_wait']
+        self.stdout.write(
+            f"room lock wait: {wait['count']} acquisitions, avg {wait['avg_seconds'] * 1000:.2f} ms, "
+            f"max {wait['max_seconds'] * 1000:.2f} ms"
+        )
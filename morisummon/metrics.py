@@ -0,0 +1,252 @@
+"""
+処理ごとの回数・エラー数・所要時間（ヒストグラム）と、その中で MongoDB / SQL に費やした時間の計測
+
+・記録はスレッドごとの集計（shard）に対してのみ行い、ロックを取らない
+  （asyncio のイベントループ上の処理は1つの shard に、sync_to_async のスレッドはそれぞれの shard に記録される）
+・/metrics（Prometheus のテキスト形式）や dumpmetrics コマンドで取得する時に全ての shard を合算する
+・MongoDB の時間は pymongo のコマンド監視、SQL の時間は Django の execute_wrapper で計測し、
+  実行中の track() に加算する（contextvars で sync_to_async のスレッドにも引き継がれる）
+・集計はプロセスごと。複数のワーカーで動かす場合はワーカーごとに取得する
+"""
+import bisect
+import contextvars
+import threading
+import time
+from django.conf import settings
+from pymongo import monitoring
+
+# 所要時間のヒストグラムの区切り（秒）
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 1処理分の集計（list の位置）
+COUNT, ERRORS, SECONDS, MONGO_SECONDS, SQL_SECONDS, FIRST_BUCKET = range(6)
+
+
+class Timer:
+    """計測中の1件の処理（name を設定した場合は track() に渡した名前の代わりに記録する）"""
+    __slots__ = ("started", "name", "error", "mongo", "sql")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.name: str | None = None
+        self.error = False
+        self.mongo = 0.0
+        self.sql = 0.0
+
+
+_current: contextvars.ContextVar[Timer | None] = contextvars.ContextVar("morisummon_metrics_timer", default=None)
+
+
+class _Tracking:
+    """MetricsRegistry.track() の with 文（ジェネレータを使わず、記録の負荷を小さくする）"""
+    __slots__ = ("registry", "kind", "name", "timer", "token")
+
+    def __init__(self, registry: "MetricsRegistry", kind: str, name: str):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.token = None
+
+    def __enter__(self) -> Timer:
+        self.timer = Timer()
+        if self.registry.enabled:
+            self.token = _current.set(self.timer)
+        return self.timer
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.token is None:
+            return
+        _current.reset(self.token)
+        timer = self.timer
+        if exc_type is not None and issubclass(exc_type, Exception):
+            timer.error = True
+        seconds = time.perf_counter() - timer.started
+        self.registry.observe(self.kind, timer.name or self.name, seconds, timer.error, timer.mongo, timer.sql)
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards: list[dict[tuple[str, str], list]] = []
+        # shard の登録時（スレッドごとに1回）のみ使う
+        self._shards_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, "MORISUMMON_METRICS_ENABLED", True)
+
+    def _shard(self) -> dict[tuple[str, str], list]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False, mongo: float = 0.0, sql: float = 0.0) -> None:
+        shard = self._shard()
+        stat = shard.get((kind, name))
+        if stat is None:
+            stat = shard[(kind, name)] = [0, 0, 0.0, 0.0, 0.0] + [0] * (len(self.buckets) + 1)
+        stat[COUNT] += 1
+        if error:
+            stat[ERRORS] += 1
+        stat[SECONDS] += seconds
+        stat[MONGO_SECONDS] += mongo
+        stat[SQL_SECONDS] += sql
+        stat[FIRST_BUCKET + bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def track(self, kind: str, name: str) -> "_Tracking":
+        """
+        with の中の処理を kind / name ごとに計測する（例外が発生した場合はエラーとして数える）
+        例外以外をエラーとして数える場合は timer.error = True にする
+        """
+        return _Tracking(self, kind, name)
+
+    def collect(self) -> dict[tuple[str, str], list]:
+        """全ての shard を合算する"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        totals: dict[tuple[str, str], list] = {}
+        for shard in shards:
+            # 他のスレッドが書き込み中でも dict.copy() は GIL の下で一度に行われる
+            for key, stat in shard.copy().items():
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = list(stat)
+                else:
+                    for i, value in enumerate(stat):
+                        total[i] += value
+        return totals
+
+    def snapshot(self) -> list[dict]:
+        """合算した結果を処理ごとの dict で返す（パーセンタイルはヒストグラムからの推定）"""
+        result = []
+        for (kind, name), stat in sorted(self.collect().items()):
+            count = stat[COUNT]
+            buckets = stat[FIRST_BUCKET:]
+            result.append({
+                "kind": kind,
+                "name": name,
+                "count": count,
+                "errors": stat[ERRORS],
+                "seconds": stat[SECONDS],
+                "mongo_seconds": stat[MONGO_SECONDS],
+                "sql_seconds": stat[SQL_SECONDS],
+                "avg_seconds": stat[SECONDS] / count if count else 0.0,
+                "p50_seconds": self._quantile(buckets, count, 0.50),
+                "p95_seconds": self._quantile(buckets, count, 0.95),
+                "p99_seconds": self._quantile(buckets, count, 0.99),
+            })
+        return result
+
+    def _quantile(self, buckets: list[int], count: int, q: float) -> float:
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(buckets):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    # 最大の区切りを超えた分は区切りの値とする
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def render_prometheus(self) -> str:
+        """Prometheus のテキスト形式で返す"""
+        from battle.locks import room_locks
+
+        totals = sorted(self.collect().items())
+        lines = [
+            "# HELP morisummon_requests_total Handled requests by kind (http, ws) and view or action name.",
+            "# TYPE morisummon_requests_total counter",
+        ]
+        lines += [f"morisummon_requests_total{_labels(kind, name)} {stat[COUNT]}" for (kind, name), stat in totals]
+        lines += [
+            "# HELP morisummon_request_errors_total Requests that raised or returned a server error.",
+            "# TYPE morisummon_request_errors_total counter",
+        ]
+        lines += [f"morisummon_request_errors_total{_labels(kind, name)} {stat[ERRORS]}" for (kind, name), stat in totals]
+        lines += [
+            "# HELP morisummon_request_duration_seconds Request latency.",
+            "# TYPE morisummon_request_duration_seconds histogram",
+        ]
+        for (kind, name), stat in totals:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), stat[FIRST_BUCKET:]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"morisummon_request_duration_seconds_bucket{_labels(kind, name, le=le)} {cumulative}")
+            lines.append(f"morisummon_request_duration_seconds_sum{_labels(kind, name)} {stat[SECONDS]}")
+            lines.append(f"morisummon_request_duration_seconds_count{_labels(kind, name)} {stat[COUNT]}")
+        lines += [
+            "# HELP morisummon_request_mongo_seconds_total Time spent in MongoDB commands inside requests.",
+            "# TYPE morisummon_request_mongo_seconds_total counter",
+        ]
+        lines += [f"morisummon_request_mongo_seconds_total{_labels(kind, name)} {stat[MONGO_SECONDS]}" for (kind, name), stat in totals]
+        lines += [
+            "# HELP morisummon_request_sql_seconds_total Time spent in SQL queries inside requests.",
+            "# TYPE morisummon_request_sql_seconds_total counter",
+        ]
+        lines += [f"morisummon_request_sql_seconds_total{_labels(kind, name)} {stat[SQL_SECONDS]}" for (kind, name), stat in totals]
+
+        wait = room_locks.wait_stats.snapshot()
+        lines += [
+            "# HELP morisummon_room_lock_wait_seconds Time spent waiting for battle room locks.",
+            "# TYPE morisummon_room_lock_wait_seconds summary",
+            f"morisummon_room_lock_wait_seconds_sum {wait['total_seconds']}",
+            f"morisummon_room_lock_wait_seconds_count {wait['count']}",
+            "# HELP morisummon_room_lock_wait_max_seconds Longest wait for a battle room lock.",
+            "# TYPE morisummon_room_lock_wait_max_seconds gauge",
+            f"morisummon_room_lock_wait_max_seconds {wait['max_seconds']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(kind: str, name: str, **extra: str) -> str:
+    labels = {"kind": kind, "name": name, **extra}
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """MongoDB のコマンドの所要時間を実行中の track() に加算する（mongoengine.connect の event_listeners に渡す）"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        timer = _current.get()
+        if timer is not None:
+            timer.mongo += event.duration_micros / 1e6
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+def sql_execute_wrapper(execute, sql, params, many, context):
+    """SQL の所要時間を実行中の track() に加算する（connection.execute_wrappers に追加する）"""
+    timer = _current.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.sql += time.perf_counter() - started
+
+
+def install_sql_timer(sender, connection, **kwargs):
+    """connection_created シグナルで新しい DB 接続に sql_execute_wrapper を追加する"""
+    if sql_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_execute_wrapper)
+
+
+metrics = MetricsRegistry()
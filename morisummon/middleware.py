@@ -0,0 +1,40 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from morisummon.metrics import metrics
+
+
+class MetricsMiddleware:
+    """
+    HTTP のビューごとの回数・エラー数・所要時間を記録する（morisummon.metrics）
+    ビュー名は URL の view_name（名前の無い URL はビュー関数のパス）で、URL が解決しなかった場合（404 など）は
+    "unresolved" としてまとめて記録する（存在しない URL ごとに集計が増えないようにする）
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with metrics.track("http", "unresolved") as timer:
+            response = self.get_response(request)
+            self._finish(request, response, timer)
+        return response
+
+    async def __acall__(self, request):
+        with metrics.track("http", "unresolved") as timer:
+            response = await self.get_response(request)
+            self._finish(request, response, timer)
+        return response
+
+    @staticmethod
+    def _finish(request, response, timer) -> None:
+        if response.status_code >= 500:
+            timer.error = True
+        # 記録はビューの解決後に分かる名前で行う（track() の終了時に参照される）
+        match = getattr(request, "resolver_match", None)
+        timer.name = match.view_name if match else None
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('morisummon', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='rarity',
+            field=models.CharField(choices=[('common', 'コモン'), ('uncommon', 'アンコモン'), ('rare', 'レア'), ('super_rare', 'スーパーレア')], default='common', max_length=10),
+        ),
+    ]
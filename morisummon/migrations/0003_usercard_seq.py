@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('morisummon', '0002_card_rarity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercard',
+            name='seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='usercard',
+            index=models.Index(fields=['user', 'seq'], name='morisummon__user_id_3f0544_idx'),
+        ),
+    ]
@@ -59,6 +59,14 @@ class Card(models.Model):
     # 技名（攻撃時のログ表示用）
     attack_name = models.CharField(max_length=255, blank=True, null=True)
     pack = models.CharField(max_length=50, blank=True, null=True)
+    # レアリティ（ガチャの排出率の重みは settings.MORISUMMON_GACHA_RARITY_WEIGHTS）
+    RARITY_CHOICES = [
+        ('common', 'コモン'),
+        ('uncommon', 'アンコモン'),
+        ('rare', 'レア'),
+        ('super_rare', 'スーパーレア'),
+    ]
+    rarity = models.CharField(max_length=10, choices=RARITY_CHOICES, default='common')
     # 特性（自由設定）
     ability = models.TextField(blank=True, null=True)
 
@@ -70,9 +78,12 @@ class UserCard(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     card = models.ForeignKey(Card, on_delete=models.CASCADE)
     amount = models.IntegerField(default=0)  # 所持数
+    # 最後に変更された時の User.collection_version（差分の取得に使う）
+    seq = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ('user', 'card')
+        indexes = [models.Index(fields=['user', 'seq'])]
 
 
 class Deck(models.Model):
@@ -80,19 +91,13 @@ class Deck(models.Model):
     card_ids = models.JSONField(default=list)  # JSONField to store the list of cards
 
     def clean(self):
-        card_ids = [None for _ in range(settings.MORISUMMON_DECK_SIZE)]
-
-        for i, card_id in enumerate(self.card_ids):
-            if not isinstance(card_id, int):
-                continue
-
-            try:
-                card = Card.objects.get(pk=card_id)
-                card_ids[i] = card
-            except Card.DoesNotExist:
-                raise ValidationError('存在しないカードが含まれています')
+        # カードは1回のクエリでまとめて取得する（morisummon.decks が models を使うため、ここで読み込む）
+        from .decks import DeckError, load_deck_cards
 
-        self.card_ids = card_ids
+        try:
+            self.card_ids = load_deck_cards(self.card_ids)
+        except DeckError as e:
+            raise ValidationError(e.message)
 
     def __str__(self):
         return f"{self.user.username}'s Deck"
@@ -2,6 +2,7 @@ from django.conf import settings
 from rest_framework import serializers
 from morisummon.models import Card, Deck, ChatMessage, ChatGroup, UserCard, ExchangeSession, Sound
 from accounts.serializers import UserSerializer
+from morisummon.decks import hydrate_deck
 
 class CardSerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,7 +10,7 @@ class CardSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'hp', 'attack', 'image',
             'retreat_cost', 'attack_cost', 'type', 'category',
-            'attack_name', 'pack', 'ability'
+            'attack_name', 'pack', 'rarity', 'ability'
         ]
 
 
@@ -53,18 +54,8 @@ class DeckSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'card_ids', 'cards']
 
     def get_cards(self, obj):
-        ids = obj.card_ids
-
-        cards = [None for _ in range(settings.MORISUMMON_DECK_SIZE)]
-        for i, card in enumerate(ids):
-            if card is not None:
-                try:
-                    card = Card.objects.get(pk=card)
-                    cards[i] = CardSerializer(card).data
-                except Card.DoesNotExist:
-                    pass
-
-        return cards
+        # シリアライズ結果はキャッシュから取得する（存在しないカードは None のまま）
+        return hydrate_deck(obj.card_ids)
 
 ########## 以下はチャット関連の実装 ##########
 class ChatMessageSerializer(serializers.ModelSerializer):
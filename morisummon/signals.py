@@ -1,7 +1,9 @@
 # signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import FriendRequest, Friendship, Notification
+from .card_cache import card_cache
+from .gacha import gacha_tables
+from .models import Card, FriendRequest, Friendship, Notification
 
 
 @receiver(post_save, sender=FriendRequest)
@@ -18,3 +20,10 @@ def create_notification(sender, instance, created, **kwargs):
         Notification.objects.create(user=instance.to_user, message=message)
 
 
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def invalidate_card_caches(sender, instance, **kwargs):
+    # カードの追加・レアリティやパックの変更を排出テーブルに反映する
+    gacha_tables.invalidate()
+    # シリアライズ結果のキャッシュを読み直す
+    card_cache.invalidate()
@@ -1,3 +1,335 @@
-from django.test import TestCase
+import datetime
+import random
+import threading
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from morisummon.collection import record_changes
+from morisummon.decks import DeckError, validate_deck
+from morisummon.gacha import AliasTable, GachaError, gacha_tables, pull
+from morisummon.models import Card, Deck, UserCard
 
-# Create your tests here.
+
+class ConcurrentPullTests(TransactionTestCase):
+    """同じユーザーが同時にガチャを引いても魔石が二重に消費されず、所持数が失われない"""
+
+    THREADS = 8
+
+    def setUp(self):
+        gacha_tables.invalidate()
+        for i in range(3):
+            Card.objects.create(name=f'card{i}', pack='test')
+        self.user = get_user_model().objects.create_user(username='gacha', password='password')
+
+    def tearDown(self):
+        gacha_tables.invalidate()
+
+    def _pull_concurrently(self, count: int, bonus: bool = False) -> tuple[list[int], list[Exception]]:
+        """THREADS 件のガチャを同時に引く（bonus の場合は同時にログインボーナスも受け取る）"""
+        pulled, errors = [], []
+        barrier = threading.Barrier(self.THREADS + (1 if bonus else 0))
+
+        def worker():
+            user = get_user_model().objects.get(pk=self.user.pk)
+            try:
+                barrier.wait()
+                pulled.append(len(pull(user, 'test', count)))
+            except GachaError as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def bonus_worker():
+            # ガチャより先に読み込んだユーザーでボーナスを受け取る
+            user = get_user_model().objects.get(pk=self.user.pk)
+            try:
+                barrier.wait()
+                self.bonus = user.award_login_bonus(datetime.date(2026, 1, 1))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        if bonus:
+            threads.append(threading.Thread(target=bonus_worker))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return pulled, errors
+
+    def test_stones_never_go_negative(self):
+        # 3 回分の魔石しか無い
+        cost = settings.MORISUMMON_GACHA_STONES_PER_CARD * 10
+        get_user_model().objects.filter(pk=self.user.pk).update(magic_stones=cost * 3)
+        pulled, errors = self._pull_concurrently(10)
+
+        self.user.refresh_from_db()
+        self.assertEqual(len(pulled), 3)
+        self.assertEqual(len(errors), self.THREADS - 3)
+        self.assertEqual(self.user.magic_stones, 0)
+        self.assertEqual(sum(UserCard.objects.filter(user=self.user).values_list('amount', flat=True)), 30)
+
+    def test_amounts_add_up(self):
+        get_user_model().objects.filter(pk=self.user.pk).update(magic_stones=1000)
+        pulled, errors = self._pull_concurrently(5)
+
+        self.user.refresh_from_db()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.user.magic_stones, 1000 - settings.MORISUMMON_GACHA_STONES_PER_CARD * 5 * self.THREADS)
+        self.assertEqual(sum(UserCard.objects.filter(user=self.user).values_list('amount', flat=True)), sum(pulled))
+        self.assertEqual(sum(pulled), 5 * self.THREADS)
+
+    def test_login_bonus_during_pulls(self):
+        # ボーナスの付与で、同時に消費された魔石が戻らない
+        get_user_model().objects.filter(pk=self.user.pk).update(magic_stones=1000)
+        start_version = get_user_model().objects.get(pk=self.user.pk).collection_version
+        pulled, errors = self._pull_concurrently(5, bonus=True)
+
+        self.user.refresh_from_db()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.bonus, 10)
+        spent = settings.MORISUMMON_GACHA_STONES_PER_CARD * 5 * self.THREADS
+        self.assertEqual(self.user.magic_stones, 1000 - spent + self.bonus)
+        self.assertEqual(self.user.collection_version, start_version + self.THREADS)
+
+
+@override_settings(MORISUMMON_METRICS_TOKEN='', MORISUMMON_METRICS_TRUST_LOOPBACK=False)
+class MetricsEndpointTests(TestCase):
+    """/metrics はトークンが無い場合スタッフのみ（リバースプロキシ経由の 127.0.0.1 を信用しない）"""
+
+    def test_anonymous_loopback_is_forbidden(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    def test_staff(self):
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='x', is_staff=True))
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.1').status_code, 200)
+
+    def test_non_staff_is_forbidden(self):
+        self.client.force_login(get_user_model().objects.create_user(username='user', password='x'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(MORISUMMON_METRICS_TRUST_LOOPBACK=True)
+    def test_trusted_loopback(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    @override_settings(MORISUMMON_METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class AliasTableTests(SimpleTestCase):
+    """エイリアス法の抽選表は重みに比例した確率で選ぶ"""
+
+    WEIGHTS = [60, 25, 10, 4, 1]
+
+    def _probabilities(self, table: AliasTable) -> list[float]:
+        # 列 i は prob[i] の確率で i 自身、残りで alias[i] を選ぶ（各列は 1/n の確率で選ばれる）
+        n = len(table.items)
+        probabilities = [0.0] * n
+        for i in range(n):
+            probabilities[i] += table._prob[i] / n
+            probabilities[table._alias[i]] += (1 - table._prob[i]) / n
+        return probabilities
+
+    def test_exact_probabilities(self):
+        for weights in (self.WEIGHTS, [1], [1, 1, 1], [0, 5, 0, 1], [0.1, 1000, 3]):
+            table = AliasTable(list(range(len(weights))), weights)
+            for actual, weight in zip(self._probabilities(table), weights):
+                self.assertAlmostEqual(actual, weight / sum(weights))
+
+    def test_sampled_rates(self):
+        # カイ二乗検定（自由度 4、有意水準 0.1% の棄却限界 18.47）
+        table = AliasTable(list(range(len(self.WEIGHTS))), self.WEIGHTS)
+        draws = 100000
+        counts = [0] * len(self.WEIGHTS)
+        for item in table.sample(draws, random.Random(0)):
+            counts[item] += 1
+        expected = [draws * weight / sum(self.WEIGHTS) for weight in self.WEIGHTS]
+        chi_square = sum((count - e) ** 2 / e for count, e in zip(counts, expected))
+        self.assertLess(chi_square, 18.47)
+
+    def test_invalid_weights(self):
+        with self.assertRaises(ValueError):
+            AliasTable([], [])
+        with self.assertRaises(ValueError):
+            AliasTable(['a'], [0])
+
+
+def validate_deck_per_card(user, card_ids: list):
+    """以前の save_deck と同じ、スロットごとに Card と UserCard を取得する検証（エラーの場合は応答の内容を返す）"""
+    if len(card_ids) != 12:
+        return {'error': 'デッキは12枚で構成されている必要があります'}
+    if len(card_ids) != len(set(card_ids)):
+        return {'error': 'duplicate_card', 'message': '同一カードを複数枚デッキに追加することはできません'}
+    filtered_cards = []
+    for card_id in card_ids:
+        if not isinstance(card_id, int):
+            filtered_cards.append(None)
+            continue
+        try:
+            card = Card.objects.get(pk=card_id)
+            UserCard.objects.get(user=user, card=card)
+            filtered_cards.append(card.pk)
+        except Card.DoesNotExist:
+            return {'error': '存在しないカードが含まれています'}
+        except UserCard.DoesNotExist:
+            return {'error': '所有していないカードが含まれています'}
+    return filtered_cards
+
+
+@override_settings(MORISUMMON_DECK_SIZE=12)
+class ValidateDeckTests(TestCase):
+    """まとめて確認する validate_deck は、スロットごとに確認していた以前の検証と同じ結果・エラーを返す"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='deck', password='password')
+        cards = [Card.objects.create(name=f'card{i}') for i in range(16)]
+        self.owned = [card.pk for card in cards[:12]]
+        self.not_owned = [card.pk for card in cards[12:]]
+        for card_id in self.owned:
+            UserCard.objects.create(user=self.user, card_id=card_id, amount=1)
+        self.unknown = [max(self.not_owned) + 1 + i for i in range(4)]
+
+    def _validate(self, card_ids: list):
+        try:
+            return validate_deck(self.user, card_ids)
+        except DeckError as e:
+            return e.to_data()
+
+    def _assert_same(self, card_ids: list):
+        self.assertEqual(self._validate(card_ids), validate_deck_per_card(self.user, card_ids), card_ids)
+
+    def test_valid(self):
+        self._assert_same(self.owned)
+        self._assert_same([None, 'x', 1.5] + self.owned[:9])
+
+    def test_size(self):
+        self._assert_same(self.owned[:11])
+        self._assert_same(self.owned + [self.unknown[0]])
+        # 枚数の確認が重複より先
+        self._assert_same(self.owned[:5] * 3)
+
+    def test_duplicate(self):
+        self._assert_same(self.owned[:11] + self.owned[:1])
+        # 空きスロットが複数ある場合も以前と同じく重複として扱う
+        self._assert_same(self.owned[:10] + [None, None])
+        # 重複の確認が存在・所持より先
+        self._assert_same([self.unknown[0], self.unknown[0]] + self.owned[:10])
+
+    def test_first_bad_slot(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            pool = self.owned + self.not_owned + self.unknown + [None]
+            card_ids = rng.sample(pool, 12)
+            self._assert_same(card_ids)
+
+    def test_unknown_and_not_owned(self):
+        self._assert_same(self.owned[:10] + [self.unknown[0], self.not_owned[0]])
+        self._assert_same(self.owned[:10] + [self.not_owned[0], self.unknown[0]])
+
+    def test_query_count(self):
+        with self.assertNumQueries(2):
+            validate_deck(self.user, self.owned[:10] + [None, 'x'])
+        with self.assertNumQueries(2), self.assertRaises(DeckError):
+            validate_deck(self.user, self.owned[:6] + self.not_owned[:2] + self.unknown[:2] + [None, 'x'])
+
+
+class CollectionTests(TestCase):
+    """所持カードの ETag と差分の取得"""
+
+    def setUp(self):
+        gacha_tables.invalidate()
+        self.cards = [Card.objects.create(name=f'card{i}', pack='test') for i in range(3)]
+        self.user = get_user_model().objects.create_user(username='collection', password='password')
+        get_user_model().objects.filter(pk=self.user.pk).update(magic_stones=10000)
+        self.user.refresh_from_db()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        gacha_tables.invalidate()
+
+    def _changes(self, since, catalog) -> dict:
+        return self.client.get('/api/collection/changes/', {'since': since, 'catalog': catalog}).json()
+
+    def test_etag(self):
+        pull(self.user, 'test', 1)
+        response = self.client.get('/api/collection/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/api/collection/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        pull(self.user, 'test', 1)
+        response = self.client.get('/api/collection/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(sum(row['amount'] for row in response.json()['results']), 2)
+
+    def test_changes_since(self):
+        data = self.client.get('/api/collection/').json()
+        seq, catalog = data['seq'], data['catalog']
+        self.assertEqual(self._changes(seq, catalog), {'seq': seq, 'catalog': catalog, 'resync': False, 'changes': []})
+
+        drawn = pull(self.user, 'test', 1)
+        changes = self._changes(seq, catalog)
+        self.assertFalse(changes['resync'])
+        self.assertGreater(changes['seq'], seq)
+        self.assertEqual([(row['card']['id'], row['amount']) for row in changes['changes']], [(drawn[0].id, 1)])
+
+        # 受け取った seq から続けて取得すると、その後の変更だけを返す
+        seq = changes['seq']
+        self.assertEqual(self._changes(seq, catalog)['changes'], [])
+        drawn = pull(self.user, 'test', 1)
+        changes = self._changes(seq, catalog)
+        self.assertEqual([row['card']['id'] for row in changes['changes']], [drawn[0].id])
+
+    def test_changes_resync(self):
+        data = self.client.get('/api/collection/').json()
+        seq, catalog = data['seq'], data['catalog']
+        self.assertTrue(self.client.get('/api/collection/changes/').json()['resync'])
+        self.assertTrue(self._changes(seq + 1, catalog)['resync'])
+        self.assertTrue(self._changes(seq, catalog + 1)['resync'])
+
+        for card in self.cards[:2]:
+            UserCard.objects.create(user=self.user, card=card, amount=1)
+        record_changes(self.user, [card.id for card in self.cards[:2]])
+        with override_settings(MORISUMMON_COLLECTION_CHANGES_LIMIT=1):
+            self.assertTrue(self._changes(seq, catalog)['resync'])
+        self.assertFalse(self._changes(seq, catalog)['resync'])
+
+
+@override_settings(MORISUMMON_DECK_SIZE=12)
+class CompactDeckTests(TestCase):
+    """?compact=1 のデッキは完全な形式と同じスロットにカードの id を返す"""
+
+    def setUp(self):
+        self.cards = [Card.objects.create(name=f'card{i}') for i in range(12)]
+        self.user = get_user_model().objects.create_user(username='deck', password='password')
+        self.client.force_login(self.user)
+
+    def _deck(self, compact: bool) -> list:
+        if compact:
+            return self.client.get('/api/get-deck/', {'compact': '1'}).json()['deck_card_ids']
+        return [card and card['id'] for card in self.client.get('/api/get-deck/').json()['deck_cards']]
+
+    def test_no_deck(self):
+        self.assertEqual(self._deck(compact=True), [None] * 12)
+
+    def test_deleted_card(self):
+        card_ids = [card.id for card in self.cards[:10]] + [None, None]
+        Deck.objects.create(user=self.user, card_ids=card_ids)
+        self.cards[3].delete()
+        expected = card_ids[:3] + [None] + card_ids[4:]
+        self.assertEqual(self._deck(compact=True), expected)
+        self.assertEqual(self._deck(compact=False), expected)
+
+    def test_oversized_deck(self):
+        # 保存時の検証を経ていない（枚数が変わる前に保存された）デッキでも先頭から規定の枚数だけ返す
+        card_ids = [card.id for card in self.cards] + [self.cards[0].id]
+        Deck.objects.create(user=self.user, card_ids=card_ids)
+        self.assertEqual(self._deck(compact=True), card_ids[:12])
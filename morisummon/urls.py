@@ -6,12 +6,16 @@ urlpatterns = [
 
     ##### デッキ #####
     path('api/get-cards/', views.user_cards, name='user_cards'),
+    path('api/catalog/', views.catalog, name='catalog'),
+    path('api/collection/', views.collection, name='collection'),
+    path('api/collection/changes/', views.collection_changes_view, name='collection_changes'),
     path('api/save-deck/', views.save_deck, name='deck_list'),
     path('api/get-deck/', views.get_deck, name='get_deck'),
     ##### ここまで #####
 
     ##### ガチャ #####
     path('api/gacha/', views.gacha, name='gacha'),
+    path('api/gacha/pull/', views.gacha_pull, name='gacha_pull'),
     ##### ここまで #####
 
     ##### チャット #####
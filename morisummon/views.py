@@ -1,20 +1,32 @@
+import ipaddress
 import json
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from django.contrib.auth import get_user_model, authenticate, login as auth_login, logout
 from django.middleware.csrf import get_token
 from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_GET
 from rest_framework.authtoken.models import Token
 from morisummon.serializers import UserSerializer, ExchangeSessionSerializer, SoundSerializer
 from .models import Card, UserCard, Deck, ChatMessage, ChatGroup, FriendRequest, Notification, ExchangeSession, Sound
-from .serializers import CardSerializer, DeckSerializer
-import random
+from .serializers import DeckSerializer
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from .serializers import ChatMessageSerializer, ChatGroupSerializer
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from morisummon.card_cache import card_cache
+from morisummon.catalog import CATALOG_VERSION_HEADER, catalog_endpoint, catalog_version
+from morisummon.collection import (
+    CollectionPagination, collection_changes, collection_etag, collection_queryset, hydrate_collection, is_not_modified,
+    record_changes,
+)
+from morisummon.decks import DeckError, validate_deck
+from morisummon.gacha import GachaError, pull
+from morisummon.metrics import metrics
 
 
 # Custom User modelを取得
@@ -25,10 +37,41 @@ def index(request):
     return render(request, template_name)
 
 
+def metrics_endpoint(request):
+    """
+    計測結果（morisummon.metrics）を Prometheus のテキスト形式で返す
+    ?format=json の場合は処理ごとの集計（パーセンタイルを含む）を JSON で返す
+    MORISUMMON_METRICS_TOKEN が設定されている場合は Authorization: Bearer <token> が必要
+    設定されていない場合はスタッフのユーザーのみ（MORISUMMON_METRICS_TRUST_LOOPBACK の場合は
+    ループバックアドレスからのリクエストも）に返す
+    """
+    if not metrics.enabled:
+        return HttpResponse(status=404)
+    token = settings.MORISUMMON_METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=401)
+    elif not (request.user.is_staff or (
+        settings.MORISUMMON_METRICS_TRUST_LOOPBACK and _is_loopback(request.META.get('REMOTE_ADDR'))
+    )):
+        return HttpResponse(status=403)
+
+    if request.GET.get('format') == 'json':
+        from battle.locks import room_locks
+        return JsonResponse({'requests': metrics.snapshot(), 'room_lock_wait': room_locks.wait_stats.snapshot()})
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _is_loopback(address: str | None) -> bool:
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def gacha(request):
-    user = request.user
     # パックが指定されているかチェック
     pack = request.query_params.get('pack')
     if not pack:
@@ -36,26 +79,70 @@ def gacha(request):
             {"error": "パックが指定されていません。パックを選択してください。"},
             status=400
         )
+    # 従来通り1度に5枚引く
+    return _pull_gacha(request, pack, 5)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def gacha_pull(request):
+    """
+    まとめて引く（{"pack": "...", "count": 1 | 5 | 10}）
+    魔石の消費と所持カードの加算は1つのトランザクションで行う（morisummon.gacha.pull）
+    """
+    pack = request.data.get('pack')
+    if not pack:
+        return Response(
+            {"error": "パックが指定されていません。パックを選択してください。"},
+            status=400
+        )
+    try:
+        count = int(request.data.get('count', 1))
+    except (TypeError, ValueError):
+        return Response({'error': '回数が正しくありません'}, status=400)
+    return _pull_gacha(request, pack, count)
 
-    required_stones = 10
-    if user.magic_stones < required_stones:
-        return Response({'error': 'ガチャ石が足りません'}, status=400)
 
-    user.magic_stones -= required_stones
-    user.save()
+def _pull_gacha(request, pack, count):
+    user = request.user
+    try:
+        drawn_cards = pull(user, pack, count)
+    except GachaError as e:
+        return Response({'error': e.message}, status=e.status)
 
-    cards = Card.objects.filter(pack=pack)
-    if not cards.exists():
-        return Response({'error': '選択されたパックにカードが存在しません'}, status=404)
+    if _is_compact(request):
+        return _compact_response({'card_ids': [card.id for card in drawn_cards], 'magic_stones': user.magic_stones})
+    return Response({'cards': card_cache.serialize(drawn_cards), 'magic_stones': user.magic_stones})
+
+
+def _is_compact(request):
+    """?compact=1 の場合はカードの内容の代わりに id のみを返す（内容は api/catalog/ から取得する）"""
+    return request.query_params.get('compact') == '1'
 
-    drawn_cards = random.choices(list(cards), k=5)
-    for card in drawn_cards:
-        user_card, created = UserCard.objects.get_or_create(user=user, card=card)
-        user_card.amount += 1
-        user_card.save()
 
-    serializer = CardSerializer(drawn_cards, many=True)
-    return Response({'cards': serializer.data})
+def _compact_response(data):
+    response = Response(data)
+    response[CATALOG_VERSION_HEADER] = catalog_version()
+    return response
+
+
+@require_GET
+def catalog(request):
+    """
+    全カードの一覧を列ごとの配列で返す（morisummon.catalog）
+    ?v=<version> が現在の version と一致する場合は内容が変わらないため、長期間キャッシュさせる
+    """
+    encoded = catalog_endpoint.get()
+    if is_not_modified(request, encoded.etag):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(encoded.body, content_type='application/json')
+    response['ETag'] = encoded.etag
+    if request.GET.get('v') == encoded.version:
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, no-cache'
+    return response
 
 
 @api_view(['GET'])
@@ -63,37 +150,59 @@ def gacha(request):
 def user_cards(request):
     user = request.user
 
-    user_cards = UserCard.objects.filter(user=user)
-    data = [{'card': CardSerializer(uc.card).data, 'amount': uc.amount} for uc in user_cards]
+    # カードは読み込まず、シリアライズ結果をキャッシュから取得する
+    user_cards = list(UserCard.objects.filter(user=user).values_list('card_id', 'amount'))
+    if _is_compact(request):
+        return _compact_response([{'card_id': card_id, 'amount': amount} for card_id, amount in user_cards])
+    cards = card_cache.get_many(card_id for card_id, _ in user_cards)
+    data = [{'card': cards[card_id], 'amount': amount} for card_id, amount in user_cards if card_id in cards]
     return Response(data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def collection(request):
+    """
+    所持カードをページ分割して返す（?pack= / ?type= / ?category= で絞り込み、?cursor= / ?limit= でページ指定）
+    所持カードとカードの内容が変わっていなければ If-None-Match に対して 304 を返す
+    """
+    etag = collection_etag(request.user)
+    if is_not_modified(request, etag):
+        return Response(status=304, headers={'ETag': etag})
+
+    paginator = CollectionPagination()
+    rows = paginator.paginate_queryset(collection_queryset(request.user, request.query_params), request)
+    response = paginator.get_paginated_response(hydrate_collection(rows))
+    # 以降の変更は api/collection/changes/ にこの値を渡して取得する
+    response.data['seq'] = request.user.collection_version
+    response.data['catalog'] = card_cache.version()
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def collection_changes_view(request):
+    """
+    ?since=<seq>&catalog=<catalog> 以降に変更された所持カードだけを返す（morisummon.collection.collection_changes）
+    resync が true の場合は api/collection/ から取得し直す
+    """
+    try:
+        since = int(request.query_params['since'])
+        catalog = int(request.query_params['catalog'])
+    except (KeyError, ValueError):
+        since = catalog = None
+    return Response(collection_changes(request.user, since, catalog))
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def save_deck(request):
     user = request.user
 
-    deck_card_ids = request.data
-    if len(deck_card_ids) != 12:
-        return Response({'error': 'デッキは12枚で構成されている必要があります'}, status=400)
-
-    if len(deck_card_ids) != len(set(deck_card_ids)):
-        return Response({'error': 'duplicate_card', 'message': '同一カードを複数枚デッキに追加することはできません'}, status=400)
-
-    filtered_cards = []
-    for card_id in deck_card_ids:
-        if not isinstance(card_id, int):
-            filtered_cards.append(None)
-            continue
-
-        try:
-            card = Card.objects.get(pk=card_id)
-            UserCard.objects.get(user=user, card=card)
-
-            filtered_cards.append(card.pk)
-        except Card.DoesNotExist:
-            return Response({'error': '存在しないカードが含まれています'}, status=400)
-        except UserCard.DoesNotExist:
-            return Response({'error': '所有していないカードが含まれています'}, status=400)
+    # カードの存在・所持はそれぞれ1回のクエリでまとめて確認する（morisummon.decks）
+    try:
+        filtered_cards = validate_deck(user, request.data)
+    except DeckError as e:
+        return Response(e.to_data(), status=400)
 
     try:
         deck = Deck.objects.filter(user=user).first()
@@ -113,6 +222,16 @@ def get_deck(request):
     user = request.user
 
     deck = Deck.objects.filter(user=user).first()
+    if _is_compact(request):
+        card_ids = deck.card_ids if deck else []
+        # 完全な形式（hydrate_deck）と同じく、削除されたカードのスロットは None にする
+        cards = card_cache.get_many(card_id for card_id in card_ids if card_id is not None)
+        slots = [None for _ in range(settings.MORISUMMON_DECK_SIZE)]
+        for i in range(min(len(card_ids), settings.MORISUMMON_DECK_SIZE)):
+            if card_ids[i] in cards:
+                slots[i] = card_ids[i]
+        return _compact_response({'deck_card_ids': slots})
+
     serialized = DeckSerializer(deck)
 
     try:
@@ -338,18 +457,20 @@ def cancel_exchange(request, exchange_ulid):
     if exchange.proposer != request.user:
         return Response({'error': 'Only the proposer can cancel the exchange'}, status=403)
 
-    if exchange.status == 'proposed' and exchange.proposed_card_id is not None:
-        # 提案済みの場合は、提案者にカードを返す（所持数を１増やす）
-        try:
-            user_card = UserCard.objects.get(user=request.user, card_id=exchange.proposed_card_id)
-            user_card.amount += 1
-            user_card.save()
-        except UserCard.DoesNotExist:
-            # 存在しない場合は新たに作成
-            UserCard.objects.create(user=request.user, card_id=exchange.proposed_card_id, amount=1)
-
-    exchange.status = 'cancelled'
-    exchange.save()
+    with transaction.atomic():
+        if exchange.status == 'proposed' and exchange.proposed_card_id is not None:
+            # 提案済みの場合は、提案者にカードを返す（所持数を１増やす）
+            try:
+                user_card = UserCard.objects.get(user=request.user, card_id=exchange.proposed_card_id)
+                user_card.amount += 1
+                user_card.save()
+            except UserCard.DoesNotExist:
+                # 存在しない場合は新たに作成
+                UserCard.objects.create(user=request.user, card_id=exchange.proposed_card_id, amount=1)
+            record_changes(request.user, [exchange.proposed_card_id])
+
+        exchange.status = 'cancelled'
+        exchange.save()
 
     return Response({'message': 'Exchange cancelled successfully'})
 
@@ -377,16 +498,19 @@ def propose_exchange(request, exchange_ulid):
     # 提案者のカード所持数を１減らす
     try:
         user_card = UserCard.objects.get(user=request.user, card_id=card_id)
-        if user_card.amount <= 0:
-            return Response({'error': 'Insufficient card amount'}, status=400)
-        user_card.amount -= 1
-        user_card.save()
     except UserCard.DoesNotExist:
         return Response({'error': 'User does not have the card'}, status=404)
+    if user_card.amount <= 0:
+        return Response({'error': 'Insufficient card amount'}, status=400)
+
+    with transaction.atomic():
+        user_card.amount -= 1
+        user_card.save()
+        record_changes(request.user, [user_card.card_id])
 
-    exchange.proposed_card_id = card_id
-    exchange.status = 'proposed'
-    exchange.save()
+        exchange.proposed_card_id = card_id
+        exchange.status = 'proposed'
+        exchange.save()
 
     Notification.objects.create(
         user=exchange.receiver,
@@ -422,17 +546,19 @@ def confirm_exchange(request, exchange_ulid):
         return Response({'error': 'Only the receiver can confirm the exchange'}, status=403)
 
     card_id = exchange.proposed_card_id
-    if card_id is not None:
-        receiver_card, created = UserCard.objects.get_or_create(
-            user=request.user,
-            card_id=card_id,
-            defaults={'amount': 0}
-        )
-        receiver_card.amount += 1
-        receiver_card.save()
-
-    exchange.status = 'completed'
-    exchange.save()
+    with transaction.atomic():
+        if card_id is not None:
+            receiver_card, created = UserCard.objects.get_or_create(
+                user=request.user,
+                card_id=card_id,
+                defaults={'amount': 0}
+            )
+            receiver_card.amount += 1
+            receiver_card.save()
+            record_changes(request.user, [card_id])
+
+        exchange.status = 'completed'
+        exchange.save()
 
     Notification.objects.create(
         user=exchange.proposer,